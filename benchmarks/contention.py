@@ -0,0 +1,221 @@
+"""Many simulated clients racing for a few meals, against a local stand-in MealPal with limited inventory.
+
+Run with `python -m benchmarks.contention`. Each trial starts a fresh `mealpy.standin.StandInMealPal` with `--quantity`
+of each meal, logs in our client and every rival, and has them all go for the same restaurant when it opens, each
+with its own strategy and network jitter. It reports which strategies won the meals, and how long before the last
+meal went our client's first reservation arrived, so that retry and burst settings can be tuned offline.
+"""
+import contextlib
+import functools
+import io
+import math
+import random
+import threading
+import time
+from collections import Counter
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from mealpy import mealpy
+from mealpy import standin
+
+CHOICES = ['RestaurantName']
+RESERVATION_TIME = '12:15pm-12:30pm'
+CITY = 'San Francisco'
+# Seconds between the clients starting and the kitchen opening, enough for all of them to prepare
+OPENS_IN = 1.0
+# Seconds after opening that a trial is abandoned
+TRIAL_TIMEOUT = 10.0
+# Seconds before opening that retry loops start firing
+RETRY_LOOP_LEAD = 0.1
+RIVAL_BURST = 4
+OURS = 'ours'
+
+
+class SoldOut(Exception):
+    """Raised by a simulated client's fire once there is nothing left, so its retry loop ends."""
+
+
+class SimulatedMealPal(mealpy.MealPal):
+    """A client of the stand-in whose reservation requests each take up to `jitter` seconds longer to go out."""
+
+    def __init__(self, standin_mealpal, jitter, rng):
+        super().__init__(base_url=standin_mealpal.base_url)
+        self.standin_mealpal = standin_mealpal
+        self.jitter = jitter
+        self.rng = rng
+
+    def fire(self, reserve_data=None):
+        if self.standin_mealpal.sold_out((reserve_data or self.reserve_data)['schedule_id']):
+            raise SoldOut()
+        if self.jitter:
+            time.sleep(self.rng.uniform(0, self.jitter))
+        return super().fire(reserve_data)
+
+
+def run_retry_loop(mealpal, open_at, burst=1, burst_interval=mealpy.DEFAULT_BURST_INTERVAL):
+    """What `mealpy reserve` does, started just before opening: fire again as soon as each attempt fails."""
+    del burst, burst_interval
+    reservations = mealpy.prepare_until_found(mealpal, CHOICES, RESERVATION_TIME, CITY)
+    mealpy.precise_wait(open_at - RETRY_LOOP_LEAD)
+    mealpy.fire_until_success(mealpal, reservations)
+
+
+def run_scheduled(mealpal, open_at, burst=1, burst_interval=mealpy.DEFAULT_BURST_INTERVAL):
+    """What `mealpy schedule` does."""
+    mealpy.execute_scheduled_reservation(
+        mealpal, CHOICES, RESERVATION_TIME, CITY, open_at, sync_clock=False, burst=burst, burst_interval=burst_interval,
+    )
+
+
+def run_late(mealpal, open_at, burst=1, burst_interval=mealpy.DEFAULT_BURST_INTERVAL):
+    """Someone reserving by hand: the menu is only fetched once the kitchen opens."""
+    del burst, burst_interval
+    mealpy.precise_wait(open_at)
+    mealpy.fire_until_success(mealpal, mealpy.prepare_until_found(mealpal, CHOICES, RESERVATION_TIME, CITY))
+
+
+STRATEGIES = {
+    'retry-loop': run_retry_loop,
+    'scheduled': run_scheduled,
+    'burst': functools.partial(run_scheduled, burst=RIVAL_BURST),
+    'late': run_late,
+}
+
+Trial = namedtuple('Trial', 'open_at attempts strategies errors')
+
+
+def parse_rival(_ctx, _param, values):
+    rivals = []
+    for value in values:
+        strategy, _, count = value.partition('=')
+        if strategy not in STRATEGIES or not count.isdigit():
+            raise click.BadParameter(f'{value!r} is not STRATEGY=COUNT, with STRATEGY one of {", ".join(STRATEGIES)}.')
+        rivals.append((strategy, int(count)))
+    return rivals
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile."""
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def run_trial(strategy, tuning, rivals, quantity, latency, jitter, rng):  # pylint: disable=too-many-arguments
+    """Race our client, using `strategy` with `tuning` keyword arguments, against `rivals` for `quantity` meals."""
+    clients = [(OURS, strategy, tuning)]
+    clients += [(f'{name}-{i}', name, {}) for name, count in rivals for i in range(count)]
+    errors = Counter()
+
+    with standin.StandInMealPal(latency=latency, quantity=quantity) as standin_mealpal:
+        mealpals = {
+            name: SimulatedMealPal(standin_mealpal, jitter, random.Random(rng.random())) for name, _, _ in clients
+        }
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            list(executor.map(lambda name: mealpals[name].login(name, 'password'), mealpals))
+
+        open_at = time.time() + OPENS_IN
+        standin_mealpal.open_at = open_at
+
+        def client(name, client_strategy, kwargs):
+            try:
+                STRATEGIES[client_strategy](mealpals[name], open_at, **kwargs)
+            except SoldOut:
+                pass
+            except Exception:  # pylint: disable=broad-except
+                errors[client_strategy] += 1
+
+        threads = [threading.Thread(target=client, args=i, daemon=True) for i in clients]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=max(0.0, open_at + TRIAL_TIMEOUT - time.time()))
+
+    strategies = {f'r:{name}': OURS if name == OURS else client_strategy for name, client_strategy, _ in clients}
+    return Trial(open_at, list(standin_mealpal.attempts), strategies, errors)
+
+
+def our_margin(trial, quantity):
+    """Seconds between our first reservation arriving after opening and the last meal going, if it went.
+
+    Positive when we arrived in time, negative when we were that late.
+    """
+    accepted = [i.received_at for i in trial.attempts if i.error is None]
+    ours = [i.received_at for i in trial.attempts if i.session == f'r:{OURS}' and i.received_at >= trial.open_at]
+    if len(accepted) < quantity or not ours:
+        return None
+    return accepted[-1] - min(ours)
+
+
+@click.command()
+@click.option('--trials', default=5, show_default=True, help='Races to run.')
+@click.option(
+    '--strategy', type=click.Choice(sorted(STRATEGIES)), default='scheduled', show_default=True,
+    help='Our strategy.',
+)
+@click.option('--burst', default=1, show_default=True, help='Our burst attempts, with the scheduled strategy.')
+@click.option(
+    '--burst-interval', default=mealpy.DEFAULT_BURST_INTERVAL, show_default=True,
+    help='Seconds between our burst attempts.',
+)
+@click.option(
+    '--rival', 'rivals', multiple=True, default=['retry-loop=50', 'scheduled=50'], show_default=True,
+    callback=parse_rival, help='STRATEGY=COUNT rivals using STRATEGY.',
+)
+@click.option('--quantity', default=3, show_default=True, help='How many of the meal there are.')
+@click.option('--latency', default=0.02, show_default=True, help='Round trip time to the stand-in, in seconds.')
+@click.option('--jitter', default=0.01, show_default=True, help='Up to how many seconds each reservation is delayed.')
+@click.option('--seed', type=int, help='Seed for the jitter, to repeat a run.')
+def main(trials, strategy, burst, burst_interval, rivals, quantity, latency, jitter, seed):
+    # pylint: disable=too-many-arguments,too-many-locals
+    rng = random.Random(seed)
+    tuning = {'burst': burst, 'burst_interval': burst_interval} if strategy == 'scheduled' else {}
+    clients = Counter({OURS: 1})
+    for name, count in rivals:
+        clients[name] += count
+
+    print(
+        f'{trials} races for {quantity} meals between us ({strategy}'
+        f'{f", burst {burst}" if tuning and burst > 1 else ""}) and '
+        f'{", ".join(f"{count} {name}" for name, count in rivals)}, '
+        f'{latency * 1000:.0f}ms round trip, up to {jitter * 1000:.0f}ms jitter:',
+    )
+
+    wins = Counter()
+    errors = Counter()
+    margins = []
+    unsent = 0
+    sold_out_after = []
+    for _ in range(trials):
+        trial = run_trial(strategy, tuning, rivals, quantity, latency, jitter, rng)
+        accepted = [i for i in trial.attempts if i.error is None]
+        wins.update(trial.strategies[i.session] for i in accepted)
+        errors.update(trial.errors)
+        if len(accepted) == quantity:
+            sold_out_after.append((accepted[-1].received_at - trial.open_at) * 1000)
+        margin = our_margin(trial, quantity)
+        if margin is not None:
+            margins.append(margin * 1000)
+        elif len(accepted) == quantity:
+            unsent += 1
+
+    print(f'{"strategy":>12} {"clients":>8} {"wins":>6} {"win rate":>9} {"errors":>7}')
+    for name, count in clients.items():
+        print(f'{name:>12} {count:8} {wins[name]:6} {wins[name] / (count * trials):9.1%} {errors[name]:7}')
+
+    if sold_out_after:
+        print(f'Sold out {percentile(sold_out_after, 0.5):.1f}ms after opening (p50).')
+    if margins:
+        print(
+            f'Our first reservation arrived before the last meal went by p50 {percentile(margins, 0.5):+.1f}ms, '
+            f'worst {min(margins):+.1f}ms, best {max(margins):+.1f}ms.',
+        )
+    if unsent:
+        print(f'{unsent} of {trials} races were lost before our reservation was even sent.')
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
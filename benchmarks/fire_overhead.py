@@ -0,0 +1,62 @@
+"""Client-side cost of one reservation attempt, with the request built as it is fired or ahead of time.
+
+Run with `python -m benchmarks.fire_overhead`. The session's adapter is swapped for one answering every request with a
+canned response, so the timings are only what `MealPal.fire` spends in Python before and after the network.
+"""
+import statistics
+import time
+
+import requests
+import requests.adapters
+
+from mealpy import mealpy
+
+ATTEMPTS = 20000
+RUNS = 5
+RESERVE_DATA = {'quantity': 1, 'schedule_id': 'mock_schedule_id', 'pickup_time': '12:15pm-12:30pm', 'source': 'Web'}
+
+
+class CannedAdapter(requests.adapters.BaseAdapter):
+    """Answers every request with a 400, without touching the network."""
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        response = requests.Response()
+        response.status_code = 400
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def make_mealpal(hot_send):
+    mealpal = mealpy.MealPal(hot_send=hot_send)
+    mealpal.session.mount('https://', CannedAdapter())
+    mealpal.session.cookies.set('mock_cookie', 'mock_value')
+    return mealpal
+
+
+def microseconds_per_attempt(hot_send):
+    mealpal = make_mealpal(hot_send)
+    if hot_send:
+        mealpal.prepare_request(RESERVE_DATA)
+    durations = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        for _ in range(ATTEMPTS):
+            mealpal.fire(RESERVE_DATA)
+        durations.append((time.perf_counter() - start) / ATTEMPTS * 1e6)
+    return statistics.median(durations)
+
+
+def main():
+    print(f'Median client-side time per attempt over {RUNS} runs of {ATTEMPTS}:')
+    cold = microseconds_per_attempt(hot_send=False)
+    hot = microseconds_per_attempt(hot_send=True)
+    print(f'{"built when fired":>18} {cold:8.1f} us')
+    print(f'{"built ahead":>18} {hot:8.1f} us')
+
+
+if __name__ == '__main__':
+    main()
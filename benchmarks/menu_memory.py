@@ -0,0 +1,70 @@
+"""Memory held by menus as json dicts versus the compact `mealpy.Schedule` model, on synthetic menus.
+
+Run with `python -m benchmarks.menu_memory`. Each menu has restaurants serving a meal on each of several days, spread
+over a few neighborhoods, like a week of a city's menu. Memory is what stays allocated once the menu is built, as
+measured by tracemalloc, so it's what holding the menu costs, e.g. the daemon keeping menus prefetched.
+"""
+import json
+import time
+import tracemalloc
+
+from mealpy import mealpy
+from mealpy import standin
+
+RESTAURANT_COUNTS = (100, 500, 2000)
+DAYS = ('20190401', '20190402', '20190403', '20190404', '20190405')
+NEIGHBORHOODS = 20
+
+
+def make_menu(restaurants):
+    schedules = []
+    for day in DAYS:
+        for i in range(restaurants):
+            schedule = standin.make_schedule(f'schedule_{day}_{i}', f'Restaurant {i}', f'Meal {i}')
+            schedule['date'] = day
+            schedule['meal']['id'] = f'meal_{i}'
+            schedule['restaurant']['id'] = f'restaurant_{i}'
+            schedule['restaurant']['neighborhood'] = {'name': f'Neighborhood {i % NEIGHBORHOODS}', 'id': f'n{i}'}
+            schedules.append(schedule)
+    return json.dumps({'schedules': schedules}).encode()
+
+
+def build_dicts(data):
+    return mealpy.Menu(json.loads(data)['schedules'])
+
+
+def build_compact(data):
+    return mealpy.Menu(mealpy.compact_schedules(json.loads(data)['schedules']))
+
+
+def measure(build, data, runs=3):
+    """Best time to build the menu, in milliseconds, and the memory it holds on to, in megabytes."""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        build(data)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    menu = build(data)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del menu
+
+    return min(durations), retained / 1024 / 1024
+
+
+def main():
+    print(f'{"schedules":>9} {"dict ms":>8} {"dict MB":>8} {"compact ms":>10} {"compact MB":>10} {"saved":>6}')
+    for restaurants in RESTAURANT_COUNTS:
+        data = make_menu(restaurants)
+        dict_ms, dict_mb = measure(build_dicts, data)
+        compact_ms, compact_mb = measure(build_compact, data)
+        print(
+            f'{restaurants * len(DAYS):9} {dict_ms:8.1f} {dict_mb:8.1f} '
+            f'{compact_ms:10.1f} {compact_mb:10.1f} {1 - compact_mb / dict_mb:6.0%}',
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Full versus streaming menu parsing, on synthetic multi-megabyte menus.
+
+Run with `python -m benchmarks.menu_parsing`. Parses from memory, in MENU_CHUNK_SIZE chunks, so only the parsing is
+measured and not the network.
+"""
+import json
+import time
+import tracemalloc
+
+from mealpy import mealpy
+from mealpy import standin
+
+MENU_SIZES = (1000, 5000, 20000)
+# Where on the menu the target schedule is, as a fraction of the way through it
+TARGET_POSITIONS = (0.0, 0.5, 1.0)
+
+
+def make_menu(size):
+    schedules = [standin.make_schedule(f'schedule_{i}', f'Restaurant {i}', f'Meal {i}') for i in range(size)]
+    return json.dumps({'generated_at': '2019-04-01T00:00:00Z', 'schedules': schedules}).encode()
+
+
+def chunked(data):
+    return (data[i:i + mealpy.MENU_CHUNK_SIZE] for i in range(0, len(data), mealpy.MENU_CHUNK_SIZE))
+
+
+def find_full(data, restaurant_name):
+    menu = mealpy.Menu(json.loads(b''.join(chunked(data)))['schedules'])
+    return menu.get_by_restaurant_name(restaurant_name)
+
+
+def find_streaming(data, restaurant_name):
+    for schedule in mealpy.iter_json_array(chunked(data), 'schedules'):
+        if schedule['restaurant']['name'] == restaurant_name:
+            return schedule
+    raise mealpy.ScheduleNotFoundError(restaurant_name)
+
+
+def measure(find, data, restaurant_name, runs=3):
+    """Best time to find the schedule, in milliseconds, and peak memory allocated while doing so, in megabytes."""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        find(data, restaurant_name)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    find(data, restaurant_name)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(durations), peak / 1024 / 1024
+
+
+def main():
+    print(
+        f'{"schedules":>9} {"menu MB":>8} {"target at":>9} '
+        f'{"full ms":>9} {"full MB":>8} {"stream ms":>9} {"stream MB":>9}',
+    )
+    for size in MENU_SIZES:
+        data = make_menu(size)
+        for position in TARGET_POSITIONS:
+            restaurant_name = f'Restaurant {min(int(size * position), size - 1)}'
+            full_ms, full_mb = measure(find_full, data, restaurant_name)
+            stream_ms, stream_mb = measure(find_streaming, data, restaurant_name)
+            print(
+                f'{size:9} {len(data) / 1024 / 1024:8.1f} {position:9.0%} '
+                f'{full_ms:9.1f} {full_mb:8.1f} {stream_ms:9.1f} {stream_mb:9.1f}',
+            )
+
+
+if __name__ == '__main__':
+    main()
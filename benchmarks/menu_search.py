@@ -0,0 +1,50 @@
+"""Fuzzy menu search through `mealpy.MenuIndex`, versus scanning the menu, on synthetic menus.
+
+Run with `python -m benchmarks.menu_search`. Reports the time to build each menu's index, the size of the index as
+persisted, and the median time of a query through the index and through a linear scan of the menu's names.
+"""
+import json
+import statistics
+import time
+
+from mealpy import mealpy
+from benchmarks.menu_parsing import make_menu
+
+MENU_SIZES = (1000, 5000, 20000)
+QUERIES = ('restaurant 123', 'meal 4567', 'restuarant 99', 'served at', 'nothing like it')
+
+
+def scan(schedules, query):
+    query = mealpy.normalize_name(query)
+    return [
+        i['id'] for i in schedules
+        if query in mealpy.normalize_name(i['restaurant']['name']) or query in mealpy.normalize_name(i['meal']['name'])
+    ]
+
+
+def median_ms(func, *args, runs=20):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(*args)
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def main():
+    print(f'{"schedules":>9} {"build ms":>9} {"index MB":>9} {"query":>16} {"index ms":>9} {"scan ms":>8} {"hits":>5}')
+    for size in MENU_SIZES:
+        schedules = json.loads(make_menu(size))['schedules']
+        build_ms = median_ms(mealpy.MenuIndex.build, schedules, runs=3)
+        index = mealpy.MenuIndex.build(schedules)
+        index_mb = len(json.dumps(index.to_json())) / 1024 / 1024
+        for query in QUERIES:
+            print(
+                f'{size:9} {build_ms:9.1f} {index_mb:9.1f} {query:>16} '
+                f'{median_ms(index.search, query):9.3f} {median_ms(scan, schedules, query):8.3f} '
+                f'{len(index.search(query)):5}',
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""End to end time from the kitchen opening to the reservation being accepted, against a local stand-in MealPal.
+
+Run with `python -m benchmarks.reservation_latency`. Each trial starts a fresh `mealpy.standin.StandInMealPal` that
+opens shortly after the client starts, and measures how long after opening the server accepted the reservation.
+"""
+import contextlib
+import io
+import math
+import time
+
+import click
+
+from mealpy import mealpy
+from mealpy import standin
+
+CHOICES = ['RestaurantName']
+RESERVATION_TIME = '12:15pm-12:30pm'
+CITY = 'San Francisco'
+# Seconds between starting a trial and the kitchen opening, enough to log in and prepare
+OPENS_IN = 0.5
+
+
+def run_retry_loop(mealpal, open_at):
+    """What `mealpy reserve` does: start early, and fire again as soon as each attempt fails."""
+    del open_at
+    reservations = mealpy.prepare_until_found(mealpal, CHOICES, RESERVATION_TIME, CITY)
+    mealpy.fire_until_success(mealpal, reservations)
+
+
+def run_scheduled(mealpal, open_at):
+    """What `mealpy schedule` does: fire once, on warm connections, at the opening instant."""
+    mealpy.execute_scheduled_reservation(mealpal, CHOICES, RESERVATION_TIME, CITY, open_at, sync_clock=False)
+
+
+def run_scheduled_cold(mealpal, open_at):
+    """`run_scheduled`, building each reservation request at the moment it is fired instead of ahead of time."""
+    mealpal.hot_send = False
+    run_scheduled(mealpal, open_at)
+
+
+def run_burst(mealpal, open_at):
+    """What `mealpy schedule --burst 4` does."""
+    mealpy.execute_scheduled_reservation(mealpal, CHOICES, RESERVATION_TIME, CITY, open_at, sync_clock=False, burst=4)
+
+
+MODES = {
+    'retry-loop': run_retry_loop,
+    'scheduled': run_scheduled,
+    'scheduled-cold': run_scheduled_cold,
+    'burst': run_burst,
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile."""
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def time_to_reservation(mode, latency):
+    """Seconds from opening until the stand-in accepted a reservation, for one trial of `mode`."""
+    open_at = time.time() + OPENS_IN
+    with standin.StandInMealPal(latency=latency, open_at=open_at) as standin_mealpal:
+        mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+        mealpal.login('username', 'password')
+        with contextlib.redirect_stdout(io.StringIO()):
+            MODES[mode](mealpal, open_at)
+    return standin_mealpal.reserved_at[0] - open_at
+
+
+@click.command()
+@click.option('--trials', default=20, show_default=True, help='Trials per mode.')
+@click.option('--latency', default=0.02, show_default=True, help='Round trip time to the stand-in, in seconds.')
+@click.option('--mode', 'modes', multiple=True, type=click.Choice(sorted(MODES)), help='Modes to run, all by default.')
+def main(trials, latency, modes):
+    print(f'Time to reservation over {trials} trials, {latency * 1000:.0f}ms round trip:')
+    print(f'{"mode":>14} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for mode in modes or MODES:
+        results = [time_to_reservation(mode, latency) * 1000 for _ in range(trials)]
+        print(f'{mode:>14} {percentile(results, 0.5):8.1f} {percentile(results, 0.99):8.1f} {max(results):8.1f}')
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
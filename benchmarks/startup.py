@@ -0,0 +1,124 @@
+"""Cold start cost of the mealpy CLI, measured with `python -X importtime`.
+
+Run with `python -m benchmarks.startup`, which enforces STARTUP_BUDGET_MS. The test suite enforces the looser, but
+machine independent, STARTUP_BUDGET_RATIO, see tests/startup_test.py.
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Cumulative import time allowed for mealpy.mealpy, in milliseconds
+STARTUP_BUDGET_MS = 100
+# The same, as a multiple of the time to import click alone, the one dependency imported up front. Load on the machine
+# slows both down alike, so unlike STARTUP_BUDGET_MS this holds up on a busy CI runner.
+STARTUP_BUDGET_RATIO = 4
+# Top level packages which must only be imported once a command actually needs them
+DEFERRED_PACKAGES = {'aiohttp', 'apscheduler', 'requests', 'ruamel', 'strictyaml', 'urllib3', 'xdg'}
+
+
+def import_times(module='mealpy.mealpy'):
+    """Import `module` in a fresh interpreter, and return the cumulative import time of everything, in microseconds."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=str(ROOT_DIR),
+        stderr=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure_import(runs=5, module='mealpy.mealpy'):
+    """Median cumulative import time of `module`, in milliseconds, after a run to make sure bytecode is cached."""
+    import_times(module)
+    return statistics.median(import_times(module)[module] for _ in range(runs)) / 1000
+
+
+def measure_command(command, runs=5):
+    """Median wall clock time of running `command`, in milliseconds."""
+    durations = []
+    for _ in range(runs + 1):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=str(ROOT_DIR), stdout=subprocess.DEVNULL, check=True)
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations[1:])
+
+
+def measure_compile(runs=5):
+    """Median time to compile mealpy/mealpy.py, in milliseconds.
+
+    Running it as a script pays this on every start, while `python -m mealpy` loads cached bytecode instead.
+    """
+    source = (ROOT_DIR / 'mealpy' / 'mealpy.py').read_text()
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        compile(source, 'mealpy.py', 'exec')
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def measure_config_load(runs=5):
+    """Median wall clock time of a fresh interpreter importing mealpy and loading the config, in milliseconds, without
+    and then with the config snapshot in the cache directory."""
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, XDG_CONFIG_HOME=f'{home}/config', XDG_CACHE_HOME=f'{home}/cache')
+        Path(home, 'config', 'mealpy').mkdir(parents=True)
+        shutil.copyfile(str(ROOT_DIR / 'config.template.yaml'), f'{home}/config/mealpy/config.yaml')
+        snapshot_path = Path(home, 'cache', 'mealpy', 'config.json')
+        command = [sys.executable, '-c', 'from mealpy import mealpy; mealpy.load_config()']
+
+        def run(cold):
+            if cold:
+                snapshot_path.unlink(missing_ok=True)
+            start = time.perf_counter()
+            subprocess.run(command, cwd=str(ROOT_DIR), env=env, check=True)
+            return (time.perf_counter() - start) * 1000
+
+        run(cold=False)
+        cold_ms = statistics.median(run(cold=True) for _ in range(runs))
+        snapshot_ms = statistics.median(run(cold=False) for _ in range(runs))
+    return cold_ms, snapshot_ms
+
+
+def main():
+    times = import_times()
+    slowest = sorted(times.items(), key=lambda i: i[1], reverse=True)[:10]
+
+    print('Slowest imports (cumulative):')
+    for name, cumulative in slowest:
+        print(f'  {cumulative / 1000:8.1f}ms  {name}')
+
+    import_ms = measure_import()
+    click_ms = measure_import(module='click')
+    print(f'\nimport mealpy.mealpy:             {import_ms:6.1f}ms (budget {STARTUP_BUDGET_MS}ms)')
+    print(f'import click:                     {click_ms:6.1f}ms (budget {STARTUP_BUDGET_RATIO}x this)')
+    print(f'compile mealpy/mealpy.py:         {measure_compile():6.1f}ms')
+    print(f'python mealpy/mealpy.py --help:   {measure_command([sys.executable, "mealpy/mealpy.py", "--help"]):6.1f}ms')
+    print(f'python -m mealpy --help:          {measure_command([sys.executable, "-m", "mealpy", "--help"]):6.1f}ms')
+    cold_ms, snapshot_ms = measure_config_load()
+    print(f'import and load_config(), parsed: {cold_ms:6.1f}ms')
+    print(f'import and load_config(), cached: {snapshot_ms:6.1f}ms')
+
+    deferred = sorted({i.split('.')[0] for i in times} & DEFERRED_PACKAGES)
+    if deferred:
+        print(f'\nImported eagerly, but should be deferred: {", ".join(deferred)}')
+    if deferred or import_ms > STARTUP_BUDGET_MS:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
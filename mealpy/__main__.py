@@ -0,0 +1,8 @@
+"""Run the mealpy CLI with `python -m mealpy`.
+
+Unlike running mealpy/mealpy.py as a script, this imports mealpy.mealpy from its cached bytecode instead of compiling
+it on every start.
+"""
+from mealpy.mealpy import cli
+
+cli(prog_name='mealpy')  # pylint: disable=unexpected-keyword-arg
@@ -0,0 +1,132 @@
+"""An asyncio flavour of `mealpy.MealPal`, so one event loop can drive many logins, menu fetches and reservations."""
+import json
+
+import aiohttp
+
+from mealpy.mealpy import BASE_URL
+from mealpy.mealpy import CITIES_PATH
+from mealpy.mealpy import CityCache
+from mealpy.mealpy import compact_schedules
+from mealpy.mealpy import HEADERS
+from mealpy.mealpy import KITCHEN_PATH
+from mealpy.mealpy import LOGIN_PATH
+from mealpy.mealpy import Menu
+from mealpy.mealpy import MENU_PATH
+from mealpy.mealpy import RESERVATION_PATH
+
+# Maximum simultaneous connections per client
+DEFAULT_CONNECTION_LIMIT = 20
+# Seconds allowed for each request, from sending it to reading the whole response
+DEFAULT_TIMEOUT = 10.0
+
+
+class AsyncMealPal:
+    """Same API as `mealpy.MealPal`, with coroutines in place of blocking methods.
+
+    Requests go through one pooled aiohttp session, which is opened by `async with` and closed on exit. Every request
+    is bounded by `timeout` seconds, and raises `asyncio.TimeoutError` past that.
+    """
+
+    def __init__(self, base_url=BASE_URL, limit=DEFAULT_CONNECTION_LIMIT, timeout=DEFAULT_TIMEOUT):
+        self.base_url = base_url
+        self.limit = limit
+        self.timeout = timeout
+        self.session = None
+        self.city_cache = CityCache()
+        self.reserve_data = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            headers=HEADERS,
+            connector=aiohttp.TCPConnector(limit=self.limit),
+            # Also accept cookies from IP addresses, e.g. a local stand-in server
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *_exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.session.close()
+
+    async def login(self, user, password):
+        data = {
+            'username': user,
+            'password': password,
+        }
+        async with self.session.post(self.base_url + LOGIN_PATH, data=json.dumps(data)) as request:
+            request.raise_for_status()
+            return request.status
+
+    async def get_cities(self):
+        """Fetch the cities list, refreshing the city cache."""
+        async with self.session.post(self.base_url + CITIES_PATH) as request:
+            request.raise_for_status()
+            cities = (await request.json(content_type=None))['result']
+        self.city_cache.update(cities)
+        return cities
+
+    async def get_city(self, city_name):
+        if self.city_cache.expired or city_name not in self.city_cache:
+            await self.get_cities()
+        return self.city_cache.get(city_name)
+
+    async def get_schedules(self, city_name, compact=False):
+        city_id = (await self.get_city(city_name))['objectId']
+        async with self.session.get(self.base_url + MENU_PATH.format(city_id)) as request:
+            request.raise_for_status()
+            schedules = (await request.json(content_type=None))['schedules']
+        return Menu(compact_schedules(schedules) if compact else schedules)
+
+    async def get_schedule_by_restaurant_name(self, restaurant_name, city_name):
+        return (await self.get_schedules(city_name)).get_by_restaurant_name(restaurant_name)
+
+    async def get_schedule_by_meal_name(self, meal_name, city_name):
+        return (await self.get_schedules(city_name)).get_by_meal_name(meal_name)
+
+    async def prepare_reservation(self, timing, city_name, restaurant_name=None, meal_name=None):
+        assert restaurant_name or meal_name
+
+        if meal_name:
+            schedule_id = (await self.get_schedule_by_meal_name(meal_name, city_name))['id']
+        else:
+            schedule_id = (await self.get_schedule_by_restaurant_name(restaurant_name, city_name))['id']
+
+        self.reserve_data = {
+            'quantity': 1,
+            'schedule_id': schedule_id,
+            'pickup_time': timing,
+            'source': 'Web',
+        }
+        return self.reserve_data
+
+    async def fire(self, reserve_data=None):
+        reserve_data = reserve_data or self.reserve_data
+        assert reserve_data, 'Call prepare_reservation first.'
+
+        async with self.session.post(self.base_url + RESERVATION_PATH, data=reserve_data) as request:
+            return request.status
+
+    async def reserve_meal(
+            self,
+            timing,
+            city_name,
+            restaurant_name=None,
+            meal_name=None,
+            cancel_current_meal=False,
+    ):  # pylint: disable=too-many-arguments
+        assert restaurant_name or meal_name
+        if cancel_current_meal:
+            await self.cancel_current_meal()
+
+        await self.prepare_reservation(timing, city_name, restaurant_name=restaurant_name, meal_name=meal_name)
+        return await self.fire()
+
+    async def get_current_meal(self):
+        async with self.session.post(self.base_url + KITCHEN_PATH) as request:
+            return await request.json(content_type=None)
+
+    async def cancel_current_meal(self):
+        raise NotImplementedError()
@@ -1,22 +1,43 @@
-import getpass
+# Heavier imports (requests, strictyaml, xdg, apscheduler, ...) are deferred to the functions that need them, since
+# mealpy is usually started just before the kitchen opens, when every millisecond of startup counts.
+import atexit
+import bisect
+import codecs
+import contextlib
+import datetime
+import functools
 import json
+import math
+import re
+import sys
 import time
-from http.cookiejar import MozillaCookieJar
+from collections import defaultdict
+from collections import namedtuple
 from pathlib import Path
-from shutil import copyfile
+from urllib.parse import urlparse
 
 import click
-import requests
-import strictyaml
-import xdg
 
 BASE_DOMAIN = 'secure.mealpal.com'
 BASE_URL = f'https://{BASE_DOMAIN}'
-LOGIN_URL = f'{BASE_URL}/1/login'
-CITIES_URL = f'{BASE_URL}/1/functions/getCitiesWithNeighborhoods'
-MENU_URL = f'{BASE_URL}/api/v1/cities/{{}}/product_offerings/lunch/menu'
-RESERVATION_URL = f'{BASE_URL}/api/v2/reservations'
-KITCHEN_URL = f'{BASE_URL}/1/functions/checkKitchen3'
+LOGIN_PATH = '/1/login'
+CITIES_PATH = '/1/functions/getCitiesWithNeighborhoods'
+MENU_PATH = '/api/v1/cities/{}/product_offerings/lunch/menu'
+RESERVATION_PATH = '/api/v2/reservations'
+KITCHEN_PATH = '/1/functions/checkKitchen3'
+LOGIN_URL = f'{BASE_URL}{LOGIN_PATH}'
+CITIES_URL = f'{BASE_URL}{CITIES_PATH}'
+MENU_URL = f'{BASE_URL}{MENU_PATH}'
+RESERVATION_URL = f'{BASE_URL}{RESERVATION_PATH}'
+KITCHEN_URL = f'{BASE_URL}{KITCHEN_PATH}'
+# Names of the endpoints rate limits are set for, see DEFAULT_RATE_LIMITS
+ENDPOINTS = {
+    'login': LOGIN_PATH,
+    'cities': CITIES_PATH,
+    'menu': MENU_PATH,
+    'reservation': RESERVATION_PATH,
+    'kitchen': KITCHEN_PATH,
+}
 
 HEADERS = {
     'Host': BASE_DOMAIN,
@@ -26,25 +47,238 @@ HEADERS = {
 }
 
 KEYRING_SERVICENAME = BASE_DOMAIN
+# Where passwords come from, see PASSWORD_PROVIDERS. 'prompt' asks on the terminal.
+PASSWORD_SOURCES = ('prompt', 'keyring', 'env', 'fd', 'encrypted_file')
+DEFAULT_PASSWORD_ENV = 'MEALPY_PASSWORD'
+# Environment variable holding the Fernet key of the encrypted_file password source
+PASSWORD_KEY_ENV = 'MEALPY_PASSWORD_KEY'
 
 CONFIG_FILENAME = 'config.yaml'
+CONFIG_SNAPSHOT_FILENAME = 'config.json'
 COOKIES_FILENAME = 'cookies.txt'
+CITIES_FILENAME = 'cities.json'
+MENUS_DIRNAME = 'menus'
+MENU_CACHE_STATS_FILENAME = 'stats.json'
+MENU_INDEX_SUFFIX = '.index.json'
+MENU_CACHE_STATS = ('hits', 'misses', 'bytes_received', 'bytes_saved')
+COOKIES_VALIDATED_FILENAME = 'cookies_validated_at'
+DAEMON_SOCKET_FILENAME = 'daemon.sock'
+DAEMON_TARGETS_FILENAME = 'daemon_targets.json'
+RATE_LIMITS_FILENAME = 'rate_limits.json'
 ROOT_DIR = Path(__file__).resolve().parent.parent
 
+CITY_CACHE_TTL = 24 * 60 * 60
+# Saved cookies validated less than this many seconds ago are trusted without checking them again
+COOKIE_VALIDATION_TTL = 10 * 60
+COOKIE_VALIDATION_TIMEOUT = 3.0
+
+KITCHEN_OPEN_TIME = '17:00:00'
+# Seconds before the kitchen opens to wake up, log in and prepare the reservation
+DEFAULT_LEAD_TIME = 30.0
+# Below this many seconds to go, busy-wait instead of sleeping, since sleep() can overshoot by a few milliseconds
+SPIN_THRESHOLD = 0.005
+# Number of BASE_URL round trips used to estimate MealPal's clock offset and our latency to it
+CLOCK_PROBE_SAMPLES = 5
+
+# Seconds after the kitchen opens to stop retrying failed reservations, e.g. once the meal is sold out
+DEFAULT_RETRY_FOR = 60.0
+
+DEFAULT_BURST_ATTEMPTS = 1
+DEFAULT_BURST_INTERVAL = 0.02
+
+# Keep-alive connections held open per host
+DEFAULT_POOL_SIZE = 10
+# Keep-alive connections opened ahead of firing, and refreshed this many seconds before it
+DEFAULT_WARM_CONNECTIONS = 2
+WARM_REFRESH_AHEAD = 2.0
+
+# Bytes read at a time when streaming a menu
+MENU_CHUNK_SIZE = 16 * 1024
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+# Seconds before the kitchen opens that the daemon fetches the menu
+DAEMON_PREFETCH_AHEAD = 10 * 60
+
+BurstAttempt = namedtuple('BurstAttempt', 'index offset latency status_code')
+Credentials = namedtuple('Credentials', 'email password source')
+# Requests a second, and how many can go out at once after a lull
+RateLimit = namedtuple('RateLimit', 'rate burst')
+Span = namedtuple('Span', 'name start duration')
+
+# Per endpoint, shared by every process using the cache directory. Enough for a burst and a brisk retry loop, not
+# enough to look like a flood. Endpoints not listed aren't limited.
+DEFAULT_RATE_LIMITS = {
+    'reservation': RateLimit(20.0, 10),
+}
+
+
+class Tracer:
+    """Times each phase of a run, for `--trace`.
+
+    Spans are recorded with the monotonic high-resolution clock, from `phase` blocks, `traced` functions and a requests
+    response hook timing each HTTP round trip. Phases nest, so a phase's time includes that of the phases inside it.
+    Does nothing until enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.origin = time.perf_counter()
+
+    def record(self, name, start, duration):
+        self.spans.append(Span(name, start - self.origin, duration))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start)
+
+    def response_hook(self, response, *_args, **_kwargs):
+        if self.enabled:
+            # The hook runs once the response arrives, so the request started `elapsed` ago
+            duration = response.elapsed.total_seconds()
+            name = f'HTTP {response.request.method} {urlparse(response.url).path}'
+            self.record(name, time.perf_counter() - duration, duration)
+
+    def durations(self):
+        durations = defaultdict(list)
+        for span in self.spans:
+            durations[span.name].append(span.duration)
+        return durations
+
+    def report(self, file=None):
+        """Print a per-phase breakdown, slowest first, and a histogram of each phase that ran more than once."""
+        file = file or sys.stderr
+        durations = sorted(self.durations().items(), key=lambda i: sum(i[1]), reverse=True)
+
+        width = max([len('phase')] + [len(name) for name, _ in durations])
+        print(f'\n{"phase":<{width}} {"count":>5} {"total ms":>9} {"mean ms":>8} {"max ms":>8}', file=file)
+        for name, values in durations:
+            print(
+                f'{name:<{width}} {len(values):5} {sum(values) * 1000:9.1f} '
+                f'{sum(values) / len(values) * 1000:8.1f} {max(values) * 1000:8.1f}',
+                file=file,
+            )
+
+        for name, values in durations:
+            if len(values) > 1:
+                print(f'\n{name}', file=file)
+                self.print_histogram(values, file)
+
+    @staticmethod
+    def print_histogram(values, file):
+        """Histogram of durations in power of two millisecond buckets."""
+        buckets = defaultdict(int)
+        for value in values:
+            buckets[max(0, math.ceil(value * 1000) - 1).bit_length()] += 1
+
+        scale = 40 / max(buckets.values())
+        for bucket in range(min(buckets), max(buckets) + 1):
+            upper = 2 ** bucket
+            print(f'  <{upper:>6}ms {buckets[bucket]:5} {"#" * round(buckets[bucket] * scale)}', file=file)
+
+    def write_json_lines(self, path):
+        with open(path, 'w') as f:
+            for span in self.spans:
+                f.write(json.dumps(span._asdict()) + '\n')
+
+
+TRACER = Tracer()
+
+
+def traced(func):
+    """Record each call to `func` as a phase named after it, when tracing."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not TRACER.enabled:
+            return func(*args, **kwargs)
+        with TRACER.phase(func.__qualname__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def load_config_from_file(config_file: Path, schema):
+    import strictyaml
 
-def load_config_from_file(config_file: Path, schema: strictyaml.Map):
     return strictyaml.load(config_file.read_text(), schema).data
 
 
-def load_config():
+def load_batch(batch_path: Path):
+    """Load a reserve-batch file: one reservation per account, each with its own email address and cookies."""
+    import strictyaml
+
     schema = strictyaml.Map({
-        'email_address': strictyaml.Email(),
-        'use_keyring': strictyaml.Bool(),
+        'accounts': strictyaml.Seq(strictyaml.Map({
+            # Used as a directory name, so not . or ..
+            'name': strictyaml.Regex(r'(?!\.+$)[\w.-]+'),
+            'email_address': strictyaml.Email(),
+            'city': strictyaml.Str(),
+            'reservation_time': strictyaml.Str(),
+            strictyaml.Optional('restaurant'): strictyaml.Str(),
+            strictyaml.Optional('meal'): strictyaml.Str(),
+        })),
     })
+    batch = strictyaml.load(batch_path.read_text(), schema).data
+
+    for account in batch['accounts']:
+        if not account.get('restaurant') and not account.get('meal'):
+            raise ValueError(f'Account {account["name"]} in {batch_path} needs a restaurant or a meal.')
+
+    return batch
+
+
+def config_snapshot_key(paths):
+    """What a config snapshot depends on: the mtime, size and hash of each of `paths`, and of this module's source,
+    whose schema they were validated against."""
+    import hashlib
+
+    key = []
+    for path in (*paths, Path(__file__)):
+        stat = path.stat()
+        key.append([str(path), stat.st_mtime_ns, stat.st_size, hashlib.sha1(path.read_bytes()).hexdigest()])
+    return key
+
+
+def load_config_snapshot(snapshot_path, key):
+    try:
+        snapshot = json.loads(snapshot_path.read_text())
+        if snapshot['key'] == key and isinstance(snapshot['config'], dict):
+            return snapshot['config']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def save_config_snapshot(snapshot_path, key, config):
+    try:
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = snapshot_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({'key': key, 'config': config}))
+        tmp_path.replace(snapshot_path)
+    except OSError:
+        pass
+
+
+@traced
+def load_config():
+    """Load the config file over the template's defaults.
+
+    strictyaml is slow to import and parse with, so the validated config is kept as a json snapshot in the cache
+    directory, and only parsed again once the config, the template or mealpy itself changes.
+    """
+    from shutil import copyfile
 
     template_config_path = ROOT_DIR / 'config.template.yaml'
 
-    config_path = xdg.XDG_CONFIG_HOME / 'mealpy' / CONFIG_FILENAME
+    config_path = get_config_dir() / CONFIG_FILENAME
 
     # Create config file if it doesn't already exist
     if not config_path.exists():
@@ -54,185 +288,2055 @@ def load_config():
             f'Please update the email_address field in {config_path} with your email address for MealPal.',
         )
 
+    snapshot_path = get_cache_dir() / CONFIG_SNAPSHOT_FILENAME
+    key = config_snapshot_key([template_config_path, config_path])
+    config = load_config_snapshot(snapshot_path, key)
+    if config is None:
+        with TRACER.phase('parse config'):
+            config = parse_config(template_config_path, config_path)
+        save_config_snapshot(snapshot_path, key, config)
+    return config
+
+
+def parse_config(template_config_path, config_path):
+    import strictyaml
+
+    schema = strictyaml.Map({
+        'email_address': strictyaml.Email(),
+        'use_keyring': strictyaml.Bool(),
+        strictyaml.Optional('city_cache_ttl'): strictyaml.Int(),
+        strictyaml.Optional('cookie_validation_ttl'): strictyaml.Int(),
+        strictyaml.Optional('password_source'): strictyaml.Enum(PASSWORD_SOURCES),
+        strictyaml.Optional('password_env'): strictyaml.Str(),
+        strictyaml.Optional('password_fd'): strictyaml.Int(),
+        strictyaml.Optional('password_file'): strictyaml.Str(),
+        strictyaml.Optional('rate_limits'): strictyaml.MapPattern(
+            strictyaml.Enum(list(ENDPOINTS)),
+            strictyaml.Map({'rate': strictyaml.Float(), strictyaml.Optional('burst'): strictyaml.Int()}),
+        ),
+    })
+
     config = load_config_from_file(template_config_path, schema)
     config.update(load_config_from_file(config_path, schema))
     return config
 
 
+class ScheduleNotFoundError(LookupError):
+    pass
+
+
+def normalize_name(name):
+    """Casefold and collapse whitespace, so near-identical names index together."""
+    return ' '.join(name.casefold().split())
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _Compact:
+    """Base of the compact menu model, whose fields can also be read dict style, like the menu json they came from."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, i) == getattr(other, i) for i in self.__slots__)
+
+    def __hash__(self):
+        return hash((type(self), self.id))  # pylint: disable=no-member
+
+    def __repr__(self):
+        return f'{type(self).__name__}({", ".join(f"{i}={getattr(self, i)!r}" for i in self.__slots__)})'
+
+
+class Meal(_Compact):
+    __slots__ = ('id', 'name', 'cuisine')
+
+    def __init__(self, id, name, cuisine=None):  # pylint: disable=redefined-builtin
+        self.id = id
+        self.name = name
+        self.cuisine = cuisine
+
+    @classmethod
+    def from_dict(cls, meal):
+        return cls(meal.get('id'), _intern(meal['name']), _intern(meal.get('cuisine')))
+
+
+class Restaurant(_Compact):
+    """A restaurant, with its neighborhood and city flattened to their names."""
+
+    __slots__ = ('id', 'name', 'address', 'neighborhood', 'city')
+
+    def __init__(self, id, name, address=None, neighborhood=None, city=None):  # pylint: disable=redefined-builtin
+        # pylint: disable=too-many-arguments
+        self.id = id
+        self.name = name
+        self.address = address
+        self.neighborhood = neighborhood
+        self.city = city
+
+    @classmethod
+    def from_dict(cls, restaurant):
+        return cls(
+            restaurant.get('id'),
+            _intern(restaurant['name']),
+            _intern(restaurant.get('address')),
+            _intern((restaurant.get('neighborhood') or {}).get('name')),
+            _intern((restaurant.get('city') or {}).get('name')),
+        )
+
+
+class Schedule(_Compact):
+    __slots__ = ('id', 'date', 'meal', 'restaurant')
+
+    def __init__(self, id, date, meal, restaurant):  # pylint: disable=redefined-builtin
+        self.id = id
+        self.date = date
+        self.meal = meal
+        self.restaurant = restaurant
+
+
+def compact_schedules(schedules):
+    """Convert schedules from the menu json into `Schedule`s, keeping only the fields mealpy uses.
+
+    Restaurants and meals appearing in several schedules are shared, and names repeated across the menu, such as
+    neighborhoods and cities, are interned. Lookups like `schedule['restaurant']['name']` work on either form.
+    """
+    def shared(cache, cls, data):
+        key = data.get('id')
+        if key is None:
+            return cls.from_dict(data)
+        if key not in cache:
+            cache[key] = cls.from_dict(data)
+        return cache[key]
+
+    restaurants = {}
+    meals = {}
+    return [
+        Schedule(
+            schedule['id'],
+            _intern(schedule.get('date')),
+            shared(meals, Meal, schedule['meal']),
+            shared(restaurants, Restaurant, schedule['restaurant']),
+        )
+        for schedule in schedules
+    ]
+
+
+class Menu:
+    """Schedules from a single MENU_URL fetch, indexed once for O(1) lookups.
+
+    Iterates like the plain list of schedules it wraps, either dicts from the menu json or the compact `Schedule`s. When
+    several schedules share a name, the first one on the menu wins, same as a linear scan would.
+    """
+
+    def __init__(self, schedules, index=None):
+        self.schedules = schedules
+        self._index = index
+        self.by_id = {}
+        self.by_restaurant_name = {}
+        self.by_meal_name = {}
+
+        for schedule in schedules:
+            self.by_id.setdefault(schedule['id'], schedule)
+            self.by_restaurant_name.setdefault(schedule['restaurant']['name'], schedule)
+            self.by_meal_name.setdefault(schedule['meal']['name'], schedule)
+
+        # Restaurant names take precedence over meal names
+        self.by_normalized_name = {normalize_name(k): v for k, v in reversed(list(self.by_meal_name.items()))}
+        self.by_normalized_name.update(
+            (normalize_name(k), v) for k, v in reversed(list(self.by_restaurant_name.items()))
+        )
+
+    def __iter__(self):
+        return iter(self.schedules)
+
+    def __len__(self):
+        return len(self.schedules)
+
+    def __getitem__(self, index):
+        return self.schedules[index]
+
+    @staticmethod
+    def _lookup(index, key, description):
+        try:
+            return index[key]
+        except KeyError:
+            raise ScheduleNotFoundError(f'No schedule found for {description} {key!r}.')
+
+    def get_by_id(self, schedule_id):
+        return self._lookup(self.by_id, schedule_id, 'schedule id')
+
+    def get_by_restaurant_name(self, restaurant_name):
+        return self._lookup(self.by_restaurant_name, restaurant_name, 'restaurant')
+
+    def get_by_meal_name(self, meal_name):
+        return self._lookup(self.by_meal_name, meal_name, 'meal')
+
+    @property
+    def index(self):
+        """The `MenuIndex` of these schedules, built the first time it's needed unless one was given."""
+        if self._index is None:
+            self._index = MenuIndex.build(self.schedules)
+        return self._index
+
+    def find(self, name, fuzzy=False):
+        """Look up a schedule by restaurant or meal name, ignoring case and whitespace differences.
+
+        With `fuzzy`, a name without such a match resolves to the best `search` result instead, if there is one.
+        """
+        try:
+            return self._lookup(self.by_normalized_name, normalize_name(name), 'restaurant or meal')
+        except ScheduleNotFoundError:
+            matches = self.search(name) if fuzzy else None
+            if not matches:
+                raise
+            return matches[0]
+
+    def search(self, query):
+        """Schedules matching `query`, even partly or misspelt, best first, see `MenuIndex.search`."""
+        return [self.by_id[i] for i in self.index.search(query)]
+
+
+_WORD = re.compile(r'\w+')
+# Fraction of a query's trigrams a name needs to share with it to match
+FUZZY_MIN_SCORE = 0.5
+# Weight of a query's words all appearing in a meal description, next to its trigrams all appearing in a name
+FUZZY_DESCRIPTION_WEIGHT = 0.5
+
+
+def trigrams(text):
+    """Trigrams of each word of `text`, padded with a space either side so that word starts and ends count."""
+    return {f' {word} '[i:i + 3] for word in _WORD.findall(text.casefold()) for i in range(len(word))}
+
+
+class MenuIndex:
+    """Inverted index of a menu, from the trigrams of restaurant and meal names, and from the words of meal
+    descriptions, to the positions of the schedules they appear in.
+
+    `ids` holds the schedule ids by position. Built once per menu fetch, and persisted alongside the menu cache with
+    the validators of the menu it was built from, see `MenuCache`.
+    """
+
+    def __init__(self, ids, name_trigrams, description_words):
+        self.ids = ids
+        self.name_trigrams = name_trigrams
+        self.description_words = description_words
+
+    @classmethod
+    def build(cls, schedules):
+        name_trigrams = defaultdict(list)
+        description_words = defaultdict(list)
+        for position, schedule in enumerate(schedules):
+            for trigram in trigrams(f'{schedule["restaurant"]["name"]} {schedule["meal"]["name"]}'):
+                name_trigrams[trigram].append(position)
+            for word in set(_WORD.findall((schedule['meal'].get('description') or '').casefold())):
+                description_words[word].append(position)
+        return cls([i['id'] for i in schedules], dict(name_trigrams), dict(description_words))
+
+    def search(self, query, min_score=FUZZY_MIN_SCORE):
+        """Ids of the schedules matching `query`, best first, and in menu order among equally good matches.
+
+        A schedule scores the share of the query's trigrams found in its restaurant and meal names, which tolerates
+        typos and partial names, or FUZZY_DESCRIPTION_WEIGHT times the share of the query's words found in its meal
+        description, whichever is higher. Shares are weighted by how rare each trigram or word is on the menu, so that
+        words most of the menu has in common count for little. Those scoring under `min_score` are left out.
+        """
+        name_scores = self._match(self.name_trigrams, trigrams(query), min_score)
+        description_scores = self._match(
+            self.description_words, set(_WORD.findall(query.casefold())), min_score / FUZZY_DESCRIPTION_WEIGHT,
+        )
+        scores = {
+            position: max(
+                name_scores.get(position, 0.0), FUZZY_DESCRIPTION_WEIGHT * description_scores.get(position, 0.0),
+            )
+            for position in {*name_scores, *description_scores}
+        }
+        ranked = sorted((-score, position) for position, score in scores.items() if score >= min_score)
+        return [self.ids[position] for _, position in ranked]
+
+    def _match(self, postings, terms, min_share):
+        """Position -> weighted share of `terms` found there, for every position where it could reach `min_share`."""
+        if not terms or not self.ids:
+            return {}
+
+        # Inverse document frequency. Terms on no schedule at all, typically from a typo, weigh as much as the average
+        # term that is on the menu, rather than swamping the rest.
+        weights = {i: math.log((len(self.ids) + 1) / len(postings[i])) for i in terms if i in postings}
+        if not weights:
+            return {}
+        unseen_weight = sum(weights.values()) / len(weights)
+        weights.update((i, unseen_weight) for i in terms if i not in postings)
+        total = sum(weights.values())
+        # Terms on over half the menu are only checked for the positions the rarer terms found, unless they weigh
+        # enough to make a match on their own, which keeps queries fast however common their words are
+        common = {i for i in terms if 2 * len(postings.get(i, ())) > len(self.ids)}
+        if sum(weights[i] for i in common) >= min_share * total:
+            common = set()
+
+        matched = defaultdict(float)
+        for term in terms - common:
+            for position in postings.get(term, ()):
+                matched[position] += weights[term]
+        for term in common:
+            positions = postings[term]
+            for position in matched:
+                found = bisect.bisect_left(positions, position)
+                if found < len(positions) and positions[found] == position:
+                    matched[position] += weights[term]
+
+        return {position: weight / total for position, weight in matched.items()}
+
+    def to_json(self):
+        return {'ids': self.ids, 'name_trigrams': self.name_trigrams, 'description_words': self.description_words}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['ids'], data['name_trigrams'], data['description_words'])
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = re.compile(r'[0-9.eE+-]*')
+_NUMBER_START = '-0123456789'
+
+
+def iter_json_array(chunks, key):
+    """Incrementally parse a json object from an iterable of byte `chunks`, yielding the items of its `key` array.
+
+    Other top-level values are parsed and skipped. Only as many chunks are read as needed for the next item, so a
+    caller can stop iterating as soon as it finds what it's after. Raises ValueError on malformed or truncated json.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+
+    def fill():
+        nonlocal buffer, pos
+        for chunk in chunks:
+            if chunk:
+                # Drop what's been parsed already, so the buffer only ever holds about one item
+                buffer = buffer[pos:] + utf8.decode(chunk)
+                pos = 0
+                return True
+        return False
+
+    def peek():
+        nonlocal pos
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                raise ValueError('Unexpected end of json.')
+
+    def expect(char):
+        nonlocal pos
+        if peek() != char:
+            raise ValueError(f'Expected {char!r} at {buffer[pos:pos + 20]!r}.')
+        pos += 1
+
+    def decode():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # A number running up to the end of the buffer may carry on in the next chunk
+            if buffer[pos] in _NUMBER_START and _NUMBER.match(buffer, end).end() == len(buffer) and fill():
+                continue
+            pos = end
+            return value
+
+    expect('{')
+    while peek() != '}':
+        if peek() == ',':
+            pos += 1
+        name = decode()
+        expect(':')
+        if name != key or peek() != '[':
+            decode()
+            continue
+
+        pos += 1
+        while peek() != ']':
+            if peek() == ',':
+                pos += 1
+            yield decode()
+        return
+
+
+def get_cache_dir():
+    import xdg
+
+    return Path(xdg.XDG_CACHE_HOME) / 'mealpy'
+
+
+def get_config_dir():
+    import xdg
+
+    return Path(xdg.XDG_CONFIG_HOME) / 'mealpy'
+
+
+class CityCache:
+    """City name -> city lookup for CITIES_URL results.
+
+    Kept in memory, and persisted as json to `path` when one is given so later runs can skip CITIES_URL entirely
+    until `ttl` seconds have passed.
+    """
+
+    def __init__(self, path=None, ttl=CITY_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.cities = {}
+        self.fetched_at = None
+
+        if self.path:
+            self.load()
+
+    def __contains__(self, city_name):
+        return city_name in self.cities
+
+    @property
+    def expired(self):
+        return self.fetched_at is None or time.time() - self.fetched_at > self.ttl
+
+    def get(self, city_name):
+        return self.cities.get(city_name)
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text())
+            cities = {i['name']: i for i in data['cities']}
+            fetched_at = float(data['fetched_at'])
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing, corrupt or of some other shape: same as not cached
+            return
+
+        self.cities = cities
+        self.fetched_at = fetched_at
+
+    def update(self, cities):
+        self.cities = {i['name']: i for i in cities}
+        self.fetched_at = time.time()
+
+        if self.path:
+            tmp_path = self.path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps({'fetched_at': self.fetched_at, 'cities': cities}))
+            tmp_path.replace(self.path)
+
+
+class MenuCache:
+    """City objectId -> last MENU_URL response, with its ETag and Last-Modified validators.
+
+    Kept in memory, and persisted as json under the directory `path` when one is given. Responses are revalidated with
+    a conditional GET rather than expiring, so a menu which hasn't changed costs a 304 with no body. `stats` counts
+    304 `hits`, full `misses`, `bytes_received` over the wire and `bytes_saved` against fetching the full,
+    uncompressed menu. Counts are added to those persisted alongside the menus by `flush`, which runs at exit.
+
+    When persisting, a `MenuIndex` is built from each menu cached, and saved next to it, so that a menu revalidated by
+    a 304 comes with its index ready.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.menus = {}
+        self.indexes = {}
+        self.stats = dict.fromkeys(MENU_CACHE_STATS, 0)
+        self.unflushed = dict.fromkeys(MENU_CACHE_STATS, 0)
+
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.stats = self.load_stats()
+            atexit.register(self.flush)
+
+    def get(self, city_id):
+        if city_id not in self.menus and self.path:
+            try:
+                cached = json.loads((self.path / f'{city_id}.json').read_text())
+            except (OSError, ValueError):
+                return None
+            if not isinstance(cached, dict) or not {'schedules', 'size'} <= cached.keys():
+                return None
+            self.menus[city_id] = cached
+        return self.menus.get(city_id)
+
+    def validators(self, city_id):
+        """Conditional request headers for the cached menu of `city_id`, if there is one."""
+        cached = self.get(city_id)
+        if not cached:
+            return {}
+
+        headers = {}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    def hit(self, city_id, response):
+        """Count a 304 `response` for `city_id`, and return the cached schedules."""
+        cached = self.get(city_id)
+        self.record(hits=1, bytes_received=wire_size(response), bytes_saved=cached['size'])
+        return cached['schedules']
+
+    def update(self, city_id, response, schedules):
+        """Cache the `schedules` parsed from a full `response` for `city_id`."""
+        size = len(response.content)
+        received = wire_size(response)
+        cached = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'size': size,
+            'schedules': schedules,
+        }
+        self.record(misses=1, bytes_received=received, bytes_saved=max(0, size - received))
+
+        if not cached['etag'] and not cached['last_modified']:
+            self.indexes[city_id] = None
+            return
+        self.menus[city_id] = cached
+        if self.path:
+            index = self.indexes[city_id] = MenuIndex.build(schedules)
+            self.write(self.path / f'{city_id}.json', cached)
+            self.write(
+                self.path / f'{city_id}{MENU_INDEX_SUFFIX}',
+                {'menu': [cached['etag'], cached['last_modified'], size], **index.to_json()},
+            )
+
+    def get_index(self, city_id):
+        """The `MenuIndex` of the cached menu of `city_id`, if one was built for it."""
+        if city_id not in self.indexes and self.path:
+            cached = self.get(city_id)
+            try:
+                data = json.loads((self.path / f'{city_id}{MENU_INDEX_SUFFIX}').read_text())
+                built_for_cached = cached and data['menu'] == [cached['etag'], cached['last_modified'], cached['size']]
+                self.indexes[city_id] = MenuIndex.from_json(data) if built_for_cached else None
+            except (OSError, ValueError, KeyError, TypeError):
+                self.indexes[city_id] = None
+        return self.indexes.get(city_id)
+
+    def record(self, **counts):
+        for key, value in counts.items():
+            self.stats[key] += value
+            self.unflushed[key] += value
+
+    def load_stats(self):
+        stats = dict.fromkeys(MENU_CACHE_STATS, 0)
+        try:
+            saved = json.loads((self.path / MENU_CACHE_STATS_FILENAME).read_text())
+            stats.update((key, int(saved[key])) for key in MENU_CACHE_STATS if key in saved)
+        except (OSError, ValueError, TypeError):
+            pass
+        return stats
+
+    def flush(self):
+        """Add the counts recorded since the last flush to the persisted stats.
+
+        The saved stats are read again first, so that counts from other processes aren't overwritten.
+        """
+        if not self.path or not any(self.unflushed.values()):
+            return
+
+        stats = self.load_stats()
+        for key, value in self.unflushed.items():
+            stats[key] += value
+        self.write(self.path / MENU_CACHE_STATS_FILENAME, stats)
+        self.stats = stats
+        self.unflushed = dict.fromkeys(MENU_CACHE_STATS, 0)
+
+    @staticmethod
+    def write(path, data):
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(data))
+        tmp_path.replace(path)
+
+
+def wire_size(response):
+    """Bytes of `response` body read off the wire, before any Content-Encoding was decoded."""
+    try:
+        return response.raw.tell()
+    except (AttributeError, OSError):
+        return len(response.content)
+
+
 class MealPal:
 
-    def __init__(self):
+    def __init__(
+            self,
+            cache_dir=None,
+            city_cache_ttl=CITY_CACHE_TTL,
+            base_url=BASE_URL,
+            pool_size=DEFAULT_POOL_SIZE,
+            hot_send=True,
+            rate_limits=None,
+    ):  # pylint: disable=too-many-arguments
+        """With a `cache_dir`, the rate limits' buckets are kept there, shared with other processes, see `TokenBuckets`.
+
+        `rate_limits` maps endpoint names to RateLimits, DEFAULT_RATE_LIMITS by default.
+        """
+        import requests
+        from urllib3.util.request import ACCEPT_ENCODING
+
+        from mealpy.ratelimit import RateLimitedAdapter
+        from mealpy.ratelimit import TokenBuckets
+
+        self.base_url = base_url
         self.session = requests.Session()
         self.session.headers.update(HEADERS)
+        # Every encoding urllib3 can decode: gzip and deflate, and br when a brotli package is installed
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        self.rate_limits = TokenBuckets(
+            DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits,
+            cache_dir / RATE_LIMITS_FILENAME if cache_dir else None,
+        )
+        adapter = RateLimitedAdapter(self.rate_limits, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.hooks['response'].append(TRACER.response_hook)
+        self.city_cache = CityCache(cache_dir / CITIES_FILENAME if cache_dir else None, city_cache_ttl)
+        self.menu_cache = MenuCache(cache_dir / MENUS_DIRNAME if cache_dir else None)
+        self.reserve_data = None
+        self.hot_send = hot_send
+        self.prepared_requests = {}
+        self.send_settings = {}
 
+    @traced
     def login(self, user, password):
         data = {
             'username': user,
             'password': password,
         }
-        request = self.session.post(LOGIN_URL, data=json.dumps(data))
+        request = self.session.post(self.base_url + LOGIN_PATH, data=json.dumps(data))
 
         request.raise_for_status()
+        # They carry the cookies of the previous session
+        self.prepared_requests.clear()
 
         return request.status_code
 
+    @traced
     def get_cities(self):
-        request = self.session.post(CITIES_URL)
+        """Fetch the cities list, refreshing the city cache."""
+        request = self.session.post(self.base_url + CITIES_PATH)
         request.raise_for_status()
-        return request.json()['result']
+        cities = request.json()['result']
+        self.city_cache.update(cities)
+        return cities
 
+    @traced
     def get_city(self, city_name):
-        city = next((i for i in self.get_cities() if i['name'] == city_name), None)
-        return city
+        if self.city_cache.expired or city_name not in self.city_cache:
+            self.get_cities()
+        return self.city_cache.get(city_name)
 
-    def get_schedules(self, city_name):
+    @traced
+    def get_schedules(self, city_name, compact=False):
+        """Fetch the menu, or revalidate the cached one, see `MenuCache`.
+
+        With `compact`, the menu holds `Schedule`s rather than the json dicts, which takes much less memory when menus
+        are kept around, see `compact_schedules`.
+        """
         city_id = self.get_city(city_name)['objectId']
-        request = self.session.get(MENU_URL.format(city_id))
-        request.raise_for_status()
-        return request.json()['schedules']
+        return self._read_menu(city_id, self._request_menu(city_id), compact)
 
-    def get_schedule_by_restaurant_name(self, restaurant_name, city_name):
-        restaurant = next(
-            i
-            for i in self.get_schedules(city_name)
-            if i['restaurant']['name'] == restaurant_name
+    def _request_menu(self, city_id, **kwargs):
+        return self.session.get(
+            self.base_url + MENU_PATH.format(city_id), headers=self.menu_cache.validators(city_id), **kwargs,
         )
-        return restaurant
+
+    def _read_menu(self, city_id, request, compact):
+        if request.status_code == 304:
+            schedules = self.menu_cache.hit(city_id, request)
+        else:
+            request.raise_for_status()
+            with TRACER.phase('parse menu'):
+                schedules = request.json()['schedules']
+            self.menu_cache.update(city_id, request, schedules)
+
+        return Menu(compact_schedules(schedules) if compact else schedules, index=self.menu_cache.get_index(city_id))
+
+    @traced
+    def fetch_all_menus(self, city_names=None, workers=DEFAULT_POOL_SIZE, compact=True):
+        """Fetch the menus of `city_names`, or of every city, returning city name -> `Menu` in name order.
+
+        The cities list is fetched once at most, then up to `workers` menus are fetched at a time, so that a sweep
+        takes about as long as the slowest menu rather than all of them added up. Menus are compact by default, see
+        `get_schedules`.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self.city_cache.expired or any(i not in self.city_cache for i in city_names or ()):
+            self.get_cities()
+        city_ids = {i: self.city_cache.get(i)['objectId'] for i in sorted(city_names or self.city_cache.cities)}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(self._request_menu, city_id) for name, city_id in city_ids.items()}
+            # Menus are parsed here, one at a time, while the rest are still downloading
+            return {
+                name: self._read_menu(city_ids[name], future.result(), compact) for name, future in futures.items()
+            }
+
+    def iter_schedules(self, city_name, chunk_size=MENU_CHUNK_SIZE):
+        """Stream the menu's schedules, parsing them as they arrive rather than once the whole menu is downloaded.
+
+        Closing the generator early closes the response without reading the rest of it. An unchanged menu is read from
+        the menu cache instead, though streamed menus aren't added to it.
+        """
+        city_id = self.get_city(city_name)['objectId']
+        request = self._request_menu(city_id, stream=True)
+        with request:
+            if request.status_code == 304:
+                yield from self.menu_cache.hit(city_id, request)
+                return
+            request.raise_for_status()
+            yield from iter_json_array(request.iter_content(chunk_size), 'schedules')
+
+    @traced
+    def find_schedule(self, city_name, restaurant_name=None, meal_name=None, name=None):
+        """Look a schedule up by streaming the menu, stopping as soon as it's found.
+
+        A `name` is matched against restaurant and meal names the way `Menu.find` does. Since restaurant names take
+        precedence, a meal name match is only returned once the rest of the menu has no restaurant by that name.
+        """
+        assert restaurant_name or meal_name or name
+        if name:
+            return self._find_schedule_by_name(city_name, name)
+        key, name = ('meal', meal_name) if meal_name else ('restaurant', restaurant_name)
+
+        schedules = self.iter_schedules(city_name)
+        try:
+            for schedule in schedules:
+                if schedule[key]['name'] == name:
+                    return schedule
+        finally:
+            schedules.close()
+
+        raise ScheduleNotFoundError(f'No schedule found for {key} {name!r}.')
+
+    def _find_schedule_by_name(self, city_name, name):
+        normalized = normalize_name(name)
+        meal_match = None
+
+        schedules = self.iter_schedules(city_name)
+        try:
+            for schedule in schedules:
+                if normalize_name(schedule['restaurant']['name']) == normalized:
+                    return schedule
+                if meal_match is None and normalize_name(schedule['meal']['name']) == normalized:
+                    meal_match = schedule
+        finally:
+            schedules.close()
+
+        if meal_match is None:
+            raise ScheduleNotFoundError(f'No schedule found for restaurant or meal {name!r}.')
+        return meal_match
+
+    def get_schedule_by_restaurant_name(self, restaurant_name, city_name):
+        return self.get_schedules(city_name).get_by_restaurant_name(restaurant_name)
 
     def get_schedule_by_meal_name(self, meal_name, city_name):
-        return next(i for i in self.get_schedules(city_name) if i['meal']['name'] == meal_name)
+        return self.get_schedules(city_name).get_by_meal_name(meal_name)
 
-    def reserve_meal(
+    @traced
+    def prepare_reservation(
             self,
             timing,
             city_name,
             restaurant_name=None,
             meal_name=None,
-            cancel_current_meal=False,
+            menu=None,
+            stream=False,
     ):  # pylint: disable=too-many-arguments
+        """Resolve the schedule and build the reservation payload ahead of time, for `fire` to send later.
+
+        The schedule is looked up in `menu` if given, e.g. one shared between accounts, instead of fetching the menu.
+        With `stream`, the menu is streamed and parsing stops at the schedule, see `find_schedule`.
+        """
         assert restaurant_name or meal_name
-        if cancel_current_meal:
-            self.cancel_current_meal()
 
-        if meal_name:
+        if stream:
+            schedule_id = self.find_schedule(city_name, restaurant_name=restaurant_name, meal_name=meal_name)['id']
+        elif menu is not None:
+            schedule = menu.get_by_meal_name(meal_name) if meal_name else menu.get_by_restaurant_name(restaurant_name)
+            schedule_id = schedule['id']
+        elif meal_name:
             schedule_id = self.get_schedule_by_meal_name(meal_name, city_name)['id']
         else:
             schedule_id = self.get_schedule_by_restaurant_name(restaurant_name, city_name)['id']
 
-        reserve_data = {
+        self.reserve_data = {
             'quantity': 1,
             'schedule_id': schedule_id,
             'pickup_time': timing,
             'source': 'Web',
         }
+        if self.hot_send:
+            self.prepare_request(self.reserve_data)
+        return self.reserve_data
+
+    @traced
+    def prepare_reservations(self, timing, city_name, choices, menu=None, fuzzy=False):
+        """Resolve several restaurant or meal names, in order of preference, against a single menu fetch.
+
+        Names are matched the way `Menu.find` does, with `fuzzy` passed on. Returns the payloads of the choices on the
+        menu, best first, and makes the best one the default for `fire`.
+        """
+        menu = self.get_schedules(city_name) if menu is None else menu
+        reservations = []
+        schedule_ids = set()
+
+        for choice in choices:
+            try:
+                schedule = menu.find(choice, fuzzy=fuzzy)
+            except ScheduleNotFoundError:
+                continue
+            if fuzzy and normalize_name(choice) not in menu.by_normalized_name:
+                print(f'Taking {choice!r} to mean {schedule["meal"]["name"]} at {schedule["restaurant"]["name"]}.')
+            schedule_id = schedule['id']
+            if schedule_id not in schedule_ids:
+                schedule_ids.add(schedule_id)
+                reservations.append({
+                    'quantity': 1,
+                    'schedule_id': schedule_id,
+                    'pickup_time': timing,
+                    'source': 'Web',
+                })
 
-        request = self.session.post(RESERVATION_URL, data=reserve_data)
+        if not reservations:
+            raise ScheduleNotFoundError(f'None of {", ".join(map(repr, choices))} are on the menu.')
+
+        self.reserve_data = reservations[0]
+        if self.hot_send:
+            for reserve_data in reservations:
+                self.prepare_request(reserve_data)
+        return reservations
+
+    def prepare_request(self, reserve_data):
+        """Build the reservation request for `reserve_data`, encoded and with the session's headers and cookies, for
+        `fire` to send as is."""
+        import requests
+
+        url = self.base_url + RESERVATION_PATH
+        prepared = self.session.prepare_request(requests.Request('POST', url, data=reserve_data))
+        self.send_settings = self.session.merge_environment_settings(url, {}, None, None, None)
+        self.prepared_requests[tuple(sorted(reserve_data.items()))] = prepared
+        return prepared
+
+    @traced
+    def fire(self, reserve_data=None):
+        """Send only the reservation request, using the payload from `prepare_reservation` by default.
+
+        With `hot_send`, the request built for the payload by `prepare_request` is sent as is, rather than encoding the
+        payload, merging in the session's headers and cookies and looking up proxy settings again on every attempt.
+        """
+        reserve_data = reserve_data or self.reserve_data
+        assert reserve_data, 'Call prepare_reservation first.'
+
+        prepared = self.prepared_requests.get(tuple(sorted(reserve_data.items()))) if self.hot_send else None
+        if prepared is None:
+            request = self.session.post(self.base_url + RESERVATION_PATH, data=reserve_data)
+        else:
+            request = self.session.send(prepared, **self.send_settings)
         return request.status_code
 
+    @traced
+    def reserve_meal(
+            self,
+            timing,
+            city_name,
+            restaurant_name=None,
+            meal_name=None,
+            cancel_current_meal=False,
+    ):  # pylint: disable=too-many-arguments
+        assert restaurant_name or meal_name
+        if cancel_current_meal:
+            self.cancel_current_meal()
+
+        self.prepare_reservation(timing, city_name, restaurant_name=restaurant_name, meal_name=meal_name)
+        return self.fire()
+
+    def _connection_pools(self):
+        """urllib3 connection pools for `base_url`'s host, of which there may be several with different TLS settings."""
+        host = urlparse(self.base_url).hostname
+        pools = self.session.get_adapter(self.base_url).poolmanager.pools
+        return [pools[key] for key in pools.keys() if key.key_host == host]
+
+    def connections_opened(self):
+        """Total connections opened to `base_url`'s host so far. Unchanged across a request means it reused one."""
+        return sum(pool.num_connections for pool in self._connection_pools())
+
+    def idle_connections(self):
+        return sum(
+            1
+            for pool in self._connection_pools()
+            for connection in list(pool.pool.queue)
+            if connection is not None
+        )
+
+    @traced
+    def warm_up(self, connections=DEFAULT_WARM_CONNECTIONS):
+        """Open, or refresh, `connections` keep-alive connections to `base_url` with concurrent HEAD requests.
+
+        DNS, TCP and TLS setup is then already done by the time a reservation goes out on one of them.
+        Returns the number of idle connections left in the pool.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            for future in [executor.submit(self.session.head, self.base_url) for _ in range(connections)]:
+                future.result()
+        return self.idle_connections()
+
+    @traced
+    def validate_cookies(self, timeout=COOKIE_VALIDATION_TIMEOUT):
+        """Check the session is logged in, with the cheapest authenticated request there is."""
+        import requests
+
+        try:
+            request = self.session.post(self.base_url + KITCHEN_PATH, timeout=timeout)
+            request.raise_for_status()
+            return 'error' not in request.json()
+        except (requests.RequestException, ValueError):
+            return False
+
+    @traced
     def get_current_meal(self):
-        request = self.session.post(KITCHEN_URL)
+        request = self.session.post(self.base_url + KITCHEN_PATH)
         return request.json()
 
     def cancel_current_meal(self):
         raise NotImplementedError()
 
 
-def get_mealpal_credentials():
+class CredentialsNotFoundError(LookupError):
+    pass
+
+
+def password_from_keyring(email, _config):
+    try:
+        import keyring
+    except ImportError:
+        raise CredentialsNotFoundError('The keyring password source needs the keyring package installed.')
+
+    password = keyring.get_password(KEYRING_SERVICENAME, email)
+    if password is None:
+        raise CredentialsNotFoundError(f'No password for {email} in the keyring.')
+    return password
+
+
+def password_from_env(_email, config):
+    import os
+
+    name = config.get('password_env', DEFAULT_PASSWORD_ENV)
+    if not os.environ.get(name):
+        raise CredentialsNotFoundError(f'No password in the environment variable {name}.')
+    return os.environ[name]
+
+
+_fd_passwords = {}
+
+
+def password_from_fd(_email, config):
+    """Read the password from the file descriptor `password_fd`, e.g. a pipe from a secrets manager, up to the first
+    newline. It's kept, so that later logins in the same run don't need the descriptor again."""
+    import os
+
+    if 'password_fd' not in config:
+        raise CredentialsNotFoundError('The fd password source needs password_fd set in the config.')
+    fd = config['password_fd']
+    if fd not in _fd_passwords:
+        data = b''
+        try:
+            while b'\n' not in data:
+                chunk = os.read(fd, 4096)
+                if not chunk:
+                    break
+                data += chunk
+        except OSError as e:
+            raise CredentialsNotFoundError(f'Could not read a password from file descriptor {fd}: {e}')
+        _fd_passwords[fd] = data.partition(b'\n')[0].decode()
+    if not _fd_passwords[fd]:
+        raise CredentialsNotFoundError(f'No password on file descriptor {fd}.')
+    return _fd_passwords[fd]
+
+
+def password_from_encrypted_file(_email, config):
+    """Decrypt the password in the file `password_file` with the Fernet key in the PASSWORD_KEY_ENV environment
+    variable."""
+    import os
+
+    try:
+        from cryptography.fernet import Fernet
+        from cryptography.fernet import InvalidToken
+    except ImportError:
+        raise CredentialsNotFoundError('The encrypted_file password source needs the cryptography package installed.')
+
+    if 'password_file' not in config or not os.environ.get(PASSWORD_KEY_ENV):
+        raise CredentialsNotFoundError(
+            'The encrypted_file password source needs password_file set in the config, '
+            f'and the key in {PASSWORD_KEY_ENV}.',
+        )
+    path = Path(config['password_file']).expanduser()
+    try:
+        return Fernet(os.environ[PASSWORD_KEY_ENV].encode()).decrypt(path.read_bytes()).decode()
+    except (OSError, ValueError, InvalidToken) as e:
+        raise CredentialsNotFoundError(f'Could not decrypt the password in {path}: {e!r}')
+
+
+PASSWORD_PROVIDERS = {
+    'keyring': password_from_keyring,
+    'env': password_from_env,
+    'fd': password_from_fd,
+    'encrypted_file': password_from_encrypted_file,
+}
+
+
+def get_password_source(config):
+    return config.get('password_source') or ('keyring' if config.get('use_keyring') else 'prompt')
+
+
+def get_mealpal_credentials(email=None, interactive=True):
+    """Get the password of `email`, or of the configured email address, from the configured password source.
+
+    Falls back on prompting for it when the source has none, unless not `interactive` or not run from a terminal, in
+    which case a click.ClickException is raised right away rather than waiting on a prompt nobody will answer.
+    """
+    import getpass
+
     config = load_config()
-    email = config['email_address']
-    password = getpass.getpass('Enter password: ')
-    return email, password
+    prompt = 'Enter password: ' if email is None else f'Enter password for {email}: '
+    email = email or config['email_address']
+    source = get_password_source(config)
+
+    if source != 'prompt':
+        try:
+            return Credentials(email, PASSWORD_PROVIDERS[source](email, config), source)
+        except CredentialsNotFoundError as e:
+            if not interactive or not sys.stdin.isatty():
+                raise click.ClickException(str(e))
+            print(f'{e} Falling back on asking for it.')
+    elif not interactive:
+        raise click.ClickException('Logging in unattended needs a password_source other than prompt in the config.')
+
+    return Credentials(email, getpass.getpass(prompt), 'prompt')
+
+
+def store_keyring_password(email, password):
+    try:
+        import keyring
+    except ImportError:
+        print('Install the keyring package to keep the password in the keyring, as use_keyring asks.')
+        return
+    keyring.set_password(KEYRING_SERVICENAME, email, password)
+    print(f'Saved the password of {email} to the keyring.')
+
+
+def get_rate_limits(config):
+    """DEFAULT_RATE_LIMITS, with the endpoints set in the config's rate_limits overridden."""
+    rate_limits = dict(DEFAULT_RATE_LIMITS)
+    for endpoint, limit in config.get('rate_limits', {}).items():
+        burst = rate_limits[endpoint].burst if endpoint in rate_limits else 1
+        rate_limits[endpoint] = RateLimit(limit['rate'], limit.get('burst', burst))
+    return rate_limits
+
+
+def get_cookies_path(account=None):
+    """Where the cookies of `account`, or of the default account, are saved."""
+    cache_dir = get_cache_dir()
+    if not account:
+        return cache_dir / COOKIES_FILENAME
+
+    (cache_dir / account).mkdir(parents=True, exist_ok=True)
+    return cache_dir / account / COOKIES_FILENAME
 
 
-def initialize_mealpal():
-    cookies_path = xdg.XDG_CACHE_HOME / 'mealpy' / COOKIES_FILENAME
-    mealpal = MealPal()
+@traced
+def initialize_mealpal(account=None, email=None, pool_size=DEFAULT_POOL_SIZE):
+    """Log in to MealPal, reusing saved cookies when they're still valid.
+
+    For an `account` other than the default one, cookies are kept in their own directory under the cache directory,
+    and `email` is logged in instead of the configured email address.
+    """
+    from http.cookiejar import MozillaCookieJar
+
+    import requests
+
+    cache_dir = get_cache_dir()
+    cookies_path = get_cookies_path(account)
+    config = load_config()
+    mealpal = MealPal(
+        cache_dir=cache_dir,
+        city_cache_ttl=config.get('city_cache_ttl', CITY_CACHE_TTL),
+        pool_size=pool_size,
+        rate_limits=get_rate_limits(config),
+    )
     mealpal.session.cookies = MozillaCookieJar()
 
+    validated_path = cookies_path.with_name(COOKIES_VALIDATED_FILENAME)
+    validation_ttl = config.get('cookie_validation_ttl', COOKIE_VALIDATION_TTL)
+
     if cookies_path.exists():
         try:
-            mealpal.session.cookies.load(cookies_path, ignore_expires=True, ignore_discard=True)
+            with TRACER.phase('load cookies'):
+                mealpal.session.cookies.load(cookies_path, ignore_expires=True, ignore_discard=True)
         except UnicodeDecodeError:
             pass
         else:
-            # hacky way of validating cookies
-            sleep_duration = 1
-            for _ in range(5):
-                try:
-                    mealpal.get_schedules('San Francisco')
-                except requests.HTTPError:
-                    # Possible fluke, retry validation
-                    print(f'Login using cookies failed, retrying after {sleep_duration} second(s).')
-                    time.sleep(sleep_duration)
-                    sleep_duration *= 2
-                else:
-                    print('Login using cookies successful!')
-                    return mealpal
+            try:
+                validated_at = float(validated_path.read_text())
+            except (OSError, ValueError):
+                validated_at = 0
+
+            if time.time() - validated_at < validation_ttl:
+                print('Using recently validated cookies.')
+                return mealpal
+            if mealpal.validate_cookies():
+                validated_path.write_text(str(time.time()))
+                print('Login using cookies successful!')
+                return mealpal
 
         print('Existing cookies are invalid, please re-enter your login credentials.')
 
     while True:
-        email, password = get_mealpal_credentials()
+        credentials = get_mealpal_credentials(email)
 
         try:
-            mealpal.login(email, password)
+            mealpal.login(credentials.email, credentials.password)
         except requests.HTTPError:
+            if credentials.source != 'prompt':
+                raise click.ClickException(f'The password from the {credentials.source} password source was refused.')
             print('Invalid login credentials, please try again!')
         else:
             break
 
+    if credentials.source == 'prompt' and config.get('use_keyring'):
+        store_keyring_password(credentials.email, credentials.password)
+
     # save latest cookies
     print(f'Login successful! Saving cookies as {cookies_path}.')
     mealpal.session.cookies.save(cookies_path, ignore_discard=True, ignore_expires=True)
+    validated_path.write_text(str(time.time()))
 
     return mealpal
 
 
 def initialize_directories():
     """Mkdir all directories mealpy uses."""
-    cache = Path(xdg.XDG_CACHE_HOME) / 'mealpy'
-    config = Path(xdg.XDG_CONFIG_HOME) / 'mealpy'
+    cache = get_cache_dir()
+    config = get_config_dir()
 
     for i in (cache, config):
         i.mkdir(parents=True, exist_ok=True)
 
 
 @click.group()
-def cli():
+@click.option('--trace', is_flag=True, help='Time each phase of the run, and print a breakdown at exit.')
+@click.option(
+    '--trace-file', type=click.Path(dir_okay=False, writable=True),
+    help='Write the timings of --trace to this file as json lines instead.',
+)
+def cli(trace, trace_file):
     initialize_directories()
 
+    if trace or trace_file:
+        TRACER.enabled = True
+        if trace_file:
+            atexit.register(TRACER.write_json_lines, trace_file)
+        else:
+            atexit.register(TRACER.report)
 
-# SCHEDULER = BlockingScheduler()
-# @SCHEDULER.scheduled_job('cron', hour=16, minute=59, second=58)
-def execute_reserve_meal(restaurant, reservation_time, city):
-    mealpal = initialize_mealpal()
 
+def next_occurrence(clock_time, now=None):
+    """Return the next local datetime, after `now`, at which the wall clock reads `clock_time` (HH:MM:SS)."""
+    now = now or datetime.datetime.now()
+    target = datetime.datetime.combine(now.date(), datetime.time.fromisoformat(clock_time))
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return target
+
+
+def nearest_occurrence(clock_time, now=None):
+    """Return the local datetime nearest to `now`, before or after it, at which the wall clock reads `clock_time`."""
+    now = now or datetime.datetime.now()
+    return next_occurrence(clock_time, now - datetime.timedelta(hours=12))
+
+
+@traced
+def precise_wait(target):
+    """Block until the epoch timestamp `target`.
+
+    Sleeps for the bulk of the wait against the monotonic high-resolution clock, then spins for the last
+    SPIN_THRESHOLD seconds.
+    """
+    deadline = time.perf_counter() + (target - time.time())
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        if remaining > SPIN_THRESHOLD:
+            time.sleep(remaining - SPIN_THRESHOLD)
+
+
+class ServerClock:
+    """Estimate of MealPal's clock offset from ours, and of the round trip time to it.
+
+    The HTTP Date header only has one second resolution, so a single probe only pins the offset down to a window a bit
+    over a second wide. Probes are spread across a second and their windows intersected to narrow that down. The RTT
+    is the minimum seen, since that's the sample least inflated by queueing.
+    """
+
+    def __init__(self):
+        self.offset = 0.0
+        self.rtt = 0.0
+
+    @traced
+    def probe(self, session, samples=CLOCK_PROBE_SAMPLES, url=BASE_URL):
+        from email.utils import parsedate_to_datetime
+
+        lower, upper = float('-inf'), float('inf')
+        fallback_offset = None
+
+        for i in range(samples):
+            if i:
+                time.sleep(1 / samples)
+
+            sent_at = time.time()
+            start = time.perf_counter()
+            response = session.head(url)
+            rtt = time.perf_counter() - start
+
+            if i == 0 or rtt < self.rtt:
+                self.rtt = rtt
+            if 'Date' not in response.headers:
+                continue
+
+            # The server read its clock somewhere between our send and receive, and Date truncates it to the second
+            server_time = parsedate_to_datetime(response.headers['Date']).timestamp()
+            lower = max(lower, server_time - (sent_at + rtt))
+            upper = min(upper, server_time + 1 - sent_at)
+            if rtt == self.rtt:
+                fallback_offset = server_time + 0.5 - (sent_at + rtt / 2)
+
+        if lower <= upper < float('inf'):
+            self.offset = (lower + upper) / 2
+        elif fallback_offset is not None:
+            # Windows don't overlap, e.g. the server clock was stepped mid-probe. Trust the fastest round trip.
+            self.offset = fallback_offset
+
+        return self
+
+    @property
+    def send_ahead(self):
+        """Seconds to send early by, so a request arrives when it's meant to rather than half a round trip late."""
+        return self.rtt / 2
+
+    def estimated_server_now(self):
+        return time.time() + self.offset
+
+    def send_time(self, server_time):
+        """Local epoch timestamp to send at, for a request to arrive at the server's epoch timestamp `server_time`."""
+        return server_time - self.offset - self.send_ahead
+
+
+@traced
+def prepare_until_found(
+        mealpal,
+        choices,
+        reservation_time,
+        city,
+        stream=False,
+        menu=None,
+        give_up_at=None,
+        fuzzy=False,
+):  # pylint: disable=too-many-arguments
+    """Resolve the restaurant or meal names in `choices`, best first, into reservation payloads.
+
+    A single choice can be found by streaming the menu, see `MealPal.find_schedule`, unless it's `fuzzy`. A prefetched
+    `menu` is tried first, and the menu is fetched again if none of `choices` are on it. Raises ScheduleNotFoundError
+    if none of them are on the menu by the epoch timestamp `give_up_at`.
+    """
     while True:
         try:
-            status_code = mealpal.reserve_meal(
-                reservation_time,
-                restaurant_name=restaurant,
-                city_name=city,
-            )
+            if stream and not fuzzy and len(choices) == 1 and menu is None:
+                menu = Menu([mealpal.find_schedule(city, name=choices[0])])
+            return mealpal.prepare_reservations(reservation_time, city, choices, menu=menu, fuzzy=fuzzy)
+        except ScheduleNotFoundError:
+            if give_up_at is not None and time.time() >= give_up_at:
+                raise
+            if menu is None:
+                print('Retrying...')
+                time.sleep(0.05)
+            menu = None
+
+
+@traced
+def fire_until_success(mealpal, reservations=None, give_up_at=None):
+    """Fire until a reservation succeeds, moving on to the next of `reservations` after each failure.
+
+    After the last one, it starts over from the first. Returns the payload of the successful reservation, or None if
+    the epoch timestamp `give_up_at` passes first. At least one attempt is always made.
+    """
+    reservations = reservations or [mealpal.reserve_data]
+    while True:
+        for reserve_data in reservations:
+            status_code = mealpal.fire(reserve_data)
             if status_code == 200:
                 print('Reservation success!')
-                # print('Leave this script running to reschedule again the next day!')
-                break
+                return reserve_data
+            if give_up_at is not None and time.time() >= give_up_at:
+                print('Reservation error, giving up.')
+                return None
+            print('Reservation error, retrying!')
+
+
+@traced
+def burst_fire(mealpal, target, attempts, interval=DEFAULT_BURST_INTERVAL):
+    """Fire the prepared reservation `attempts` times concurrently, `interval` seconds apart, centered on `target`.
+
+    Each attempt runs in its own thread, so a slow response doesn't hold up the next one, and attempts that haven't
+    been sent yet are dropped as soon as one succeeds. Returns a BurstAttempt per attempt, with the offset from
+    `target` it was sent at and its latency. Dropped attempts have all three as None.
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+
+    reserved = threading.Event()
+    first = target - (attempts - 1) * interval / 2
+
+    def attempt(index):
+        precise_wait(first + index * interval)
+        if reserved.is_set():
+            return BurstAttempt(index, None, None, None)
+
+        sent_at = time.time()
+        start = time.perf_counter()
+        try:
+            status_code = mealpal.fire()
+        except requests.RequestException:
+            status_code = None
+        latency = time.perf_counter() - start
+
+        if status_code == 200:
+            reserved.set()
+        return BurstAttempt(index, sent_at - target, latency, status_code)
+
+    with ThreadPoolExecutor(max_workers=attempts) as executor:
+        return list(executor.map(attempt, range(attempts)))
+
+
+@traced
+def execute_search(query, city_names=None):
+    mealpal = initialize_mealpal()
+    menus = mealpal.fetch_all_menus(city_names)
+
+    found = False
+    for city_name, menu in menus.items():
+        for schedule in menu.search(query):
+            found = True
+            print(f'{city_name}: {schedule["restaurant"]["name"]} - {schedule["meal"]["name"]}')
+    if not found:
+        print(f'Nothing matching {query!r} on the menus of {len(menus)} cities.')
+
+
+def execute_reserve_meal(choices, reservation_time, city, stream=False, fuzzy=False):
+    mealpal = initialize_mealpal()
+
+    # Resolve the schedules once, so each attempt below is a single request
+    reservations = prepare_until_found(mealpal, choices, reservation_time, city, stream=stream, fuzzy=fuzzy)
+    fire_until_success(mealpal, reservations)
+
+
+@traced
+def execute_scheduled_reservation(
+        mealpal,
+        choices,
+        reservation_time,
+        city,
+        target,
+        sync_clock=True,
+        burst=DEFAULT_BURST_ATTEMPTS,
+        burst_interval=DEFAULT_BURST_INTERVAL,
+        warm_connections=DEFAULT_WARM_CONNECTIONS,
+        menu=None,
+        give_up_at=None,
+):  # pylint: disable=too-many-arguments
+    """Prepare the reservation, then fire it at the epoch timestamp `target` and report how close we got.
+
+    `choices` are restaurant or meal names in order of preference, looked up on the prefetched `menu` if given. The
+    best one on the menu is fired at `target`, and after that the rest are tried in turn until one succeeds, or until
+    the epoch timestamp `give_up_at`, which also bounds waiting for `choices` to appear on the menu. Returns the payload
+    of the successful reservation, or None.
+
+    With `sync_clock`, `target` is taken to be in MealPal's clock, and the request is sent early enough to land on it.
+    With a `burst` above 1, that many attempts are fired concurrently around `target`, see `burst_fire`.
+    Unless `warm_connections` is 0, at least that many connections (and one per burst attempt) are opened ahead of
+    time, and refreshed WARM_REFRESH_AHEAD seconds before firing.
+    """
+    reservations = prepare_until_found(mealpal, choices, reservation_time, city, menu=menu, give_up_at=give_up_at)
+
+    if sync_clock:
+        clock = ServerClock().probe(mealpal.session, url=mealpal.base_url)
+        print(
+            f'Server clock offset {clock.offset * 1000:+.1f}ms, round trip {clock.rtt * 1000:.1f}ms, '
+            f'sending {clock.send_ahead * 1000:.1f}ms early.',
+        )
+        target = clock.send_time(target)
+
+    if warm_connections:
+        warm_connections = max(warm_connections, burst)
+        mealpal.warm_up(warm_connections)
+        precise_wait(target - (burst - 1) * burst_interval / 2 - WARM_REFRESH_AHEAD)
+        idle = mealpal.warm_up(warm_connections)
+        print(f'{idle} warm connection(s) ready.')
+
+    connections_opened = mealpal.connections_opened()
+    if burst > 1:
+        results = burst_fire(mealpal, target, burst, burst_interval)
+        for result in results:
+            if result.offset is None:
+                print(f'Attempt {result.index}: dropped.')
             else:
-                print('Reservation error, retrying!')
-        except IndexError:
-            print('Retrying...')
-            time.sleep(0.05)
+                print(
+                    f'Attempt {result.index}: sent {result.offset * 1000:+.1f}ms from target, '
+                    f'status {result.status_code} after {result.latency * 1000:.1f}ms.',
+                )
+        reserved = any(i.status_code == 200 for i in results)
+    else:
+        precise_wait(target)
+        sent_at = time.time()
+        reserved = mealpal.fire() == 200
+        print(f'Reservation sent {(sent_at - target) * 1000:+.1f}ms from target.')
+
+    new_connections = mealpal.connections_opened() - connections_opened
+    if new_connections:
+        print(f'Firing had to open {new_connections} new connection(s).')
+    else:
+        print('Firing reused warm connections.')
+
+    if reserved:
+        print('Reservation success!')
+        return reservations[0]
+
+    print('Reservation error, retrying!')
+    return fire_until_success(mealpal, reservations[1:] + reservations[:1], give_up_at=give_up_at)
+
+
+def prepare_batch(mealpals, accounts):
+    """Prepare every account's reservation, fetching each city's menu only once, with the first account in that city.
+
+    Returns the (account, mealpal) pairs whose reservation was found on the menu.
+    """
+    menus = {}
+    prepared = []
+
+    for account in accounts:
+        mealpal = mealpals[account['name']]
+        city = account['city']
+        if city not in menus:
+            menus[city] = mealpal.get_schedules(city, compact=True)
+
+        try:
+            mealpal.prepare_reservation(
+                account['reservation_time'],
+                city,
+                restaurant_name=account.get('restaurant'),
+                meal_name=account.get('meal'),
+                menu=menus[city],
+            )
+        except ScheduleNotFoundError as e:
+            print(f'{account["name"]}: {e} Skipping.')
+        else:
+            prepared.append((account, mealpal))
+
+    return prepared
+
+
+@traced
+def execute_batch_reservation(mealpals, accounts, target, sync_clock=True, retry_for=DEFAULT_RETRY_FOR):
+    """Prepare all accounts' reservations from shared menus, then fire them all concurrently at `target`.
+
+    Failed reservations are retried for up to `retry_for` seconds after `target`.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    prepared = prepare_batch(mealpals, accounts)
+    if not prepared:
+        return
+
+    if sync_clock:
+        mealpal = prepared[0][1]
+        target = ServerClock().probe(mealpal.session, url=mealpal.base_url).send_time(target)
+
+    def fire(account, mealpal):
+        precise_wait(target - WARM_REFRESH_AHEAD)
+        mealpal.warm_up(1)
+        precise_wait(target)
+        if fire_until_success(mealpal, give_up_at=target + retry_for):
+            print(f'{account["name"]}: reserved.')
+        else:
+            print(f'{account["name"]}: not reserved.')
+
+    with ThreadPoolExecutor(max_workers=len(prepared)) as executor:
+        for future in [executor.submit(fire, *i) for i in prepared]:
+            future.result()
+
+
+def run_once_at(run_date, func, args=(), kwargs=None):
+    """Sleep until the datetime `run_date`, then call `func`, by way of an APScheduler job."""
+    from apscheduler.events import EVENT_JOB_ERROR
+    from apscheduler.events import EVENT_JOB_EXECUTED
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    scheduler = BlockingScheduler()
+    scheduler.add_job(func, 'date', run_date=run_date, args=args, kwargs=kwargs, misfire_grace_time=None)
+    scheduler.add_listener(lambda _event: scheduler.shutdown(wait=False), EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+    scheduler.start()
+
+
+def get_wake_time(open_at, lead_time):
+    target = next_occurrence(open_at)
+    wake_at = max(target - datetime.timedelta(seconds=lead_time), datetime.datetime.now())
+    print(f'Waiting until {wake_at} to reserve, kitchen opens at {target}.')
+    return wake_at, target
+
+
+class Daemon:
+    """Keeps one logged in `MealPal` around, and reserves its targets every time the kitchen opens on their days.
+
+    Targets are named reservations, each with `choices` in order of preference, a `reservation_time`, a `city` and the
+    `days` of the week to reserve on. They're saved to `targets_path`, and changed while running through the control
+    socket at `socket_path`, see `send_daemon_command`. Since an account holds one meal a day, targets sharing a day
+    are tried in name order until one is reserved.
+
+    Every `refresh_interval` seconds, cookies are validated, which also keeps the session alive, and saved again.
+    Should they no longer be valid, it logs in again, with the password from the configured password source.
+    `prefetch_ahead` seconds before opening, the menus of the targets' cities are fetched. `lead_time` seconds before
+    opening, the day's targets are reserved by `execute_scheduled_reservation`, with `reservation_kwargs`, retrying
+    for up to `retry_for` seconds after opening. Both jobs work on the opening nearest to when they run, so that one
+    running late still goes for that day's opening rather than the next day's.
+    """
+
+    def __init__(
+            self,
+            mealpal,
+            cookies_path,
+            targets_path,
+            socket_path,
+            open_at=KITCHEN_OPEN_TIME,
+            lead_time=DEFAULT_LEAD_TIME,
+            prefetch_ahead=DAEMON_PREFETCH_AHEAD,
+            refresh_interval=COOKIE_VALIDATION_TTL,
+            retry_for=DEFAULT_RETRY_FOR,
+            reservation_kwargs=None,
+    ):  # pylint: disable=too-many-arguments
+        import threading
+
+        self.mealpal = mealpal
+        self.cookies_path = cookies_path
+        self.targets_path = targets_path
+        self.socket_path = socket_path
+        self.open_at = open_at
+        self.lead_time = lead_time
+        self.prefetch_ahead = prefetch_ahead
+        self.refresh_interval = refresh_interval
+        self.retry_for = retry_for
+        self.reservation_kwargs = reservation_kwargs or {}
+
+        self.lock = threading.Lock()
+        self.targets = self.load_targets()
+        self.menus = {}
+        self.cookies_valid = True
+        self.last_reservation = None
+        self.scheduler = None
+
+    def load_targets(self):
+        try:
+            return json.loads(self.targets_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def save_targets(self):
+        tmp_path = self.targets_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.targets, indent=2))
+        tmp_path.replace(self.targets_path)
+
+    def todays_targets(self, opening):
+        """The targets to reserve when the kitchen opens at the datetime `opening`, in the order to try them."""
+        weekday = WEEKDAYS[opening.weekday()]
+        with self.lock:
+            return [(name, dict(target)) for name, target in sorted(self.targets.items()) if weekday in target['days']]
+
+    def refresh_cookies(self):
+        import requests
+
+        try:
+            self.cookies_valid = self.mealpal.validate_cookies()
+        except requests.RequestException:
+            return
+
+        if self.cookies_valid:
+            self.save_cookies()
+        else:
+            self.log_in_again()
+
+    def save_cookies(self):
+        self.mealpal.session.cookies.save(self.cookies_path, ignore_discard=True, ignore_expires=True)
+        self.cookies_path.with_name(COOKIES_VALIDATED_FILENAME).write_text(str(time.time()))
+
+    def log_in_again(self):
+        """Log in again unattended, with the password from the configured password source."""
+        import requests
+
+        try:
+            credentials = get_mealpal_credentials(interactive=False)
+            self.mealpal.login(credentials.email, credentials.password)
+        except click.ClickException as e:
+            print(f'Cookies are no longer valid, and logging in again failed: {e.message}')
+            return
+        except requests.RequestException as e:
+            print(f'Cookies are no longer valid, and logging in again failed: {e}')
+            return
+
+        self.cookies_valid = True
+        self.save_cookies()
+        print('Cookies were no longer valid, logged in again.')
+
+    def prefetch(self):
+        import requests
+
+        targets = self.todays_targets(nearest_occurrence(self.open_at))
+        self.menus = {}
+        for city in sorted({target['city'] for _, target in targets}):
+            try:
+                self.menus[city] = self.mealpal.get_schedules(city, compact=True)
+            except (requests.RequestException, TypeError) as e:
+                print(f'Could not prefetch the menu of {city}: {e}')
+
+        for name, target in targets:
+            if target['city'] in self.menus:
+                menu = self.menus[target['city']]
+                found = [i for i in target['choices'] if normalize_name(i) in menu.by_normalized_name]
+                print(f'{name}: {", ".join(found) if found else "nothing"} on the menu so far.')
+
+    def reserve(self):
+        import requests
 
-# SCHEDULER.start()
+        opening = nearest_occurrence(self.open_at)
+        menus, self.menus = self.menus, {}
+        for name, target in self.todays_targets(opening):
+            print(f'Reserving {name}.')
+            try:
+                reserved = execute_scheduled_reservation(
+                    self.mealpal,
+                    target['choices'],
+                    target['reservation_time'],
+                    target['city'],
+                    opening.timestamp(),
+                    menu=menus.get(target['city']),
+                    give_up_at=opening.timestamp() + self.retry_for,
+                    **self.reservation_kwargs,
+                )
+            except (requests.RequestException, ScheduleNotFoundError) as e:
+                print(f'Reserving {name} failed: {e}')
+                continue
+
+            if reserved:
+                self.last_reservation = {'target': name, 'reserved_at': time.time(), **reserved}
+                return
+
+    def handle(self, request):
+        """Carry out one control socket request, returning the response."""
+        command = request.get('command')
+
+        if command == 'status':
+            job = self.scheduler.get_job('reserve') if self.scheduler else None
+            return {
+                'targets': len(self.targets),
+                'cookies_valid': self.cookies_valid,
+                'prefetched_menus': sorted(self.menus),
+                'next_wake_up': str(job.next_run_time) if job else None,
+                'last_reservation': self.last_reservation,
+                'menu_cache': self.mealpal.menu_cache.stats,
+            }
+        if command == 'list':
+            with self.lock:
+                return {'targets': dict(self.targets)}
+        if command == 'set':
+            target = {
+                'choices': list(request['choices']),
+                'reservation_time': str(request['reservation_time']),
+                'city': str(request['city']),
+                'days': list(request.get('days') or WEEKDAYS[:5]),
+            }
+            if not target['choices'] or not set(target['days']) <= set(WEEKDAYS):
+                raise ValueError(f'A target needs at least one choice, and days among {", ".join(WEEKDAYS)}.')
+            with self.lock:
+                self.targets[str(request['name'])] = target
+                self.save_targets()
+                return {'targets': dict(self.targets)}
+        if command == 'remove':
+            with self.lock:
+                if self.targets.pop(request['name'], None) is None:
+                    raise ValueError(f'No target named {request["name"]}.')
+                self.save_targets()
+                return {'targets': dict(self.targets)}
+        if command == 'stop':
+            self.scheduler.shutdown(wait=False)
+            return {'stopping': True}
+
+        raise ValueError(f'Unknown command {command!r}.')
+
+    def serve_control(self):
+        """Start answering json line requests on the control socket, from a background thread."""
+        import os
+        import socketserver
+        import threading
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = daemon.handle(json.loads(line))
+                    except (ValueError, KeyError, TypeError) as e:
+                        response = {'error': str(e)}
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+
+        class Server(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+        self.socket_path.unlink(missing_ok=True)
+        # Create the socket owner-only, rather than changing its mode after it can already be connected to
+        umask = os.umask(0o177)
+        try:
+            server = Server(str(self.socket_path), Handler)
+        finally:
+            os.umask(umask)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def run(self):
+        from apscheduler.schedulers.blocking import BlockingScheduler
+
+        def time_before_opening(seconds):
+            opening = datetime.datetime.combine(datetime.date(2000, 1, 1), datetime.time.fromisoformat(self.open_at))
+            wake_at = opening - datetime.timedelta(seconds=seconds)
+            return {'hour': wake_at.hour, 'minute': wake_at.minute, 'second': wake_at.second}
+
+        self.scheduler = BlockingScheduler()
+        self.scheduler.add_job(self.refresh_cookies, 'interval', seconds=self.refresh_interval, id='refresh')
+        self.scheduler.add_job(
+            self.prefetch, 'cron', id='prefetch', misfire_grace_time=None, **time_before_opening(self.prefetch_ahead),
+        )
+        self.scheduler.add_job(
+            self.reserve, 'cron', id='reserve', misfire_grace_time=None, **time_before_opening(self.lead_time),
+        )
+
+        server = self.serve_control()
+        print(f'Daemon running, control socket at {self.socket_path}.')
+        try:
+            self.scheduler.start()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+
+
+def send_daemon_command(command, socket_path=None, **arguments):
+    """Send a request to a running daemon's control socket, and return its response."""
+    import socket
+
+    socket_path = socket_path or get_cache_dir() / DAEMON_SOCKET_FILENAME
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise click.ClickException('The daemon is not running, start it with `mealpy daemon`.')
+
+        client.sendall(json.dumps({'command': command, **arguments}).encode() + b'\n')
+        with client.makefile('rb') as f:
+            response = json.loads(f.readline())
+
+    if 'error' in response:
+        raise click.ClickException(response['error'])
+    return response
+
+
+def print_targets(targets):
+    for name, target in sorted(targets.items()):
+        print(
+            f'{name}: {" > ".join(target["choices"])}, {target["reservation_time"]} in {target["city"]}, '
+            f'on {", ".join(target["days"])}',
+        )
+
+
+fallback_option = click.option(
+    '--fallback', '-f', 'fallbacks', multiple=True, metavar='NAME',
+    help='Restaurant or meal name to try if the ones before it fail. Repeat in order of preference.',
+)
 
 
 @cli.command('reserve', short_help='Reserve a meal on MealPal.')
 @click.argument('restaurant')
 @click.argument('reservation_time')
 @click.argument('city')
-def reserve(restaurant, reservation_time, city):
-    execute_reserve_meal(restaurant, reservation_time, city)
+@fallback_option
+@click.option(
+    '--stream-menu', is_flag=True,
+    help='Parse the menu as it downloads, and stop as soon as the restaurant is found. Faster for big cities. '
+         'Only used without fallbacks.',
+)
+@click.option(
+    '--fuzzy', is_flag=True,
+    help='Accept partial or misspelt names, and reserve the best match on the menu, see the search command.',
+)
+def reserve(restaurant, reservation_time, city, fallbacks, stream_menu, fuzzy):
+    execute_reserve_meal([restaurant, *fallbacks], reservation_time, city, stream=stream_menu, fuzzy=fuzzy)
+
+
+@cli.command('schedule', short_help='Reserve a meal on MealPal the moment the kitchen opens.')
+@click.argument('restaurant')
+@click.argument('reservation_time')
+@click.argument('city')
+@fallback_option
+@click.option(
+    '--open-at', default=KITCHEN_OPEN_TIME, show_default=True,
+    help='Local time (HH:MM:SS) at which the kitchen opens.',
+)
+@click.option(
+    '--lead-time', default=DEFAULT_LEAD_TIME, type=float, show_default=True,
+    help='Seconds before opening to wake up and prepare the reservation.',
+)
+@click.option(
+    '--sync-clock/--no-sync-clock', default=True, show_default=True,
+    help="Correct for MealPal's clock offset and network latency when timing the reservation.",
+)
+@click.option(
+    '--burst', default=DEFAULT_BURST_ATTEMPTS, type=click.IntRange(min=1), show_default=True,
+    help='Number of reservation attempts to fire concurrently around the opening instant.',
+)
+@click.option(
+    '--burst-interval', default=DEFAULT_BURST_INTERVAL, type=float, show_default=True,
+    help='Seconds between consecutive burst attempts.',
+)
+@click.option(
+    '--warm-connections', default=DEFAULT_WARM_CONNECTIONS, type=click.IntRange(min=0), show_default=True,
+    help='Keep-alive connections to open ahead of firing, at least one per burst attempt. 0 disables warming.',
+)
+def schedule(
+        restaurant,
+        reservation_time,
+        city,
+        fallbacks,
+        open_at,
+        lead_time,
+        sync_clock,
+        burst,
+        burst_interval,
+        warm_connections,
+):  # pylint: disable=too-many-arguments
+    mealpal = initialize_mealpal(pool_size=max(DEFAULT_POOL_SIZE, burst, warm_connections))
+    wake_at, target = get_wake_time(open_at, lead_time)
+    run_once_at(
+        wake_at,
+        execute_scheduled_reservation,
+        args=(mealpal, [restaurant, *fallbacks], reservation_time, city, target.timestamp()),
+        kwargs={
+            'sync_clock': sync_clock,
+            'burst': burst,
+            'burst_interval': burst_interval,
+            'warm_connections': warm_connections,
+        },
+    )
+
+
+@cli.command('reserve-batch', short_help='Reserve meals for several MealPal accounts the moment the kitchen opens.')
+@click.argument('batch_file', type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    '--open-at', default=KITCHEN_OPEN_TIME, show_default=True,
+    help='Local time (HH:MM:SS) at which the kitchen opens.',
+)
+@click.option(
+    '--lead-time', default=DEFAULT_LEAD_TIME, type=float, show_default=True,
+    help='Seconds before opening to wake up and prepare the reservations.',
+)
+@click.option(
+    '--sync-clock/--no-sync-clock', default=True, show_default=True,
+    help="Correct for MealPal's clock offset and network latency when timing the reservations.",
+)
+@click.option(
+    '--retry-for', default=DEFAULT_RETRY_FOR, type=float, show_default=True,
+    help='Seconds after opening to keep retrying failed reservations.',
+)
+def reserve_batch(batch_file, open_at, lead_time, sync_clock, retry_for):
+    accounts = load_batch(Path(batch_file))['accounts']
+    mealpals = {i['name']: initialize_mealpal(account=i['name'], email=i['email_address']) for i in accounts}
+
+    wake_at, target = get_wake_time(open_at, lead_time)
+    run_once_at(
+        wake_at,
+        execute_batch_reservation,
+        args=(mealpals, accounts, target.timestamp()),
+        kwargs={'sync_clock': sync_clock, 'retry_for': retry_for},
+    )
+
+
+@cli.command('search', short_help="Search every city's menu for a restaurant or meal.")
+@click.argument('query')
+@click.option(
+    '--city', 'cities', multiple=True, metavar='CITY',
+    help='Only search the menu of this city. Repeat for several cities.',
+)
+def search(query, cities):
+    execute_search(query, list(cities) or None)
+
+
+@cli.command('menu-cache', short_help='Show how well the menu cache has been doing.')
+def menu_cache():
+    stats = MenuCache(get_cache_dir() / MENUS_DIRNAME).stats
+    fetches = stats['hits'] + stats['misses']
+    print(f'{fetches} menu fetches, {stats["hits"]} answered by a 304 from the cache.')
+    print(
+        f'{stats["bytes_received"] / 1024:.1f} KiB received, '
+        f'{stats["bytes_saved"] / 1024:.1f} KiB saved by caching and compression.',
+    )
+
+
+@cli.group('daemon', invoke_without_command=True, short_help='Stay running, and reserve meals every weekday.')
+@click.option(
+    '--open-at', default=KITCHEN_OPEN_TIME, show_default=True,
+    help='Local time (HH:MM:SS) at which the kitchen opens.',
+)
+@click.option(
+    '--lead-time', default=DEFAULT_LEAD_TIME, type=float, show_default=True,
+    help='Seconds before opening to wake up and prepare the reservation.',
+)
+@click.option(
+    '--prefetch-ahead', default=DAEMON_PREFETCH_AHEAD, type=float, show_default=True,
+    help='Seconds before opening to prefetch the menu.',
+)
+@click.option(
+    '--retry-for', default=DEFAULT_RETRY_FOR, type=float, show_default=True,
+    help='Seconds after opening to keep retrying a failed reservation.',
+)
+@click.option(
+    '--sync-clock/--no-sync-clock', default=True, show_default=True,
+    help="Correct for MealPal's clock offset and network latency when timing the reservation.",
+)
+@click.option(
+    '--burst', default=DEFAULT_BURST_ATTEMPTS, type=click.IntRange(min=1), show_default=True,
+    help='Number of reservation attempts to fire concurrently around the opening instant.',
+)
+@click.option(
+    '--burst-interval', default=DEFAULT_BURST_INTERVAL, type=float, show_default=True,
+    help='Seconds between consecutive burst attempts.',
+)
+@click.option(
+    '--warm-connections', default=DEFAULT_WARM_CONNECTIONS, type=click.IntRange(min=0), show_default=True,
+    help='Keep-alive connections to open ahead of firing, at least one per burst attempt. 0 disables warming.',
+)
+@click.pass_context
+def daemon(
+        ctx,
+        open_at,
+        lead_time,
+        prefetch_ahead,
+        retry_for,
+        sync_clock,
+        burst,
+        burst_interval,
+        warm_connections,
+):  # pylint: disable=too-many-arguments
+    """Stay running with a logged in session, and reserve the targets set with `mealpy daemon set` every time the
+    kitchen opens on their days. The other commands below control a running daemon.
+    """
+    if ctx.invoked_subcommand:
+        return
+
+    mealpal = initialize_mealpal(pool_size=max(DEFAULT_POOL_SIZE, burst, warm_connections))
+    cache_dir = get_cache_dir()
+    Daemon(
+        mealpal,
+        get_cookies_path(),
+        cache_dir / DAEMON_TARGETS_FILENAME,
+        cache_dir / DAEMON_SOCKET_FILENAME,
+        open_at=open_at,
+        lead_time=lead_time,
+        prefetch_ahead=prefetch_ahead,
+        refresh_interval=load_config().get('cookie_validation_ttl', COOKIE_VALIDATION_TTL),
+        retry_for=retry_for,
+        reservation_kwargs={
+            'sync_clock': sync_clock,
+            'burst': burst,
+            'burst_interval': burst_interval,
+            'warm_connections': warm_connections,
+        },
+    ).run()
+
+
+@daemon.command('status', short_help="Show the running daemon's state.")
+def daemon_status():
+    for key, value in send_daemon_command('status').items():
+        print(f'{key}: {value}')
+
+
+@daemon.command('list', short_help="List the running daemon's targets.")
+def daemon_list():
+    print_targets(send_daemon_command('list')['targets'])
+
+
+@daemon.command('set', short_help='Add or change a target of the running daemon.')
+@click.argument('name')
+@click.argument('restaurant')
+@click.argument('reservation_time')
+@click.argument('city')
+@fallback_option
+@click.option(
+    '--day', 'days', multiple=True, type=click.Choice(WEEKDAYS),
+    help='Day of the week to reserve on. Repeat for several days. Every weekday by default.',
+)
+def daemon_set(name, restaurant, reservation_time, city, fallbacks, days):  # pylint: disable=too-many-arguments
+    response = send_daemon_command(
+        'set',
+        name=name,
+        choices=[restaurant, *fallbacks],
+        reservation_time=reservation_time,
+        city=city,
+        days=days,
+    )
+    print_targets(response['targets'])
+
+
+@daemon.command('remove', short_help='Remove a target from the running daemon.')
+@click.argument('name')
+def daemon_remove(name):
+    print_targets(send_daemon_command('remove', name=name)['targets'])
+
+
+@daemon.command('stop', short_help='Stop the running daemon.')
+def daemon_stop():
+    send_daemon_command('stop')
+    print('Daemon stopping.')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,145 @@
+"""Client-side rate limiting of the requests `mealpy.MealPal` sends, so that retrying hard doesn't get us throttled.
+
+Each endpoint gets a token bucket refilling at `rate` requests a second up to `burst` requests. Buckets kept in a file
+are shared by every process using that file, e.g. every account of a batch or daemon and any `mealpy reserve` running
+alongside them, under an exclusive flock.
+"""
+import contextlib
+import email.utils
+import fcntl
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+from mealpy import mealpy
+
+ENDPOINT_PATTERNS = {
+    name: re.compile('^' + re.escape(path).replace(re.escape('{}'), '[^/]+') + '$')
+    for name, path in mealpy.ENDPOINTS.items()
+}
+# Seconds to hold off after a 429 without a usable Retry-After, and the longest hold off a Retry-After can ask for
+DEFAULT_RETRY_AFTER = 1.0
+MAX_RETRY_AFTER = 60.0
+
+
+def endpoint_name(url):
+    """Name of the ENDPOINTS entry `url` is for, or None."""
+    path = urlparse(url).path
+    for name, pattern in ENDPOINT_PATTERNS.items():
+        if pattern.match(path):
+            return name
+    return None
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date, or None if invalid."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+class TokenBuckets:
+    """A token bucket per endpoint, in memory, or in the json file `path` to share them between processes.
+
+    `limits` maps endpoint names to RateLimits, and endpoints without one, or with a rate of 0, aren't limited. Each
+    bucket is `[tokens, updated_at]`. Taking a token may leave the bucket owing some, and the taker then sleeps until
+    they would have refilled, outside the lock, so that waiters queue up in the order they arrived.
+    """
+
+    def __init__(self, limits, path=None):
+        self.limits = {
+            name: mealpy.RateLimit(limit.rate, max(1, limit.burst)) for name, limit in limits.items() if limit.rate > 0
+        }
+        self.path = path
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Yield the buckets, saving any changes to them, under a lock shared with every user of `path`."""
+        if self.path is None:
+            with self.lock:
+                yield self.buckets
+            return
+
+        with open(self.path, 'a+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            try:
+                buckets = json.loads(file.read() or '{}')
+            except ValueError:
+                buckets = {}
+            yield buckets
+            file.seek(0)
+            file.truncate()
+            file.write(json.dumps(buckets))
+
+    def reserve(self, endpoint, now=None):
+        """Take a token from `endpoint`'s bucket, returning the seconds to wait before using it."""
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return 0.0
+        now = time.time() if now is None else now
+
+        with self._locked() as buckets:
+            tokens, updated_at = buckets.get(endpoint, (limit.burst, now))
+            # Held off buckets are updated in the future, and only start refilling from then
+            tokens = min(limit.burst, tokens + (now - updated_at) * limit.rate) - 1
+            buckets[endpoint] = [tokens, now]
+
+        return max(0.0, -tokens / limit.rate)
+
+    def acquire(self, endpoint):
+        """Wait for a token from `endpoint`'s bucket. Returns the seconds waited."""
+        wait = self.reserve(endpoint)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def hold_off(self, endpoint, seconds, now=None):
+        """Empty `endpoint`'s bucket, and hold off refilling it for `seconds`, as asked by a Retry-After."""
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return
+        now = time.time() if now is None else now
+
+        with self._locked() as buckets:
+            tokens, updated_at = buckets.get(endpoint, (0.0, now))
+            buckets[endpoint] = [min(0.0, tokens), max(updated_at, now + seconds)]
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """An HTTPAdapter taking a token from `buckets` for the endpoint of each request before sending it.
+
+    A 429, or a 503 with a Retry-After, holds the endpoint off for as long as asked, so that retries back off instead of
+    making things worse.
+    """
+
+    def __init__(self, buckets, **kwargs):
+        super().__init__(**kwargs)
+        self.buckets = buckets
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        endpoint = endpoint_name(request.url)
+        self.buckets.acquire(endpoint)
+
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 429 or (response.status_code == 503 and 'Retry-After' in response.headers):
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is None:
+                retry_after = DEFAULT_RETRY_AFTER
+            self.buckets.hold_off(endpoint, min(MAX_RETRY_AFTER, retry_after))
+        return response
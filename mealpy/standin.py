@@ -0,0 +1,290 @@
+"""A local stand-in for the MealPal endpoints mealpy talks to, for tests, benchmarks and experiments.
+
+Serves LOGIN_PATH, CITIES_PATH, MENU_PATH, RESERVATION_PATH and KITCHEN_PATH from canned data shaped like the real
+responses, over HTTP/1.1 keep-alive on 127.0.0.1, from a background thread.
+"""
+import copy
+import email.utils
+import gzip
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from mealpy import mealpy
+
+MENU_PATH_PATTERN = re.compile('^' + mealpy.MENU_PATH.format('(?P<city_id>[^/]+)') + '$')
+SESSION_COOKIE = 'standin_session'
+# Responses this big or bigger are gzipped for clients accepting it
+GZIP_MIN_SIZE = 1024
+
+ReservationAttempt = namedtuple('ReservationAttempt', 'received_at session schedule_id error')
+
+DEFAULT_CITIES = [
+    {
+        'id': 'standin_sf_id',
+        'objectId': 'standin_sf_object_id',
+        'state': 'CA',
+        'name': 'San Francisco',
+        'city_code': 'SFO',
+        'timezone': -7,
+        'neighborhoods': [{'id': 'standin_fidi_id', 'name': 'Financial District'}],
+    },
+]
+
+
+def make_schedule(schedule_id, restaurant_name, meal_name, city_name='San Francisco'):
+    return {
+        'id': schedule_id,
+        'priority': 9,
+        'is_featured': False,
+        'date': '20190401',
+        'meal': {
+            'id': f'{schedule_id}_meal',
+            'name': meal_name,
+            'description': f'{meal_name}, served at {restaurant_name}.',
+            'cuisine': 'asian',
+            'image': 'https://example.com/image.jpg',
+            'portion': 2,
+            'veg': False,
+        },
+        'restaurant': {
+            'id': f'{schedule_id}_restaurant',
+            'name': restaurant_name,
+            'address': 'RestaurantAddress',
+            'state': 'CA',
+            'latitude': '111.111',
+            'longitude': '-111.111',
+            'neighborhood': {'name': 'Financial District', 'id': 'standin_fidi_id'},
+            'city': {'name': city_name, 'id': 'standin_sf_id', 'timezone_offset_hours': -7},
+            'open': '2019-04-01T00:00:00Z',
+            'close': '2019-04-01T00:00:00Z',
+            'mpn_open': '2019-04-01T00:00:00Z',
+            'mpn_close': '2019-04-01T00:00:00Z',
+        },
+    }
+
+
+DEFAULT_SCHEDULES = [
+    make_schedule('standin_schedule_1', 'RestaurantName', 'Spam and Eggs'),
+    make_schedule('standin_schedule_2', 'Coast Poke Counter - Battery St.', 'Poke Bowl'),
+]
+
+
+class StandInMealPal:
+    """The stand-in server. Use as a context manager, and point a client at `base_url`.
+
+    `menus` maps city objectIds to lists of schedules, and defaults to DEFAULT_SCHEDULES for every city. Every request
+    takes `latency` seconds of round trip time, half of it before the server handles it and half after. Reservations
+    are refused before the epoch timestamp `open_at`, if given. Accepted reservation payloads are appended to
+    `reservations`, and the times they were accepted at to `reserved_at`.
+
+    With a `quantity`, each schedule can only be reserved that many times, and further reservations are refused as
+    sold out. `remaining` holds what is left of each schedule, and may be edited to give schedules different amounts.
+    Each login gets its own session, named after the username, which like a MealPal account can only hold one
+    reservation. Every reservation request is recorded in `attempts` with the session it came from, so that contending
+    clients can be told apart.
+
+    Menus carry an ETag and a Last-Modified header, the epoch timestamp `menus_modified_at`, and conditional requests
+    for an unchanged menu get a 304. Responses are gzipped when the client accepts it.
+    """
+
+    def __init__(self, cities=None, menus=None, latency=0.0, open_at=None, quantity=None):
+        self.cities = copy.deepcopy(cities or DEFAULT_CITIES)
+        self.menus = menus or {i['objectId']: copy.deepcopy(DEFAULT_SCHEDULES) for i in self.cities}
+        self.latency = latency
+        self.open_at = open_at
+        self.menus_modified_at = time.time()
+        self.remaining = None if quantity is None else dict.fromkeys(self.schedule_ids(), quantity)
+        self.reservations = []
+        self.reserved_at = []
+        self.attempts = []
+        self.reserved_sessions = set()
+        self.lock = threading.Lock()
+
+        self.server = _Server(('127.0.0.1', 0), _make_handler(self))
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_exc_info):
+        self.stop()
+
+    def schedule_ids(self):
+        return {i['id'] for schedules in self.menus.values() for i in schedules}
+
+    def sold_out(self, schedule_id=None):
+        """Whether `schedule_id`, or every schedule, has none left."""
+        if self.remaining is None:
+            return False
+        if schedule_id:
+            return not self.remaining.get(schedule_id)
+        return not any(self.remaining.values())
+
+    def login(self, body, _session):
+        data = json.loads(body)
+        if not data.get('username') or not data.get('password'):
+            return 404, {'code': 101, 'error': 'Invalid username/password.'}
+        return 200, {'id': 'standin_user_id', 'email': data['username'], 'sessionToken': f'r:{data["username"]}'}
+
+    def get_cities(self, _body, _session):
+        return 200, {'result': self.cities}
+
+    def get_menu(self, city_id, request_headers):
+        if city_id not in self.menus:
+            return 404, {'error': 'ERROR_CITY_NOT_FOUND'}, {}
+
+        data = {'generated_at': '2019-04-01T00:00:00Z', 'schedules': self.menus[city_id]}
+        etag = f'"{hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()}"'
+        headers = {'ETag': etag, 'Last-Modified': email.utils.formatdate(self.menus_modified_at, usegmt=True)}
+
+        if 'If-None-Match' in request_headers:
+            not_modified = etag in [i.strip() for i in request_headers['If-None-Match'].split(',')]
+        elif 'If-Modified-Since' in request_headers:
+            since = email.utils.parsedate_to_datetime(request_headers['If-Modified-Since']).timestamp()
+            not_modified = int(self.menus_modified_at) <= since
+        else:
+            not_modified = False
+
+        if not_modified:
+            return 304, None, headers
+        return 200, data, headers
+
+    def reserve(self, body, session):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            # mealpy form-encodes the reservation, despite its json Content-Type header
+            data = dict(parse_qsl(body))
+        schedule_id = data.get('schedule_id')
+
+        with self.lock:
+            now = time.time()
+            if self.open_at and now < self.open_at:
+                error = 'ERROR_KITCHEN_CLOSED'
+            elif schedule_id not in self.schedule_ids():
+                error = 'ERROR_SCHEDULE_NOT_FOUND'
+            elif self.remaining is not None and not self.remaining[schedule_id]:
+                error = 'ERROR_SOLD_OUT'
+            elif session in self.reserved_sessions:
+                error = 'ERROR_ALREADY_RESERVED'
+            else:
+                error = None
+                if self.remaining is not None:
+                    self.remaining[schedule_id] -= 1
+                self.reservations.append(data)
+                self.reserved_at.append(now)
+                if session:
+                    self.reserved_sessions.add(session)
+            self.attempts.append(ReservationAttempt(now, session, schedule_id, error))
+
+        if error:
+            return 400, {'error': error}
+        return 200, {'result': {'schedule': {'schedule_id': schedule_id, 'ordered_quantity': 1}}}
+
+    def check_kitchen(self, _body, _session):
+        return 200, {'result': {'status': 'OPEN', 'kitchenMode': 'classic'}}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Enough for hundreds of clients connecting at once
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response, e.g. on a timeout, are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def _make_handler(standin):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        post_routes = {
+            mealpy.LOGIN_PATH: standin.login,
+            mealpy.CITIES_PATH: standin.get_cities,
+            mealpy.RESERVATION_PATH: standin.reserve,
+            mealpy.KITCHEN_PATH: standin.check_kitchen,
+        }
+
+        def log_message(self, *_args):  # pylint: disable=arguments-differ
+            pass
+
+        def session(self):
+            cookies = SimpleCookie(self.headers.get('Cookie', ''))
+            return cookies[SESSION_COOKIE].value if SESSION_COOKIE in cookies else None
+
+        def parse_request(self):
+            # The request's half of the round trip
+            if standin.latency:
+                time.sleep(standin.latency / 2)
+            return super().parse_request()
+
+        def respond(self, status, data=None, head=False, headers=None):
+            # The response's half of the round trip
+            if standin.latency:
+                time.sleep(standin.latency / 2)
+
+            body = json.dumps(data).encode() if data is not None else b''
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            if status == 304:
+                self.end_headers()
+                return
+
+            if len(body) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if status == 200 and self.path == mealpy.LOGIN_PATH:
+                self.send_header('Set-Cookie', f'{SESSION_COOKIE}={data["sessionToken"]}; Path=/')
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+
+        def do_HEAD(self):  # pylint: disable=invalid-name
+            self.respond(200, head=True)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            match = MENU_PATH_PATTERN.match(self.path)
+            if match:
+                status, data, headers = standin.get_menu(match.group('city_id'), self.headers)
+                self.respond(status, data, headers=headers)
+            else:
+                self.respond(200 if self.path == '/' else 404)
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+            route = self.post_routes.get(self.path)
+            if route:
+                self.respond(*route(body, self.session()))
+            else:
+                self.respond(404)
+
+    return Handler
@@ -0,0 +1,107 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from mealpy import mealpy
+from mealpy import standin
+from mealpy.aio import AsyncMealPal
+
+
+@pytest.fixture
+def standin_mealpal():
+    with standin.StandInMealPal() as _standin_mealpal:
+        yield _standin_mealpal
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestAsyncMealPal:
+
+    @staticmethod
+    def test_login(standin_mealpal):
+        async def login():
+            async with AsyncMealPal(base_url=standin_mealpal.base_url) as mealpal:
+                status = await mealpal.login('username', 'password')
+                return status, len(mealpal.session.cookie_jar)
+
+        assert run(login()) == (200, 1)
+
+    @staticmethod
+    def test_login_fail(standin_mealpal):
+        async def login():
+            async with AsyncMealPal(base_url=standin_mealpal.base_url) as mealpal:
+                await mealpal.login('username', '')
+
+        with pytest.raises(aiohttp.ClientResponseError):
+            run(login())
+
+    @staticmethod
+    def test_get_schedules(standin_mealpal):
+        async def get_schedules():
+            async with AsyncMealPal(base_url=standin_mealpal.base_url) as mealpal:
+                menu = await mealpal.get_schedules('San Francisco')
+                schedule = await mealpal.get_schedule_by_meal_name('Poke Bowl', 'San Francisco')
+                return menu, schedule
+
+        menu, schedule = run(get_schedules())
+
+        assert isinstance(menu, mealpy.Menu)
+        assert menu.get_by_restaurant_name('RestaurantName')['id'] == 'standin_schedule_1'
+        assert schedule['id'] == 'standin_schedule_2'
+
+    @staticmethod
+    def test_get_schedules_compact(standin_mealpal):
+        async def get_schedules():
+            async with AsyncMealPal(base_url=standin_mealpal.base_url) as mealpal:
+                return await mealpal.get_schedules('San Francisco', compact=True)
+
+        menu = run(get_schedules())
+
+        assert menu.find('Poke Bowl') == menu.get_by_id('standin_schedule_2')
+        assert isinstance(menu[0], mealpy.Schedule)
+
+    @staticmethod
+    def test_reserve_meal_concurrently(standin_mealpal):
+        async def reserve_meals():
+            async with AsyncMealPal(base_url=standin_mealpal.base_url) as mealpal:
+                await mealpal.get_cities()
+                return await asyncio.gather(*(
+                    AsyncMealPal.reserve_meal(mealpal, '12:15pm-12:30pm', 'San Francisco', restaurant_name=name)
+                    for name in ('RestaurantName', 'Coast Poke Counter - Battery St.')
+                ))
+
+        assert run(reserve_meals()) == [200, 200]
+        assert sorted(i['schedule_id'] for i in standin_mealpal.reservations) == [
+            'standin_schedule_1',
+            'standin_schedule_2',
+        ]
+
+    @staticmethod
+    def test_reserve_meal_missing_params():
+        with pytest.raises(AssertionError):
+            run(AsyncMealPal().reserve_meal('12:15pm-12:30pm', 'San Francisco'))
+
+    @staticmethod
+    def test_reserve_meal_cancel_meal():
+        with pytest.raises(NotImplementedError):
+            run(AsyncMealPal().reserve_meal('12:15pm-12:30pm', 'San Francisco', 'name', cancel_current_meal=True))
+
+    @staticmethod
+    def test_get_current_meal(standin_mealpal):
+        async def get_current_meal():
+            async with AsyncMealPal(base_url=standin_mealpal.base_url) as mealpal:
+                return await mealpal.get_current_meal()
+
+        assert run(get_current_meal())['result']['status'] == 'OPEN'
+
+    @staticmethod
+    def test_timeout():
+        async def get_cities():
+            async with AsyncMealPal(base_url=slow_standin.base_url, timeout=0.05) as mealpal:
+                await mealpal.get_cities()
+
+        with standin.StandInMealPal(latency=0.5) as slow_standin, pytest.raises(asyncio.TimeoutError):
+            run(get_cities())
@@ -0,0 +1,36 @@
+import random
+
+from click.testing import CliRunner
+
+from benchmarks import contention
+
+
+def test_run_trial():
+    trial = contention.run_trial('scheduled', {}, [('retry-loop', 3), ('late', 3)], 2, 0.0, 0.0, random.Random(0))
+
+    accepted = [i for i in trial.attempts if i.error is None]
+    assert len(accepted) == 2
+    assert len({i.session for i in accepted}) == 2
+    assert all(i.received_at >= trial.open_at for i in accepted)
+    assert set(trial.strategies.values()) == {'ours', 'retry-loop', 'late'}
+    assert not trial.errors
+
+
+def test_our_margin():
+    attempts = [
+        contention.standin.ReservationAttempt(9.0, 'r:ours', 'mock_schedule', 'ERROR_KITCHEN_CLOSED'),
+        contention.standin.ReservationAttempt(10.0, 'r:rival', 'mock_schedule', None),
+        contention.standin.ReservationAttempt(10.5, 'r:ours', 'mock_schedule', 'ERROR_SOLD_OUT'),
+        contention.standin.ReservationAttempt(10.25, 'r:ours', 'mock_schedule', 'ERROR_SOLD_OUT'),
+    ]
+    trial = contention.Trial(10.0, attempts, {}, {})
+
+    assert contention.our_margin(trial, 1) == -0.25
+    assert contention.our_margin(trial, 2) is None
+
+
+def test_bad_rival():
+    result = CliRunner().invoke(contention.main, ['--rival', 'unknown=1'])
+
+    assert result.exit_code == 2
+    assert 'is not STRATEGY=COUNT' in result.output
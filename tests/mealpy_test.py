@@ -1,11 +1,23 @@
+import datetime
+import email.utils
+import io
+import json
+import os
+import sys
+import threading
+import time
 from collections import namedtuple
 from unittest import mock
 
+import click
 import pytest
 import requests
 import responses
+import strictyaml
+from click.testing import CliRunner
 
 from mealpy import mealpy
+from mealpy import standin
 
 City = namedtuple('City', 'name objectId')
 
@@ -122,6 +134,261 @@ class TestCity:
             mealpal.get_city('Not San Francisco')
 
 
+class TestCityCache:
+
+    @staticmethod
+    @pytest.fixture
+    def cities_url_response(mock_responses):
+        mock_responses.add(
+            responses.RequestsMock.POST,
+            mealpy.CITIES_URL,
+            json={
+                'result': [{
+                    'id': 'mock_id1',
+                    'objectId': 'mock_objectId1',
+                    'name': 'San Francisco',
+                }],
+            },
+        )
+        yield mock_responses
+
+    @staticmethod
+    def test_get_city_cached_in_memory(cities_url_response):
+        mealpal = mealpy.MealPal()
+
+        assert mealpal.get_city('San Francisco')['objectId'] == 'mock_objectId1'
+        assert mealpal.get_city('San Francisco')['objectId'] == 'mock_objectId1'
+        assert len(cities_url_response.calls) == 1
+
+    @staticmethod
+    def test_get_city_cached_on_disk(cities_url_response, tmp_path):
+        mealpy.MealPal(cache_dir=tmp_path).get_city('San Francisco')
+        mealpal = mealpy.MealPal(cache_dir=tmp_path)
+
+        assert mealpal.get_city('San Francisco')['objectId'] == 'mock_objectId1'
+        assert len(cities_url_response.calls) == 1
+
+    @staticmethod
+    def test_get_city_cache_expired(cities_url_response, tmp_path):
+        mealpy.MealPal(cache_dir=tmp_path).get_city('San Francisco')
+        mealpal = mealpy.MealPal(cache_dir=tmp_path, city_cache_ttl=-1)
+
+        assert mealpal.get_city('San Francisco')['objectId'] == 'mock_objectId1'
+        assert len(cities_url_response.calls) == 2
+
+    @staticmethod
+    @pytest.mark.parametrize('content', [
+        'not json',
+        '{}',
+        '[]',
+        '{"fetched_at": 1, "cities": [{"objectId": "mock_objectId"}]}',
+        '{"fetched_at": "yesterday", "cities": []}',
+    ])
+    def test_city_cache_corrupt_file(tmp_path, content):
+        (tmp_path / mealpy.CITIES_FILENAME).write_text(content)
+
+        city_cache = mealpy.CityCache(tmp_path / mealpy.CITIES_FILENAME)
+
+        assert city_cache.expired
+        assert city_cache.get('San Francisco') is None
+
+
+class TestMenuCache:
+
+    @staticmethod
+    @pytest.fixture
+    def standin_mealpal(mock_responses):
+        with standin.StandInMealPal() as _standin_mealpal:
+            mock_responses.add_passthru(_standin_mealpal.base_url)
+            yield _standin_mealpal
+
+    @staticmethod
+    def test_unchanged_menu_costs_a_304(standin_mealpal, tmp_path):
+        mealpal = mealpy.MealPal(cache_dir=tmp_path, base_url=standin_mealpal.base_url)
+
+        first = mealpal.get_schedules('San Francisco')
+        second = mealpal.get_schedules('San Francisco')
+
+        assert [i['id'] for i in second] == [i['id'] for i in first]
+        stats = mealpal.menu_cache.stats
+        assert (stats['hits'], stats['misses']) == (1, 1)
+        # The 304 saved a whole menu, and gzip saved part of the first one
+        assert stats['bytes_saved'] > mealpal.menu_cache.get('standin_sf_object_id')['size']
+        assert stats['bytes_received'] < mealpal.menu_cache.get('standin_sf_object_id')['size']
+
+    @staticmethod
+    def test_revalidated_after_restart(standin_mealpal, tmp_path):
+        mealpal = mealpy.MealPal(cache_dir=tmp_path, base_url=standin_mealpal.base_url)
+        mealpal.get_schedules('San Francisco')
+        mealpal.menu_cache.flush()
+
+        mealpal = mealpy.MealPal(cache_dir=tmp_path, base_url=standin_mealpal.base_url)
+        mealpal.get_schedules('San Francisco')
+        mealpal.menu_cache.flush()
+
+        assert mealpy.MenuCache(tmp_path / mealpy.MENUS_DIRNAME).stats['hits'] == 1
+        assert mealpy.MenuCache(tmp_path / mealpy.MENUS_DIRNAME).stats['misses'] == 1
+
+    @staticmethod
+    def test_changed_menu_refetched(standin_mealpal):
+        mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+        mealpal.get_schedules('San Francisco')
+        standin_mealpal.menus['standin_sf_object_id'] = standin_mealpal.menus['standin_sf_object_id'][:1]
+
+        assert len(mealpal.get_schedules('San Francisco')) == 1
+        assert mealpal.menu_cache.stats['misses'] == 2
+
+    @staticmethod
+    def test_streaming_uses_cache(standin_mealpal):
+        mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+        mealpal.get_schedules('San Francisco')
+
+        assert mealpal.find_schedule('San Francisco', meal_name='Poke Bowl')['id'] == 'standin_schedule_2'
+        assert mealpal.menu_cache.stats['hits'] == 1
+
+    @staticmethod
+    def test_index_persisted(standin_mealpal, tmp_path):
+        mealpal = mealpy.MealPal(cache_dir=tmp_path, base_url=standin_mealpal.base_url)
+        mealpal.get_schedules('San Francisco')
+        assert (tmp_path / mealpy.MENUS_DIRNAME / f'standin_sf_object_id{mealpy.MENU_INDEX_SUFFIX}').exists()
+
+        mealpal = mealpy.MealPal(cache_dir=tmp_path, base_url=standin_mealpal.base_url)
+        with mock.patch.object(mealpy.MenuIndex, 'build') as mock_build:
+            menu = mealpal.get_schedules('San Francisco', compact=True)
+            assert [i.id for i in menu.search('poek bowl')] == ['standin_schedule_2']
+
+        assert mealpal.menu_cache.stats['hits'] == 1
+        assert not mock_build.called
+
+    @staticmethod
+    def test_index_of_other_menu_ignored(standin_mealpal, tmp_path):
+        mealpal = mealpy.MealPal(cache_dir=tmp_path, base_url=standin_mealpal.base_url)
+        mealpal.get_schedules('San Francisco')
+        index_path = tmp_path / mealpy.MENUS_DIRNAME / f'standin_sf_object_id{mealpy.MENU_INDEX_SUFFIX}'
+        index = json.loads(index_path.read_text())
+        index['ids'] = ['other_schedule_1', 'other_schedule_2']
+        index['menu'][0] = '"other_etag"'
+        index_path.write_text(json.dumps(index))
+
+        mealpal = mealpy.MealPal(cache_dir=tmp_path, base_url=standin_mealpal.base_url)
+        menu = mealpal.get_schedules('San Francisco')
+
+        assert menu.find('poek bowl', fuzzy=True)['id'] == 'standin_schedule_2'
+
+    @staticmethod
+    def test_not_cached_without_validators(mock_responses):
+        mock_responses.add(
+            responses.RequestsMock.GET,
+            mealpy.MENU_URL.format('mock_objectId'),
+            json={'schedules': standin.DEFAULT_SCHEDULES},
+        )
+        mealpal = mealpy.MealPal()
+        mealpal.city_cache.update([{'name': 'San Francisco', 'objectId': 'mock_objectId'}])
+
+        mealpal.get_schedules('San Francisco')
+
+        assert mealpal.menu_cache.get('mock_objectId') is None
+        assert mealpal.menu_cache.validators('mock_objectId') == {}
+
+    @staticmethod
+    @pytest.mark.parametrize('content', ['not json', '[]', '{"etag": "mock_etag"}'])
+    def test_corrupt_file(tmp_path, content):
+        (tmp_path / 'mock_objectId.json').write_text(content)
+
+        assert mealpy.MenuCache(tmp_path).get('mock_objectId') is None
+
+    @staticmethod
+    def test_flush_adds_to_saved_stats(tmp_path):
+        first = mealpy.MenuCache(tmp_path)
+        second = mealpy.MenuCache(tmp_path)
+        first.record(hits=1, bytes_saved=100)
+        second.record(hits=2, misses=1)
+
+        first.flush()
+        second.flush()
+        second.flush()
+
+        assert mealpy.MenuCache(tmp_path).stats == {'hits': 3, 'misses': 1, 'bytes_received': 0, 'bytes_saved': 100}
+
+    @staticmethod
+    def test_cli(tmp_path):
+        cache = mealpy.MenuCache(tmp_path / mealpy.MENUS_DIRNAME)
+        cache.record(hits=3, misses=1, bytes_received=1024, bytes_saved=4096)
+        cache.flush()
+
+        with mock.patch.object(mealpy, 'get_cache_dir', return_value=tmp_path), \
+                mock.patch.object(mealpy, 'get_config_dir', return_value=tmp_path):
+            result = CliRunner().invoke(mealpy.cli, ['menu-cache'])
+
+        assert result.output == (
+            '4 menu fetches, 3 answered by a 304 from the cache.\n'
+            '1.0 KiB received, 4.0 KiB saved by caching and compression.\n'
+        )
+
+
+class TestConfig:
+
+    @staticmethod
+    @pytest.fixture
+    def config_path(tmp_path):
+        with mock.patch.object(mealpy, 'get_cache_dir', return_value=tmp_path / 'cache'), \
+                mock.patch.object(mealpy, 'get_config_dir', return_value=tmp_path):
+            path = tmp_path / mealpy.CONFIG_FILENAME
+            path.write_text("email_address: 'mock@example.com'\nuse_keyring: True\n")
+            yield path
+
+    @staticmethod
+    def test_load_config(config_path):
+        config = mealpy.load_config()
+
+        assert config == {
+            'email_address': 'mock@example.com',
+            'use_keyring': True,
+            'city_cache_ttl': 86400,
+            'cookie_validation_ttl': 600,
+        }
+        assert config_path.parent.joinpath('cache', mealpy.CONFIG_SNAPSHOT_FILENAME).exists()
+
+    @staticmethod
+    def test_snapshot_reused(config_path):
+        config = mealpy.load_config()
+
+        with mock.patch.object(mealpy, 'parse_config') as mock_parse_config:
+            assert mealpy.load_config() == config
+
+        assert not mock_parse_config.called
+
+    @staticmethod
+    def test_snapshot_rebuilt_on_change(config_path):
+        mealpy.load_config()
+        config_path.write_text("email_address: 'other@example.com'\nuse_keyring: False\ncity_cache_ttl: 60\n")
+
+        config = mealpy.load_config()
+
+        assert (config['email_address'], config['use_keyring'], config['city_cache_ttl']) == (
+            'other@example.com', False, 60,
+        )
+
+    @staticmethod
+    @pytest.mark.parametrize('snapshot', ['', '[]', '{"key": [], "config": {}}', '{"config": {}}'])
+    def test_bad_snapshot_rebuilt(config_path, snapshot):
+        snapshot_path = config_path.parent / 'cache' / mealpy.CONFIG_SNAPSHOT_FILENAME
+        snapshot_path.parent.mkdir()
+        snapshot_path.write_text(snapshot)
+
+        assert mealpy.load_config()['email_address'] == 'mock@example.com'
+        assert json.loads(snapshot_path.read_text())['config']['email_address'] == 'mock@example.com'
+
+    @staticmethod
+    def test_invalid_config_not_snapshotted(config_path):
+        config_path.write_text("email_address: 'not an email'\nuse_keyring: True\n")
+
+        with pytest.raises(strictyaml.YAMLValidationError):
+            mealpy.load_config()
+
+        assert not config_path.parent.joinpath('cache', mealpy.CONFIG_SNAPSHOT_FILENAME).exists()
+
+
 class TestLogin:
 
     @staticmethod
@@ -282,8 +549,7 @@ class TestSchedule:
     def test_get_schedule_by_restaurant_name_not_found(mock_city):
         mealpal = mealpy.MealPal()
 
-        # TODO(#24):  Handle invalid restaurant
-        with pytest.raises(StopIteration):
+        with pytest.raises(mealpy.ScheduleNotFoundError):
             mealpal.get_schedule_by_restaurant_name('NotFound', mock_city.name)
 
     @staticmethod
@@ -291,8 +557,7 @@ class TestSchedule:
     def test_get_schedule_by_meal_name_not_found(mock_city):
         mealpal = mealpy.MealPal()
 
-        # TODO(#24):  Handle invalid restaurant
-        with pytest.raises(StopIteration):
+        with pytest.raises(mealpy.ScheduleNotFoundError):
             mealpal.get_schedule_by_meal_name('NotFound', mock_city.name)
 
     @staticmethod
@@ -316,6 +581,46 @@ class TestSchedule:
             'address': 'RestaurantAddress',
         }.items()
 
+    @staticmethod
+    @pytest.mark.usefixtures('mock_get_city')
+    def test_get_schedules_indexed(menu_url_response, mock_city):
+        mealpal = mealpy.MealPal()
+
+        menu = mealpal.get_schedules(mock_city.name)
+
+        assert len(menu) == 1
+        assert list(menu) == [menu[0]]
+        assert menu.get_by_id('GUID') is menu[0]
+        assert menu.get_by_restaurant_name('RestaurantName') is menu[0]
+        assert menu.get_by_meal_name('Spam and Eggs') is menu[0]
+        assert len(menu_url_response.calls) == 2
+
+    @staticmethod
+    @pytest.mark.usefixtures('mock_get_city', 'menu_url_response')
+    def test_get_schedules_find_normalized(mock_city):
+        mealpal = mealpy.MealPal()
+
+        menu = mealpal.get_schedules(mock_city.name)
+
+        assert menu.find('  restaurantname ') is menu[0]
+        assert menu.find('SPAM  AND eggs') is menu[0]
+        with pytest.raises(mealpy.ScheduleNotFoundError):
+            menu.find('NotFound')
+
+    @staticmethod
+    def test_menu_first_schedule_wins():
+        schedules = [
+            {'id': 'id1', 'restaurant': {'name': 'Poke'}, 'meal': {'name': 'Bowl'}},
+            {'id': 'id2', 'restaurant': {'name': 'Poke'}, 'meal': {'name': 'poke'}},
+        ]
+
+        menu = mealpy.Menu(schedules)
+
+        assert menu.get_by_restaurant_name('Poke')['id'] == 'id1'
+        assert menu.find('poke')['id'] == 'id1'
+        with pytest.raises(mealpy.ScheduleNotFoundError):
+            menu.get_by_id('id3')
+
     @staticmethod
     @pytest.mark.usefixtures('mock_get_city')
     def test_get_schedules_fail(mock_responses, mock_city):
@@ -331,6 +636,224 @@ class TestSchedule:
             mealpal.get_schedules(mock_city.name)
 
 
+class TestCompactMenu:
+
+    @staticmethod
+    @pytest.fixture
+    def schedules():
+        monday = standin.make_schedule('id1', 'Poke', 'Bowl')
+        tuesday = standin.make_schedule('id2', 'Poke', 'Bowl')
+        tuesday['date'] = '20190402'
+        tuesday['meal']['id'] = monday['meal']['id']
+        tuesday['restaurant']['id'] = monday['restaurant']['id']
+        other = standin.make_schedule('id3', 'Sushi', 'Roll')
+        yield json.loads(json.dumps([monday, tuesday, other]))
+
+    @staticmethod
+    def test_compact_schedules(schedules):
+        monday, tuesday, other = mealpy.compact_schedules(schedules)
+
+        assert monday == mealpy.Schedule(
+            'id1',
+            '20190401',
+            mealpy.Meal('id1_meal', 'Bowl', 'asian'),
+            mealpy.Restaurant('id1_restaurant', 'Poke', 'RestaurantAddress', 'Financial District', 'San Francisco'),
+        )
+        assert tuesday.date == '20190402'
+        assert tuesday.restaurant is monday.restaurant
+        assert tuesday.meal is monday.meal
+        assert other.restaurant.neighborhood is monday.restaurant.neighborhood
+        assert not hasattr(monday, '__dict__')
+
+    @staticmethod
+    def test_dict_style_access(schedules):
+        schedule = mealpy.compact_schedules(schedules)[0]
+
+        assert schedule['id'] == 'id1'
+        assert schedule['restaurant']['name'] == 'Poke'
+        assert schedule['meal']['name'] == 'Bowl'
+        with pytest.raises(KeyError):
+            schedule['priority']  # pylint: disable=pointless-statement
+
+    @staticmethod
+    def test_menu(schedules):
+        menu = mealpy.Menu(mealpy.compact_schedules(schedules))
+
+        assert menu.find(' poke ').id == 'id1'
+        assert menu.find('roll').id == 'id3'
+        assert menu.get_by_id('id2').date == '20190402'
+
+    @staticmethod
+    def test_get_schedules_compact(mock_responses):
+        mock_responses.add(
+            responses.RequestsMock.GET,
+            mealpy.MENU_URL.format('mock_objectId'),
+            json={'schedules': standin.DEFAULT_SCHEDULES},
+        )
+        mealpal = mealpy.MealPal()
+        mealpal.city_cache.update([{'name': 'San Francisco', 'objectId': 'mock_objectId'}])
+
+        menu = mealpal.get_schedules('San Francisco', compact=True)
+
+        assert all(isinstance(i, mealpy.Schedule) for i in menu)
+        reservations = mealpal.prepare_reservations('mock_timing', 'San Francisco', ['Poke Bowl'], menu=menu)
+        assert reservations[0]['schedule_id'] == 'standin_schedule_2'
+
+
+class TestMenuIndex:
+
+    @staticmethod
+    @pytest.fixture
+    def menu():
+        yield mealpy.Menu([
+            standin.make_schedule('id1', 'Coast Poke Counter - Battery St.', 'Spicy Tuna'),
+            standin.make_schedule('id2', 'Sushirrito', 'Poke  Bowl'),
+            standin.make_schedule('id3', 'Poke Bar', 'Salad'),
+        ])
+
+    @staticmethod
+    def test_trigrams():
+        assert mealpy.trigrams('Poke, bo') == {' po', 'pok', 'oke', 'ke ', ' bo', 'bo '}
+
+    @staticmethod
+    @pytest.mark.parametrize('query,ids', [
+        ('POKE', ['id1', 'id2', 'id3']),
+        ('coast poke', ['id1']),
+        ('poek bowl', ['id2']),
+        ('batery', ['id1']),
+        # Meal descriptions, which read "MEAL, served at RESTAURANT."
+        ('salad served', ['id3']),
+        ('pizza', []),
+        ('-', []),
+    ])
+    def test_search(menu, query, ids):
+        assert [i['id'] for i in menu.search(query)] == ids
+
+    @staticmethod
+    def test_search_best_first(menu):
+        assert [i['id'] for i in menu.search('poke bar')][:1] == ['id3']
+
+    @staticmethod
+    def test_json_round_trip(menu):
+        index = mealpy.MenuIndex.from_json(json.loads(json.dumps(menu.index.to_json())))
+
+        assert index.search('poek bowl') == ['id2']
+
+    @staticmethod
+    def test_find_fuzzy(menu):
+        assert menu.find('sushirrito', fuzzy=True)['id'] == 'id2'
+        assert menu.find('sushirito', fuzzy=True)['id'] == 'id2'
+        with pytest.raises(mealpy.ScheduleNotFoundError):
+            menu.find('sushirito')
+        with pytest.raises(mealpy.ScheduleNotFoundError):
+            menu.find('pizza', fuzzy=True)
+
+    @staticmethod
+    def test_prepare_reservations_fuzzy(menu, capsys):
+        mealpal = mealpy.MealPal()
+
+        reservations = mealpal.prepare_reservations(
+            'mock_timing', 'mock_city', ['spicy tuna', 'poke bowll'], menu=menu, fuzzy=True,
+        )
+
+        assert [i['schedule_id'] for i in reservations] == ['id1', 'id2']
+        assert capsys.readouterr().out == "Taking 'poke bowll' to mean Poke  Bowl at Sushirrito.\n"
+
+    @staticmethod
+    def test_prepare_until_found_fuzzy_does_not_stream():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+
+        mealpy.prepare_until_found(
+            mock_mealpal, ['restaurant_name'], 'mock_timing', 'mock_city', stream=True, fuzzy=True,
+        )
+
+        assert not mock_mealpal.find_schedule.called
+        mock_mealpal.prepare_reservations.assert_called_once_with(
+            'mock_timing', 'mock_city', ['restaurant_name'], menu=None, fuzzy=True,
+        )
+
+    @staticmethod
+    def test_reserve_command_fuzzy():
+        with mock.patch.object(mealpy, 'execute_reserve_meal') as mock_execute_reserve_meal:
+            result = CliRunner().invoke(mealpy.cli, ['reserve', 'poek', 'mock_timing', 'mock_city', '--fuzzy'])
+
+        assert result.exit_code == 0
+        mock_execute_reserve_meal.assert_called_once_with(
+            ['poek'], 'mock_timing', 'mock_city', stream=False, fuzzy=True,
+        )
+
+
+class TestRankedChoices:
+
+    @staticmethod
+    @pytest.fixture
+    def menu():
+        yield mealpy.Menu(standin.DEFAULT_SCHEDULES)
+
+    @staticmethod
+    def test_prepare_reservations(menu):
+        mealpal = mealpy.MealPal()
+
+        reservations = mealpal.prepare_reservations(
+            'mock_timing', 'mock_city', ['NotFound', 'poke bowl', 'RestaurantName', 'Coast Poke Counter - Battery St.'],
+            menu=menu,
+        )
+
+        assert [i['schedule_id'] for i in reservations] == ['standin_schedule_2', 'standin_schedule_1']
+        assert mealpal.reserve_data is reservations[0]
+
+    @staticmethod
+    def test_prepare_reservations_fetches_menu_once(menu):
+        mealpal = mealpy.MealPal()
+
+        with mock.patch.object(mealpal, 'get_schedules', return_value=menu) as mock_get_schedules:
+            mealpal.prepare_reservations('mock_timing', 'mock_city', ['RestaurantName', 'Poke Bowl'])
+
+        mock_get_schedules.assert_called_once_with('mock_city')
+
+    @staticmethod
+    def test_prepare_reservations_none_found(menu):
+        with pytest.raises(mealpy.ScheduleNotFoundError):
+            mealpy.MealPal().prepare_reservations('mock_timing', 'mock_city', ['NotFound'], menu=menu)
+
+    @staticmethod
+    def test_fire_until_success_moves_through_choices():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.fire.side_effect = [400, 400, 400, 200]
+
+        reserve_data = mealpy.fire_until_success(mock_mealpal, [{'schedule_id': 1}, {'schedule_id': 2}])
+
+        assert reserve_data == {'schedule_id': 2}
+        assert [i[0][0]['schedule_id'] for i in mock_mealpal.fire.call_args_list] == [1, 2, 1, 2]
+
+    @staticmethod
+    def test_prepare_until_found_stream():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        schedule = {'id': 'id1', 'restaurant': {'name': 'RestaurantName'}, 'meal': {'name': 'Meal'}}
+        mock_mealpal.find_schedule.return_value = schedule
+
+        mealpy.prepare_until_found(mock_mealpal, ['RestaurantName'], 'mock_timing', 'mock_city', stream=True)
+
+        mock_mealpal.find_schedule.assert_called_once_with('mock_city', name='RestaurantName')
+        (_, _, choices), kwargs = mock_mealpal.prepare_reservations.call_args
+        assert choices == ['RestaurantName']
+        assert kwargs['menu'].find('RestaurantName') is schedule
+
+    @staticmethod
+    def test_reserve_command_fallbacks():
+        with mock.patch.object(mealpy, 'execute_reserve_meal') as mock_execute_reserve_meal, \
+                mock.patch.object(mealpy, 'initialize_directories'):
+            result = CliRunner().invoke(
+                mealpy.cli,
+                ['reserve', 'RestaurantName', 'mock_timing', 'mock_city', '-f', 'Poke Bowl', '-f', 'Other'],
+            )
+
+        assert result.exit_code == 0
+        mock_execute_reserve_meal.assert_called_once_with(
+            ['RestaurantName', 'Poke Bowl', 'Other'], 'mock_timing', 'mock_city', stream=False, fuzzy=False,
+        )
+
+
 class TestCurrentMeal:
 
     @staticmethod
@@ -651,3 +1174,1255 @@ class TestReserve:
                 restaurant_name='restaurant_name',
                 cancel_current_meal=True,
             )
+
+    @staticmethod
+    def test_prepare_reservation_then_fire(mock_responses):
+        mock_responses.add(responses.RequestsMock.POST, mealpy.RESERVATION_URL, status=200)
+        mealpal = mealpy.MealPal()
+
+        with mock.patch.object(
+                mealpy.MealPal,
+                'get_schedule_by_restaurant_name',
+                return_value={'id': 'mock_schedule_id'},
+        ) as mock_get_schedule_by_restaurant:
+            reserve_data = mealpal.prepare_reservation('mock_timing', 'mock_city', restaurant_name='restaurant_name')
+
+        assert mock_get_schedule_by_restaurant.call_count == 1
+        assert not mock_responses.calls
+
+        assert mealpal.fire() == 200
+        assert mealpal.fire() == 200
+        assert len(mock_responses.calls) == 2
+        assert reserve_data['schedule_id'] == 'mock_schedule_id'
+        assert 'schedule_id=mock_schedule_id' in mock_responses.calls[0].request.body
+
+    @staticmethod
+    @pytest.fixture
+    def menu():
+        yield mealpy.Menu([standin.make_schedule('id1', 'Poke', 'Bowl'), standin.make_schedule('id2', 'Sushi', 'Roll')])
+
+    @staticmethod
+    def test_hot_send_same_request(mock_responses, menu):
+        mock_responses.add(responses.RequestsMock.POST, mealpy.RESERVATION_URL, status=200)
+        mealpal = mealpy.MealPal()
+        mealpal.session.cookies.set('mock_cookie', 'mock_value')
+        reservations = mealpal.prepare_reservations('mock_timing', 'mock_city', ['Poke', 'Sushi'], menu=menu)
+
+        with mock.patch.object(mealpal.session, 'post') as mock_post:
+            assert mealpal.fire(reservations[1]) == 200
+
+        assert not mock_post.called
+        mealpal.hot_send = False
+        assert mealpal.fire(reservations[1]) == 200
+        hot, cold = (i.request for i in mock_responses.calls)
+        assert hot.body == cold.body
+        assert 'schedule_id=id2' in hot.body
+        assert dict(hot.headers) == dict(cold.headers)
+        assert hot.headers['Cookie'] == 'mock_cookie=mock_value'
+
+    @staticmethod
+    def test_hot_send_unprepared_payload(mock_responses):
+        mock_responses.add(responses.RequestsMock.POST, mealpy.RESERVATION_URL, status=200)
+        mealpal = mealpy.MealPal()
+
+        assert mealpal.fire({'schedule_id': 'mock_schedule_id'}) == 200
+        assert mock_responses.calls[0].request.body == 'schedule_id=mock_schedule_id'
+
+    @staticmethod
+    def test_login_drops_prepared_requests(mock_responses, menu):
+        mock_responses.add(responses.RequestsMock.POST, mealpy.LOGIN_URL, status=200, json={})
+        mealpal = mealpy.MealPal()
+        mealpal.prepare_reservations('mock_timing', 'mock_city', ['Poke'], menu=menu)
+        assert mealpal.prepared_requests
+
+        mealpal.login('mock_user', 'mock_password')
+
+        assert not mealpal.prepared_requests
+
+    @staticmethod
+    def test_fire_not_prepared():
+        mealpal = mealpy.MealPal()
+        with pytest.raises(AssertionError):
+            mealpal.fire()
+
+    @staticmethod
+    def test_execute_reserve_meal_fires_prepared_reservation():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.prepare_reservations.side_effect = [mealpy.ScheduleNotFoundError(), [{'schedule_id': 1}]]
+        mock_mealpal.fire.side_effect = [500, 200]
+
+        with mock.patch.object(mealpy, 'initialize_mealpal', return_value=mock_mealpal), \
+                mock.patch.object(mealpy.time, 'sleep'):
+            mealpy.execute_reserve_meal(['restaurant_name'], 'mock_timing', 'mock_city')
+
+        assert mock_mealpal.prepare_reservations.call_count == 2
+        assert mock_mealpal.fire.call_args_list == [mock.call({'schedule_id': 1})] * 2
+
+
+class TestScheduledReservation:
+
+    @staticmethod
+    def test_next_occurrence_later_today():
+        now = datetime.datetime(2019, 4, 1, 12, 0, 0)
+        assert mealpy.next_occurrence('17:00:00', now) == datetime.datetime(2019, 4, 1, 17, 0, 0)
+
+    @staticmethod
+    def test_next_occurrence_tomorrow():
+        now = datetime.datetime(2019, 4, 1, 17, 0, 0)
+        assert mealpy.next_occurrence('17:00:00', now) == datetime.datetime(2019, 4, 2, 17, 0, 0)
+
+    @staticmethod
+    @pytest.mark.parametrize('now', [
+        datetime.datetime(2019, 4, 1, 16, 59, 55),
+        # A job running late still belongs to that day's opening
+        datetime.datetime(2019, 4, 1, 17, 0, 0),
+        datetime.datetime(2019, 4, 1, 18, 30, 0),
+    ])
+    def test_nearest_occurrence(now):
+        assert mealpy.nearest_occurrence('17:00:00', now) == datetime.datetime(2019, 4, 1, 17, 0, 0)
+
+    @staticmethod
+    def test_precise_wait():
+        target = time.time() + 0.05
+
+        mealpy.precise_wait(target)
+
+        assert 0 <= time.time() - target < 0.01
+
+    @staticmethod
+    def test_precise_wait_in_the_past():
+        with mock.patch.object(mealpy.time, 'sleep') as mock_sleep:
+            mealpy.precise_wait(time.time() - 1)
+
+        assert not mock_sleep.called
+
+    @staticmethod
+    def test_execute_scheduled_reservation(capsys):
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.prepare_reservations.return_value = [{'schedule_id': 1}]
+        mock_mealpal.fire.return_value = 200
+        mock_mealpal.connections_opened.return_value = 0
+
+        with mock.patch.object(mealpy, 'precise_wait') as mock_precise_wait:
+            reserved = mealpy.execute_scheduled_reservation(
+                mock_mealpal, ['restaurant_name'], 'mock_timing', 'mock_city', 123.0, sync_clock=False,
+            )
+
+        assert reserved == {'schedule_id': 1}
+        assert mock_precise_wait.call_args_list == [mock.call(121.0), mock.call(123.0)]
+        assert mock_mealpal.warm_up.call_args_list == [mock.call(2), mock.call(2)]
+        assert mock_mealpal.fire.call_count == 1
+        output = capsys.readouterr().out
+        assert 'from target' in output
+        assert 'reused warm connections' in output
+
+    @staticmethod
+    def test_execute_scheduled_reservation_retries():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.prepare_reservations.return_value = [{'schedule_id': 1}, {'schedule_id': 2}]
+        mock_mealpal.fire.side_effect = [400, 400, 200]
+        mock_mealpal.connections_opened.side_effect = [0, 1]
+
+        with mock.patch.object(mealpy, 'precise_wait'):
+            reserved = mealpy.execute_scheduled_reservation(
+                mock_mealpal, ['restaurant_name'], 'mock_timing', 'mock_city', 123.0, sync_clock=False,
+                warm_connections=0,
+            )
+
+        assert mock_mealpal.fire.call_args_list == [
+            mock.call(),
+            mock.call({'schedule_id': 2}),
+            mock.call({'schedule_id': 1}),
+        ]
+        assert reserved == {'schedule_id': 1}
+        assert not mock_mealpal.warm_up.called
+
+    @staticmethod
+    def test_execute_scheduled_reservation_gives_up():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.prepare_reservations.return_value = [{'schedule_id': 1}]
+        mock_mealpal.fire.return_value = 400
+        mock_mealpal.connections_opened.return_value = 0
+
+        with mock.patch.object(mealpy, 'precise_wait'):
+            reserved = mealpy.execute_scheduled_reservation(
+                mock_mealpal, ['restaurant_name'], 'mock_timing', 'mock_city', time.time(), sync_clock=False,
+                warm_connections=0, give_up_at=time.time() + 0.05,
+            )
+
+        assert reserved is None
+        assert mock_mealpal.fire.call_count > 1
+
+    @staticmethod
+    def test_prepare_until_found_prefetched_menu():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.prepare_reservations.side_effect = [mealpy.ScheduleNotFoundError(), [{'schedule_id': 1}]]
+        menu = mealpy.Menu([])
+
+        with mock.patch.object(mealpy.time, 'sleep') as mock_sleep:
+            reservations = mealpy.prepare_until_found(
+                mock_mealpal, ['restaurant_name'], 'mock_timing', 'mock_city', menu=menu,
+            )
+
+        assert reservations == [{'schedule_id': 1}]
+        assert mock_mealpal.prepare_reservations.call_args_list == [
+            mock.call('mock_timing', 'mock_city', ['restaurant_name'], menu=menu, fuzzy=False),
+            mock.call('mock_timing', 'mock_city', ['restaurant_name'], menu=None, fuzzy=False),
+        ]
+        assert not mock_sleep.called
+
+    @staticmethod
+    def test_prepare_until_found_gives_up():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.prepare_reservations.side_effect = mealpy.ScheduleNotFoundError()
+
+        with mock.patch.object(mealpy.time, 'sleep'), pytest.raises(mealpy.ScheduleNotFoundError):
+            mealpy.prepare_until_found(
+                mock_mealpal, ['restaurant_name'], 'mock_timing', 'mock_city', give_up_at=time.time() + 0.05,
+            )
+
+        assert mock_mealpal.prepare_reservations.call_count > 1
+
+    @staticmethod
+    def test_execute_scheduled_reservation_sync_clock():
+        mock_mealpal = mock.Mock()
+        mock_mealpal.prepare_reservations.return_value = [{'schedule_id': 1}]
+        mock_mealpal.fire.return_value = 200
+        mock_mealpal.connections_opened.return_value = 0
+
+        with mock.patch.object(mealpy, 'precise_wait') as mock_precise_wait, \
+                mock.patch.object(mealpy.ServerClock, 'probe', autospec=True) as mock_probe:
+            def probe(clock, _session, **_kwargs):
+                clock.offset = 2.0
+                clock.rtt = 0.2
+                return clock
+            mock_probe.side_effect = probe
+
+            mealpy.execute_scheduled_reservation(
+                mock_mealpal, ['restaurant_name'], 'mock_timing', 'mock_city', 123.0, warm_connections=0,
+            )
+
+        assert mock_precise_wait.call_args == mock.call(pytest.approx(120.9))
+
+
+class TestServerClock:
+
+    @staticmethod
+    def mock_session(server_offset, headers=None):
+        def head(_url):
+            date = email.utils.formatdate(time.time() + server_offset, usegmt=True)
+            return mock.Mock(headers={'Date': date} if headers is None else headers)
+
+        return mock.Mock(**{'head.side_effect': head})
+
+    def test_probe_offset(self):
+        clock = mealpy.ServerClock().probe(self.mock_session(2.3))
+
+        assert clock.offset == pytest.approx(2.3, abs=0.25)
+        assert clock.estimated_server_now() == pytest.approx(time.time() + 2.3, abs=0.25)
+        assert 0 <= clock.send_ahead < 0.01
+
+    def test_probe_no_date_header(self):
+        with mock.patch.object(mealpy.time, 'sleep'):
+            clock = mealpy.ServerClock().probe(self.mock_session(0, headers={}), samples=2)
+
+        assert clock.offset == 0.0
+        assert clock.rtt >= 0
+
+    def test_probe_inconsistent_dates(self):
+        session = self.mock_session(0)
+        session.head.side_effect = [
+            mock.Mock(headers={'Date': email.utils.formatdate(time.time() - 100, usegmt=True)}),
+            mock.Mock(headers={'Date': email.utils.formatdate(time.time() + 100, usegmt=True)}),
+        ]
+
+        with mock.patch.object(mealpy.time, 'sleep'):
+            clock = mealpy.ServerClock().probe(session, samples=2)
+
+        assert abs(clock.offset) == pytest.approx(100, abs=1)
+
+    @staticmethod
+    def test_send_time():
+        clock = mealpy.ServerClock()
+        clock.offset = -1.5
+        clock.rtt = 0.1
+
+        assert clock.send_time(100.0) == pytest.approx(101.45)
+
+
+class TestBurstFire:
+
+    @staticmethod
+    def test_burst_fire_stops_after_success():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.fire.side_effect = [400, 200]
+
+        results = mealpy.burst_fire(mock_mealpal, time.time() + 0.2, attempts=4, interval=0.05)
+
+        assert [i.status_code for i in results] == [400, 200, None, None]
+        assert [i.offset is None for i in results] == [False, False, True, True]
+        assert results[0].offset == pytest.approx(-0.075, abs=0.01)
+        assert results[1].offset == pytest.approx(-0.025, abs=0.01)
+        assert mock_mealpal.fire.call_count == 2
+
+    @staticmethod
+    def test_burst_fire_request_error():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.fire.side_effect = requests.ConnectionError()
+
+        results = mealpy.burst_fire(mock_mealpal, time.time(), attempts=2, interval=0)
+
+        assert [i.status_code for i in results] == [None, None]
+        assert all(i.latency is not None for i in results)
+
+    @staticmethod
+    def test_execute_scheduled_reservation_burst(capsys):
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.prepare_reservations.return_value = [{'schedule_id': 1}]
+        mock_mealpal.connections_opened.return_value = 0
+        mock_mealpal.warm_up.return_value = 3
+        results = [
+            mealpy.BurstAttempt(0, -0.01, 0.1, 400),
+            mealpy.BurstAttempt(1, 0.01, 0.1, 200),
+            mealpy.BurstAttempt(2, None, None, None),
+        ]
+
+        with mock.patch.object(mealpy, 'burst_fire', return_value=results) as mock_burst_fire:
+            mealpy.execute_scheduled_reservation(
+                mock_mealpal, ['restaurant_name'], 'mock_timing', 'mock_city', 123.0, sync_clock=False, burst=3,
+            )
+
+        mock_burst_fire.assert_called_once_with(mock_mealpal, 123.0, 3, mealpy.DEFAULT_BURST_INTERVAL)
+        assert mock_mealpal.warm_up.call_args_list == [mock.call(3), mock.call(3)]
+        assert not mock_mealpal.fire.called
+        output = capsys.readouterr().out
+        assert 'Attempt 1: sent +10.0ms from target, status 200' in output
+        assert 'Attempt 2: dropped.' in output
+        assert '3 warm connection(s) ready.' in output
+        assert 'Reservation success!' in output
+
+
+class TestBatchReservation:
+
+    @staticmethod
+    @pytest.fixture
+    def accounts():
+        yield [
+            {'name': 'alice', 'city': 'San Francisco', 'reservation_time': 'mock_timing', 'restaurant': 'Poke'},
+            {'name': 'bob', 'city': 'San Francisco', 'reservation_time': 'mock_timing', 'meal': 'Bowl'},
+            {'name': 'carol', 'city': 'San Francisco', 'reservation_time': 'mock_timing', 'meal': 'NotFound'},
+            {'name': 'dave', 'city': 'Seattle', 'reservation_time': 'mock_timing', 'restaurant': 'Poke'},
+        ]
+
+    @staticmethod
+    @pytest.fixture
+    def mealpals(accounts):
+        menu = mealpy.Menu([{'id': 'id1', 'restaurant': {'name': 'Poke'}, 'meal': {'name': 'Bowl'}}])
+        _mealpals = {}
+        for account in accounts:
+            mealpal = mealpy.MealPal()
+            mealpal.get_schedules = mock.Mock(return_value=menu)
+            mealpal.fire = mock.Mock(return_value=200)
+            _mealpals[account['name']] = mealpal
+        yield _mealpals
+
+    @staticmethod
+    def test_load_batch(tmp_path):
+        batch_path = tmp_path / 'batch.yaml'
+        batch_path.write_text(
+            'accounts:\n'
+            '- name: alice\n'
+            '  email_address: alice@example.com\n'
+            '  city: San Francisco\n'
+            '  reservation_time: 12:15pm-12:30pm\n'
+            '  restaurant: Coast Poke Counter - Battery St.\n',
+        )
+
+        batch = mealpy.load_batch(batch_path)
+
+        assert batch['accounts'][0]['restaurant'] == 'Coast Poke Counter - Battery St.'
+
+    @staticmethod
+    def test_load_batch_missing_target(tmp_path):
+        batch_path = tmp_path / 'batch.yaml'
+        batch_path.write_text(
+            'accounts:\n'
+            '- name: alice\n'
+            '  email_address: alice@example.com\n'
+            '  city: San Francisco\n'
+            '  reservation_time: 12:15pm-12:30pm\n',
+        )
+
+        with pytest.raises(ValueError):
+            mealpy.load_batch(batch_path)
+
+    @staticmethod
+    @pytest.mark.parametrize('name', ['.', '..', 'alice/bob'])
+    def test_load_batch_bad_name(tmp_path, name):
+        batch_path = tmp_path / 'batch.yaml'
+        batch_path.write_text(
+            'accounts:\n'
+            f'- name: "{name}"\n'
+            '  email_address: alice@example.com\n'
+            '  city: San Francisco\n'
+            '  reservation_time: 12:15pm-12:30pm\n'
+            '  meal: Poke Bowl\n',
+        )
+
+        with pytest.raises(strictyaml.YAMLValidationError):
+            mealpy.load_batch(batch_path)
+
+    @staticmethod
+    def test_prepare_batch_fetches_each_menu_once(accounts, mealpals):
+        prepared = mealpy.prepare_batch(mealpals, accounts)
+
+        assert [account['name'] for account, _ in prepared] == ['alice', 'bob', 'dave']
+        assert mealpals['alice'].get_schedules.call_count == 1
+        assert not mealpals['bob'].get_schedules.called
+        assert mealpals['dave'].get_schedules.call_count == 1
+        assert mealpals['bob'].reserve_data['schedule_id'] == 'id1'
+
+    @staticmethod
+    def test_execute_batch_reservation(accounts, mealpals):
+        with mock.patch.object(mealpy, 'precise_wait') as mock_precise_wait, \
+                mock.patch.object(mealpy.MealPal, 'warm_up') as mock_warm_up:
+            mealpy.execute_batch_reservation(mealpals, accounts, 123.0, sync_clock=False)
+
+        assert sorted(mock_precise_wait.call_args_list) == [mock.call(121.0)] * 3 + [mock.call(123.0)] * 3
+        assert mock_warm_up.call_args_list == [mock.call(1)] * 3
+        assert [mealpals[i].fire.call_count for i in ('alice', 'bob', 'carol', 'dave')] == [1, 1, 0, 1]
+
+    @staticmethod
+    def test_execute_batch_reservation_gives_up(accounts, mealpals, capsys):
+        mealpals['bob'].fire.return_value = 400
+
+        with mock.patch.object(mealpy.MealPal, 'warm_up'):
+            mealpy.execute_batch_reservation(mealpals, accounts, time.time(), sync_clock=False, retry_for=0.05)
+
+        assert mealpals['bob'].fire.call_count > 1
+        output = capsys.readouterr().out
+        assert 'alice: reserved.' in output
+        assert 'bob: not reserved.' in output
+
+    @staticmethod
+    def test_execute_batch_reservation_nothing_found(accounts, mealpals):
+        with mock.patch.object(mealpy, 'precise_wait') as mock_precise_wait:
+            mealpy.execute_batch_reservation(mealpals, accounts[2:3], 123.0)
+
+        assert not mock_precise_wait.called
+
+    @staticmethod
+    def test_initialize_mealpal_account(tmp_path):
+        with mock.patch.object(mealpy, 'get_cache_dir', return_value=tmp_path), \
+                mock.patch.object(mealpy, 'load_config', return_value={}), \
+                mock.patch('getpass.getpass', return_value='password') as mock_getpass, \
+                mock.patch.object(mealpy.MealPal, 'login') as mock_login:
+            mealpy.initialize_mealpal(account='alice', email='alice@example.com')
+
+        mock_login.assert_called_once_with('alice@example.com', 'password')
+        assert 'alice@example.com' in mock_getpass.call_args[0][0]
+        assert (tmp_path / 'alice' / mealpy.COOKIES_FILENAME).exists()
+
+
+class TestWarmUp:
+
+    @staticmethod
+    @pytest.fixture
+    def standin_mealpal(mock_responses):
+        with standin.StandInMealPal(latency=0.05) as _standin_mealpal:
+            mock_responses.add_passthru(_standin_mealpal.base_url)
+            yield _standin_mealpal
+
+    @staticmethod
+    def test_pool_size():
+        mealpal = mealpy.MealPal(pool_size=20)
+
+        assert mealpal.session.get_adapter(mealpy.BASE_URL)._pool_maxsize == 20
+
+    @staticmethod
+    def test_warm_up_then_fire_reuses_connection(standin_mealpal):
+        mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url, pool_size=4)
+
+        assert mealpal.warm_up(3) == 3
+        connections_opened = mealpal.connections_opened()
+        assert connections_opened == 3
+
+        assert mealpal.fire({'schedule_id': 'standin_schedule_1'}) == 200
+        assert mealpal.connections_opened() == connections_opened
+
+    @staticmethod
+    def test_connections_opened_cold(standin_mealpal):
+        mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+
+        assert mealpal.connections_opened() == 0
+        assert mealpal.idle_connections() == 0
+
+
+class TestInitializeMealPal:
+
+    @staticmethod
+    @pytest.fixture
+    def cache_dir(tmp_path):
+        (tmp_path / mealpy.COOKIES_FILENAME).write_text('# Netscape HTTP Cookie File\n')
+        with mock.patch.object(mealpy, 'get_cache_dir', return_value=tmp_path), \
+                mock.patch.object(mealpy, 'load_config', return_value={}):
+            yield tmp_path
+
+    @staticmethod
+    @pytest.fixture
+    def mock_login():
+        credentials = mealpy.Credentials('email', 'password', 'prompt')
+        with mock.patch.object(mealpy, 'get_mealpal_credentials', return_value=credentials), \
+                mock.patch.object(mealpy.MealPal, 'login') as _mock_login:
+            yield _mock_login
+
+    @staticmethod
+    def test_valid_cookies(mock_responses, cache_dir, mock_login):
+        mock_responses.add(responses.RequestsMock.POST, mealpy.KITCHEN_URL, json={'result': {'status': 'OPEN'}})
+
+        mealpy.initialize_mealpal()
+
+        assert not mock_login.called
+        assert (cache_dir / mealpy.COOKIES_VALIDATED_FILENAME).exists()
+
+    @staticmethod
+    def test_recently_validated_cookies(mock_responses, cache_dir, mock_login):
+        (cache_dir / mealpy.COOKIES_VALIDATED_FILENAME).write_text(str(time.time()))
+
+        mealpy.initialize_mealpal()
+
+        assert not mock_responses.calls
+        assert not mock_login.called
+
+    @staticmethod
+    @pytest.mark.parametrize('kitchen_response', [
+        {'status': 401},
+        {'status': 200, 'json': {'code': 209, 'error': 'invalid session token'}},
+        {'body': requests.Timeout()},
+    ])
+    def test_invalid_cookies_relogin_without_sleeping(mock_responses, cache_dir, mock_login, kitchen_response):
+        (cache_dir / mealpy.COOKIES_VALIDATED_FILENAME).write_text('0')
+        mock_responses.add(responses.RequestsMock.POST, mealpy.KITCHEN_URL, **kitchen_response)
+
+        with mock.patch.object(mealpy.time, 'sleep') as mock_sleep:
+            mealpy.initialize_mealpal()
+
+        mock_login.assert_called_once_with('email', 'password')
+        assert not mock_sleep.called
+        assert float((cache_dir / mealpy.COOKIES_VALIDATED_FILENAME).read_text()) > 0
+
+    @staticmethod
+    def test_validate_cookies_timeout(mock_responses):
+        mock_responses.add(responses.RequestsMock.POST, mealpy.KITCHEN_URL, json={'result': {}})
+
+        mealpal = mealpy.MealPal()
+
+        with mock.patch.object(mealpal.session, 'post', wraps=mealpal.session.post) as mock_post:
+            assert mealpal.validate_cookies(timeout=0.5)
+
+        assert mock_post.call_args[1]['timeout'] == 0.5
+
+
+class TestCredentials:
+
+    @staticmethod
+    @pytest.fixture
+    def config():
+        _config = {'email_address': 'mock@example.com', 'use_keyring': False}
+        with mock.patch.object(mealpy, 'load_config', return_value=_config):
+            yield _config
+
+    @staticmethod
+    @pytest.fixture
+    def mock_keyring():
+        _mock_keyring = mock.Mock()
+        with mock.patch.dict(sys.modules, {'keyring': _mock_keyring}):
+            yield _mock_keyring
+
+    @staticmethod
+    def test_env(config, monkeypatch):
+        config['password_source'] = 'env'
+        monkeypatch.setenv(mealpy.DEFAULT_PASSWORD_ENV, 'secret')
+
+        assert mealpy.get_mealpal_credentials() == ('mock@example.com', 'secret', 'env')
+
+    @staticmethod
+    def test_env_named(config, monkeypatch):
+        config.update(password_source='env', password_env='MOCK_PASSWORD')
+        monkeypatch.setenv('MOCK_PASSWORD', 'secret')
+
+        assert mealpy.get_mealpal_credentials('other@example.com', interactive=False).password == 'secret'
+
+    @staticmethod
+    def test_use_keyring(config, mock_keyring):
+        config['use_keyring'] = True
+        mock_keyring.get_password.return_value = 'secret'
+
+        assert mealpy.get_mealpal_credentials() == ('mock@example.com', 'secret', 'keyring')
+        mock_keyring.get_password.assert_called_once_with(mealpy.KEYRING_SERVICENAME, 'mock@example.com')
+
+    @staticmethod
+    @pytest.mark.parametrize('keyring_module', [None, mock.Mock(**{'get_password.return_value': None})])
+    def test_keyring_unavailable_unattended(config, keyring_module):
+        config['use_keyring'] = True
+
+        with mock.patch.dict(sys.modules, {'keyring': keyring_module}), \
+                mock.patch('getpass.getpass') as mock_getpass, pytest.raises(click.ClickException):
+            mealpy.get_mealpal_credentials(interactive=False)
+
+        assert not mock_getpass.called
+
+    @staticmethod
+    def test_falls_back_on_prompt_in_a_terminal(config, mock_keyring, capsys):
+        config['password_source'] = 'keyring'
+        mock_keyring.get_password.return_value = None
+
+        with mock.patch.object(sys.stdin, 'isatty', return_value=True), \
+                mock.patch('getpass.getpass', return_value='typed'):
+            credentials = mealpy.get_mealpal_credentials()
+
+        assert credentials == ('mock@example.com', 'typed', 'prompt')
+        assert 'No password for mock@example.com in the keyring.' in capsys.readouterr().out
+
+    @staticmethod
+    def test_prompt_unattended(config):
+        with pytest.raises(click.ClickException, match='unattended'):
+            mealpy.get_mealpal_credentials(interactive=False)
+
+    @staticmethod
+    def test_fd(config):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'secret\n')
+        os.close(write_fd)
+        config.update(password_source='fd', password_fd=read_fd)
+
+        try:
+            assert mealpy.get_mealpal_credentials().password == 'secret'
+            # Logging in again doesn't need the, by now empty, pipe
+            assert mealpy.get_mealpal_credentials().password == 'secret'
+        finally:
+            os.close(read_fd)
+            mealpy._fd_passwords.clear()  # pylint: disable=protected-access
+
+    @staticmethod
+    def test_encrypted_file(config, tmp_path, monkeypatch):
+        mock_fernet = mock.Mock()
+        mock_fernet.Fernet.return_value.decrypt.return_value = b'secret'
+        mock_fernet.InvalidToken = ValueError
+        (tmp_path / 'password').write_bytes(b'token')
+        config.update(password_source='encrypted_file', password_file=str(tmp_path / 'password'))
+        monkeypatch.setenv(mealpy.PASSWORD_KEY_ENV, 'key')
+
+        with mock.patch.dict(sys.modules, {'cryptography': mock.Mock(), 'cryptography.fernet': mock_fernet}):
+            assert mealpy.get_mealpal_credentials().password == 'secret'
+
+        mock_fernet.Fernet.assert_called_once_with(b'key')
+        mock_fernet.Fernet.return_value.decrypt.assert_called_once_with(b'token')
+
+    @staticmethod
+    def test_encrypted_file_without_key(config, tmp_path, monkeypatch):
+        config.update(password_source='encrypted_file', password_file=str(tmp_path / 'password'))
+        monkeypatch.delenv(mealpy.PASSWORD_KEY_ENV, raising=False)
+
+        with mock.patch.dict(sys.modules, {'cryptography': mock.Mock(), 'cryptography.fernet': mock.Mock()}), \
+                pytest.raises(click.ClickException, match=mealpy.PASSWORD_KEY_ENV):
+            mealpy.get_mealpal_credentials(interactive=False)
+
+    @staticmethod
+    def test_refused_password_not_retried(tmp_path, config, monkeypatch):
+        config['password_source'] = 'env'
+        monkeypatch.setenv(mealpy.DEFAULT_PASSWORD_ENV, 'wrong')
+
+        with mock.patch.object(mealpy, 'get_cache_dir', return_value=tmp_path), \
+                mock.patch.object(mealpy.MealPal, 'login', side_effect=requests.HTTPError()) as mock_login, \
+                pytest.raises(click.ClickException, match='env password source was refused'):
+            mealpy.initialize_mealpal()
+
+        assert mock_login.call_count == 1
+
+    @staticmethod
+    def test_prompted_password_kept_in_keyring(tmp_path, config, mock_keyring):
+        config['use_keyring'] = True
+        mock_keyring.get_password.return_value = None
+
+        with mock.patch.object(mealpy, 'get_cache_dir', return_value=tmp_path), \
+                mock.patch.object(sys.stdin, 'isatty', return_value=True), \
+                mock.patch('getpass.getpass', return_value='typed'), \
+                mock.patch.object(mealpy.MealPal, 'login'):
+            mealpy.initialize_mealpal()
+
+        mock_keyring.set_password.assert_called_once_with(mealpy.KEYRING_SERVICENAME, 'mock@example.com', 'typed')
+
+
+class TestStreamingMenu:
+
+    @staticmethod
+    def chunked(data, size):
+        return (data[i:i + size] for i in range(0, len(data), size))
+
+    @pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+    def test_iter_json_array(self, chunk_size):
+        data = {
+            'city': {'name': 'Zürich', 'nested': [1, {'schedules': []}]},
+            'count': 12345,
+            'schedules': [{'id': 1, 'name': 'Crème brûlée'}, {'id': 2}, 3.25, 'four'],
+            'generated_at': '2019-04-01T00:00:00Z',
+        }
+        chunks = self.chunked(json.dumps(data, indent=2, ensure_ascii=False).encode(), chunk_size)
+
+        assert list(mealpy.iter_json_array(chunks, 'schedules')) == data['schedules']
+
+    def test_iter_json_array_stops_early(self):
+        read = []
+
+        def chunks():
+            for chunk in self.chunked(json.dumps({'schedules': list(range(10000))}).encode(), 100):
+                read.append(chunk)
+                yield chunk
+
+        items = mealpy.iter_json_array(chunks(), 'schedules')
+
+        assert next(items) == 0
+        assert len(read) == 1
+
+    @staticmethod
+    def test_iter_json_array_missing_key():
+        assert not list(mealpy.iter_json_array([b'{"result": [1, 2]}'], 'schedules'))
+
+    @staticmethod
+    @pytest.mark.parametrize('data', [b'{"schedules": [1, 2', b'["schedules"]', b'{"schedules": [1, }]}', b''])
+    def test_iter_json_array_malformed(data):
+        with pytest.raises(ValueError):
+            list(mealpy.iter_json_array([data], 'schedules'))
+
+    @staticmethod
+    @pytest.fixture
+    def menu_url_response(mock_responses):
+        mock_responses.add(
+            responses.RequestsMock.GET,
+            mealpy.MENU_URL.format('mock_objectId'),
+            json={'schedules': standin.DEFAULT_SCHEDULES},
+        )
+        yield mock_responses
+
+    @staticmethod
+    @pytest.fixture
+    def mealpal():
+        _mealpal = mealpy.MealPal()
+        _mealpal.city_cache.update([{'name': 'San Francisco', 'objectId': 'mock_objectId'}])
+        yield _mealpal
+
+    @staticmethod
+    @pytest.mark.usefixtures('menu_url_response')
+    def test_find_schedule(mealpal):
+        schedule = mealpal.find_schedule('San Francisco', meal_name='Poke Bowl')
+
+        assert schedule['id'] == 'standin_schedule_2'
+
+    @staticmethod
+    @pytest.mark.usefixtures('menu_url_response')
+    def test_find_schedule_not_found(mealpal):
+        with pytest.raises(mealpy.ScheduleNotFoundError):
+            mealpal.find_schedule('San Francisco', restaurant_name='NotFound')
+
+    @staticmethod
+    @pytest.mark.usefixtures('menu_url_response')
+    @pytest.mark.parametrize('name', ['Poke Bowl', '  poke   BOWL ', 'coast poke counter - battery st.'])
+    def test_find_schedule_by_name(mealpal, name):
+        assert mealpal.find_schedule('San Francisco', name=name)['id'] == 'standin_schedule_2'
+
+    @staticmethod
+    def test_find_schedule_by_name_restaurant_precedence(mock_responses, mealpal):
+        mock_responses.add(
+            responses.RequestsMock.GET,
+            mealpy.MENU_URL.format('mock_objectId'),
+            json={
+                'schedules': [
+                    standin.make_schedule('id1', 'Other', 'Poke'),
+                    standin.make_schedule('id2', 'Other', 'Poke'),
+                    standin.make_schedule('id3', 'Poke', 'Bowl'),
+                ],
+            },
+        )
+
+        assert mealpal.find_schedule('San Francisco', name='poke')['id'] == 'id3'
+
+    @staticmethod
+    @pytest.mark.usefixtures('menu_url_response')
+    def test_find_schedule_by_name_not_found(mealpal):
+        with pytest.raises(mealpy.ScheduleNotFoundError):
+            mealpal.find_schedule('San Francisco', name='NotFound')
+
+    @staticmethod
+    @pytest.mark.usefixtures('menu_url_response')
+    def test_prepare_until_found_stream_meal(mealpal):
+        reservations = mealpy.prepare_until_found(mealpal, ['Poke Bowl'], 'mock_timing', 'San Francisco', stream=True)
+
+        assert [i['schedule_id'] for i in reservations] == ['standin_schedule_2']
+
+    @staticmethod
+    @pytest.mark.usefixtures('menu_url_response')
+    def test_prepare_reservation_stream(mealpal):
+        reserve_data = mealpal.prepare_reservation(
+            'mock_timing', 'San Francisco', restaurant_name='RestaurantName', stream=True,
+        )
+
+        assert reserve_data['schedule_id'] == 'standin_schedule_1'
+
+
+class TestAllMenus:
+
+    @staticmethod
+    @pytest.fixture
+    def cities_response(mock_responses):
+        mock_responses.add(
+            responses.RequestsMock.POST,
+            mealpy.CITIES_URL,
+            json={'result': [
+                {'name': 'Seattle', 'objectId': 'mock_seattle'},
+                {'name': 'San Francisco', 'objectId': 'mock_sf'},
+            ]},
+        )
+        for city_id, name in [('mock_seattle', 'Seattle Poke'), ('mock_sf', 'Poke Counter')]:
+            mock_responses.add(
+                responses.RequestsMock.GET,
+                mealpy.MENU_URL.format(city_id),
+                json={'schedules': [standin.make_schedule(f'{city_id}_schedule', name, 'Poke Bowl')]},
+            )
+        yield mock_responses
+
+    @staticmethod
+    def test_fetch_all_menus(cities_response):
+        mealpal = mealpy.MealPal()
+
+        menus = mealpal.fetch_all_menus()
+
+        assert list(menus) == ['San Francisco', 'Seattle']
+        assert menus['Seattle'].find('Seattle Poke').id == 'mock_seattle_schedule'
+        assert menus['San Francisco'].find('Poke Counter').id == 'mock_sf_schedule'
+        assert [i.request.url for i in cities_response.calls].count(mealpy.CITIES_URL) == 1
+
+    @staticmethod
+    def test_fetch_some_menus_cached_cities(cities_response):
+        mealpal = mealpy.MealPal()
+        mealpal.city_cache.update([{'name': 'Seattle', 'objectId': 'mock_seattle'}])
+
+        menus = mealpal.fetch_all_menus(['Seattle'], compact=False)
+
+        assert list(menus) == ['Seattle']
+        assert menus['Seattle'][0]['id'] == 'mock_seattle_schedule'
+        assert [i.request.url for i in cities_response.calls] == [mealpy.MENU_URL.format('mock_seattle')]
+        # Leaving the other responses unused is the point
+        cities_response.reset()
+
+    @staticmethod
+    def test_fetch_all_menus_concurrently(mock_responses):
+        latency = 0.2
+        cities = [dict(standin.DEFAULT_CITIES[0], name=f'City {i}', objectId=f'city_{i}') for i in range(5)]
+        with standin.StandInMealPal(cities=cities, latency=latency) as standin_mealpal:
+            mock_responses.add_passthru(standin_mealpal.base_url)
+            mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+
+            start = time.perf_counter()
+            menus = mealpal.fetch_all_menus()
+            elapsed = time.perf_counter() - start
+
+        assert list(menus) == [f'City {i}' for i in range(5)]
+        # The cities list, then every menu at once, rather than one menu after another
+        assert elapsed < latency * 4
+
+    @staticmethod
+    def test_menu_search():
+        menu = mealpy.Menu([
+            standin.make_schedule('id1', 'Coast Poke Counter - Battery St.', 'Spicy Tuna'),
+            standin.make_schedule('id2', 'Sushirrito', 'Poke  Bowl'),
+            standin.make_schedule('id3', 'Other', 'Salad'),
+        ])
+
+        assert [i['id'] for i in menu.search('POKE')] == ['id1', 'id2']
+        assert not menu.search('pizza')
+
+    @staticmethod
+    def test_search_command():
+        mock_mealpal = mock.Mock(spec=mealpy.MealPal)
+        mock_mealpal.fetch_all_menus.return_value = {
+            'San Francisco': mealpy.Menu(mealpy.compact_schedules([standin.make_schedule('id1', 'Poke', 'Bowl')])),
+            'Seattle': mealpy.Menu([standin.make_schedule('id2', 'Sushi', 'Poke Roll')]),
+        }
+
+        with mock.patch.object(mealpy, 'initialize_mealpal', return_value=mock_mealpal):
+            result = CliRunner().invoke(mealpy.cli, ['search', 'poke'])
+            assert result.output.splitlines() == ['San Francisco: Poke - Bowl', 'Seattle: Sushi - Poke Roll']
+            mock_mealpal.fetch_all_menus.assert_called_once_with(None)
+
+            result = CliRunner().invoke(mealpy.cli, ['search', 'pizza', '--city', 'Seattle'])
+            assert result.output == "Nothing matching 'pizza' on the menus of 2 cities.\n"
+            mock_mealpal.fetch_all_menus.assert_called_with(['Seattle'])
+
+
+class TestTracer:
+
+    @staticmethod
+    @pytest.fixture
+    def tracer(monkeypatch):
+        _tracer = mealpy.Tracer()
+        _tracer.enabled = True
+        monkeypatch.setattr(mealpy, 'TRACER', _tracer)
+        yield _tracer
+
+    @staticmethod
+    def test_disabled_records_nothing():
+        tracer = mealpy.Tracer()
+
+        with tracer.phase('mock_phase'):
+            pass
+
+        assert not tracer.spans
+
+    @staticmethod
+    def test_phase(tracer):
+        with tracer.phase('outer'):
+            with tracer.phase('inner'):
+                time.sleep(0.01)
+
+        assert [span.name for span in tracer.spans] == ['inner', 'outer']
+        assert tracer.spans[1].duration >= tracer.spans[0].duration >= 0.01
+
+    @staticmethod
+    def test_phase_records_on_error(tracer):
+        with pytest.raises(ValueError):
+            with tracer.phase('mock_phase'):
+                raise ValueError()
+
+        assert [span.name for span in tracer.spans] == ['mock_phase']
+
+    @staticmethod
+    def test_traced(tracer):
+        @mealpy.traced
+        def mock_function(value):
+            return value * 2
+
+        assert mock_function(2) == 4
+        assert [span.name for span in tracer.spans] == [mock_function.__qualname__]
+
+    @staticmethod
+    def test_traced_disabled(tracer):
+        tracer.enabled = False
+
+        @mealpy.traced
+        def mock_function():
+            return 'mock_result'
+
+        assert mock_function() == 'mock_result'
+        assert not tracer.spans
+
+    @staticmethod
+    def test_mealpal_methods_and_requests(tracer, mock_responses):
+        mock_responses.add(
+            responses.RequestsMock.POST,
+            mealpy.CITIES_URL,
+            json={'result': [{'name': 'San Francisco', 'objectId': 'mock_objectId'}]},
+        )
+        mock_responses.add(
+            responses.RequestsMock.GET,
+            mealpy.MENU_URL.format('mock_objectId'),
+            json={'schedules': standin.DEFAULT_SCHEDULES},
+        )
+        mealpal = mealpy.MealPal(cache_dir=None)
+        mealpal.city_cache = mealpy.CityCache()
+
+        mealpal.get_schedules('San Francisco')
+
+        names = {span.name for span in tracer.spans}
+        assert {
+            'MealPal.get_schedules',
+            'MealPal.get_city',
+            'MealPal.get_cities',
+            'parse menu',
+            'HTTP POST /1/functions/getCitiesWithNeighborhoods',
+        } <= names
+        assert any(name.startswith('HTTP GET /api/v1/cities/mock_objectId/') for name in names)
+
+    @staticmethod
+    def test_response_hook_start(tracer):
+        response = mock.Mock(url='https://example.com/mock_path', elapsed=datetime.timedelta(seconds=2))
+        response.request.method = 'GET'
+
+        before = time.perf_counter()
+        tracer.response_hook(response)
+
+        span, = tracer.spans
+        assert span.name == 'HTTP GET /mock_path'
+        assert span.duration == 2
+        assert before - 2 <= span.start + tracer.origin <= time.perf_counter() - 2
+
+    @staticmethod
+    def test_report(tracer):
+        tracer.record('mock_phase', time.perf_counter(), 0.0005)
+        tracer.record('mock_phase', time.perf_counter(), 0.003)
+        tracer.record('mock_phase', time.perf_counter(), 0.0031)
+        tracer.record('mock_once', time.perf_counter(), 0.1)
+
+        report = io.StringIO()
+        tracer.report(report)
+        lines = report.getvalue().splitlines()
+
+        assert lines[2].split() == ['mock_once', '1', '100.0', '100.0', '100.0']
+        assert lines[3].split() == ['mock_phase', '3', '6.6', '2.2', '3.1']
+        # Only phases which ran more than once get a histogram
+        assert lines[4:] == [
+            '',
+            'mock_phase',
+            '  <     1ms     1 ' + '#' * 20,
+            '  <     2ms     0 ',
+            '  <     4ms     2 ' + '#' * 40,
+        ]
+
+    @staticmethod
+    def test_write_json_lines(tracer, tmp_path):
+        with tracer.phase('mock_phase'):
+            pass
+
+        path = tmp_path / 'trace.jsonl'
+        tracer.write_json_lines(path)
+
+        span, = [json.loads(line) for line in path.read_text().splitlines()]
+        assert span['name'] == 'mock_phase'
+        assert span.keys() == {'name', 'start', 'duration'}
+
+    @staticmethod
+    @pytest.mark.parametrize(('args', 'method'), [
+        (['--trace'], 'report'),
+        (['--trace-file', 'trace.jsonl'], 'write_json_lines'),
+    ])
+    def test_cli(args, method, monkeypatch):
+        tracer = mealpy.Tracer()
+        monkeypatch.setattr(mealpy, 'TRACER', tracer)
+        monkeypatch.setattr(mealpy, 'initialize_directories', mock.Mock())
+        monkeypatch.setattr(mealpy, 'execute_reserve_meal', mock.Mock())
+
+        with mock.patch('atexit.register') as register:
+            result = CliRunner().invoke(
+                mealpy.cli, args + ['reserve', 'mock_restaurant', 'mock_time', 'mock_city'],
+            )
+
+        assert result.exit_code == 0, result.output
+        assert tracer.enabled
+        assert register.call_args[0][0] == getattr(tracer, method)
+
+
+class TestDaemon:
+
+    @staticmethod
+    @pytest.fixture
+    def daemon(tmp_path):
+        yield mealpy.Daemon(
+            mealpy.MealPal(),
+            tmp_path / 'cookies.txt',
+            tmp_path / 'targets.json',
+            tmp_path / 'daemon.sock',
+            reservation_kwargs={'sync_clock': False, 'warm_connections': 0},
+        )
+
+    @staticmethod
+    def test_set_list_remove(daemon):
+        daemon.handle({
+            'command': 'set',
+            'name': 'monday',
+            'choices': ['RestaurantName'],
+            'reservation_time': 'mock_time',
+            'city': 'mock_city',
+            'days': ['mon'],
+        })
+        daemon.handle({
+            'command': 'set',
+            'name': 'default',
+            'choices': ['Poke Bowl', 'RestaurantName'],
+            'reservation_time': 'mock_time',
+            'city': 'mock_city',
+        })
+
+        assert daemon.handle({'command': 'list'}) == {'targets': {
+            'monday': {
+                'choices': ['RestaurantName'],
+                'reservation_time': 'mock_time',
+                'city': 'mock_city',
+                'days': ['mon'],
+            },
+            'default': {
+                'choices': ['Poke Bowl', 'RestaurantName'],
+                'reservation_time': 'mock_time',
+                'city': 'mock_city',
+                'days': ['mon', 'tue', 'wed', 'thu', 'fri'],
+            },
+        }}
+        # Targets survive restarts
+        assert daemon.load_targets() == daemon.targets
+
+        daemon.handle({'command': 'remove', 'name': 'monday'})
+
+        assert list(daemon.load_targets()) == ['default']
+
+    @staticmethod
+    @pytest.mark.parametrize('request_', [
+        {'command': 'remove', 'name': 'unknown'},
+        {'command': 'set', 'name': 'mock_name', 'choices': [], 'reservation_time': 'mock_time', 'city': 'mock_city'},
+        {'command': 'set', 'name': 'mock_name', 'choices': ['mock_choice'], 'reservation_time': 'mock_time',
+         'city': 'mock_city', 'days': ['someday']},
+        {'command': 'unknown'},
+    ])
+    def test_handle_invalid(daemon, request_):
+        with pytest.raises(ValueError):
+            daemon.handle(request_)
+
+    @staticmethod
+    def test_control_socket(daemon):
+        server = daemon.serve_control()
+        try:
+            assert daemon.socket_path.stat().st_mode & 0o777 == 0o600
+            response = mealpy.send_daemon_command(
+                'set',
+                socket_path=daemon.socket_path,
+                name='mock_name',
+                choices=['mock_choice'],
+                reservation_time='mock_time',
+                city='mock_city',
+            )
+            assert list(response['targets']) == ['mock_name']
+
+            with pytest.raises(click.ClickException, match='No target named unknown'):
+                mealpy.send_daemon_command('remove', socket_path=daemon.socket_path, name='unknown')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    @staticmethod
+    def test_not_running(tmp_path):
+        with pytest.raises(click.ClickException, match='not running'):
+            mealpy.send_daemon_command('status', socket_path=tmp_path / 'daemon.sock')
+
+    @staticmethod
+    def test_reserve_todays_targets_in_order(daemon):
+        monday = datetime.datetime(2019, 4, 1, 17, 0, 0)
+        daemon.targets = {
+            name: {'choices': [name], 'reservation_time': 'mock_time', 'city': 'mock_city', 'days': days}
+            for name, days in [('b', ['mon']), ('a', ['mon', 'tue']), ('c', ['mon']), ('tuesday', ['tue'])]
+        }
+
+        with mock.patch.object(mealpy, 'nearest_occurrence', return_value=monday), \
+                mock.patch.object(mealpy, 'execute_scheduled_reservation') as mock_execute:
+            mock_execute.side_effect = [None, {'schedule_id': 'mock_schedule'}]
+            daemon.reserve()
+
+        assert [i[0][1] for i in mock_execute.call_args_list] == [['a'], ['b']]
+        assert mock_execute.call_args[1]['give_up_at'] == monday.timestamp() + mealpy.DEFAULT_RETRY_FOR
+        assert daemon.last_reservation['target'] == 'b'
+
+    @staticmethod
+    def test_prefetch_and_reserve(daemon, mock_responses, capsys):
+        opening = datetime.datetime.now() + datetime.timedelta(seconds=0.2)
+        with standin.StandInMealPal(open_at=opening.timestamp()) as standin_mealpal:
+            mock_responses.add_passthru(standin_mealpal.base_url)
+            daemon.mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+            daemon.targets = {'default': {
+                'choices': ['NotFound', 'Poke Bowl'],
+                'reservation_time': 'mock_time',
+                'city': 'San Francisco',
+                'days': list(mealpy.WEEKDAYS),
+            }}
+
+            with mock.patch.object(mealpy, 'nearest_occurrence', return_value=opening):
+                daemon.prefetch()
+                assert 'default: Poke Bowl on the menu so far.' in capsys.readouterr().out
+
+                with mock.patch.object(daemon.mealpal, 'get_schedules') as mock_get_schedules:
+                    daemon.reserve()
+
+        # The prefetched menu was used
+        assert not mock_get_schedules.called
+        assert not daemon.menus
+        assert [i['schedule_id'] for i in standin_mealpal.reservations] == ['standin_schedule_2']
+        assert standin_mealpal.reserved_at[0] >= opening.timestamp()
+        assert daemon.last_reservation['target'] == 'default'
+
+    @staticmethod
+    def test_reserve_target_not_on_menu(daemon, mock_responses, capsys):
+        opening = datetime.datetime.now()
+        daemon.retry_for = 0.2
+        with standin.StandInMealPal(open_at=opening.timestamp()) as standin_mealpal:
+            mock_responses.add_passthru(standin_mealpal.base_url)
+            daemon.mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+            daemon.targets = {'default': {
+                'choices': ['NotFound'],
+                'reservation_time': 'mock_time',
+                'city': 'San Francisco',
+                'days': list(mealpy.WEEKDAYS),
+            }}
+
+            with mock.patch.object(mealpy, 'nearest_occurrence', return_value=opening):
+                daemon.reserve()
+
+        assert 'Reserving default failed' in capsys.readouterr().out
+        assert not standin_mealpal.attempts
+        assert daemon.last_reservation is None
+
+    @staticmethod
+    def test_refresh_cookies(daemon, capsys):
+        daemon.mealpal = mock.Mock(spec=mealpy.MealPal)
+        daemon.mealpal.session = mock.Mock()
+        daemon.mealpal.menu_cache = mealpy.MenuCache()
+        daemon.mealpal.validate_cookies.return_value = True
+
+        daemon.refresh_cookies()
+
+        daemon.mealpal.session.cookies.save.assert_called_once_with(
+            daemon.cookies_path, ignore_discard=True, ignore_expires=True,
+        )
+        assert daemon.cookies_path.with_name(mealpy.COOKIES_VALIDATED_FILENAME).exists()
+
+        daemon.mealpal.validate_cookies.return_value = False
+        with mock.patch.object(mealpy, 'get_mealpal_credentials', side_effect=click.ClickException('No password.')):
+            daemon.refresh_cookies()
+
+        assert not daemon.cookies_valid
+        assert 'no longer valid, and logging in again failed: No password.' in capsys.readouterr().out
+        assert daemon.handle({'command': 'status'})['cookies_valid'] is False
+
+    @staticmethod
+    def test_refresh_cookies_logs_in_again(daemon, capsys):
+        daemon.mealpal = mock.Mock(spec=mealpy.MealPal)
+        daemon.mealpal.session = mock.Mock()
+        daemon.mealpal.validate_cookies.return_value = False
+        credentials = mealpy.Credentials('email', 'password', 'env')
+
+        with mock.patch.object(mealpy, 'get_mealpal_credentials', return_value=credentials) as mock_credentials:
+            daemon.refresh_cookies()
+
+        mock_credentials.assert_called_once_with(interactive=False)
+        daemon.mealpal.login.assert_called_once_with('email', 'password')
+        assert daemon.cookies_valid
+        assert daemon.cookies_path.with_name(mealpy.COOKIES_VALIDATED_FILENAME).exists()
+        assert 'logged in again' in capsys.readouterr().out
+
+    @staticmethod
+    def test_run_until_stopped(daemon):
+        thread = threading.Thread(target=daemon.run)
+        thread.start()
+        while not daemon.socket_path.exists():
+            time.sleep(0.01)
+
+        status = mealpy.send_daemon_command('status', socket_path=daemon.socket_path)
+        assert status['next_wake_up']
+        mealpy.send_daemon_command('stop', socket_path=daemon.socket_path)
+
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert not daemon.socket_path.exists()
+
+    @staticmethod
+    def test_cli_not_running(tmp_path):
+        with mock.patch.object(mealpy, 'get_cache_dir', return_value=tmp_path):
+            result = CliRunner().invoke(mealpy.cli, ['daemon', 'list'])
+
+        assert result.exit_code == 1
+        assert 'not running' in result.output
@@ -0,0 +1,178 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import responses
+
+from mealpy import mealpy
+from mealpy import ratelimit
+from mealpy import standin
+
+NOW = 1000000.0
+
+
+@pytest.fixture
+def standin_mealpal():
+    with standin.StandInMealPal() as _standin_mealpal:
+        yield _standin_mealpal
+
+
+@pytest.mark.parametrize('url, endpoint', [
+    (mealpy.RESERVATION_URL, 'reservation'),
+    (mealpy.MENU_URL.format('mock_city_id'), 'menu'),
+    ('http://127.0.0.1:8080' + mealpy.LOGIN_PATH, 'login'),
+    (mealpy.BASE_URL, None),
+    (mealpy.RESERVATION_URL + '/mock_id', None),
+])
+def test_endpoint_name(url, endpoint):
+    assert ratelimit.endpoint_name(url) == endpoint
+
+
+def test_parse_retry_after():
+    assert ratelimit.parse_retry_after('2') == 2.0
+    assert ratelimit.parse_retry_after('Thu, 01 Jan 1970 00:00:10 GMT', now=4.0) == 6.0
+    assert ratelimit.parse_retry_after('Thu, 01 Jan 1970 00:00:10 GMT', now=20.0) == 0.0
+    assert ratelimit.parse_retry_after('soon') is None
+    assert ratelimit.parse_retry_after(None) is None
+
+
+def test_burst_then_rate():
+    buckets = ratelimit.TokenBuckets({'reservation': mealpy.RateLimit(10.0, 3)})
+
+    assert [buckets.reserve('reservation', now=NOW) for _ in range(5)] == pytest.approx([0, 0, 0, 0.1, 0.2])
+    assert buckets.reserve('reservation', now=NOW + 1) == 0
+    assert buckets.reserve('menu', now=NOW) == 0
+
+
+def test_no_rate_is_unlimited():
+    buckets = ratelimit.TokenBuckets({'reservation': mealpy.RateLimit(0, 1)})
+
+    assert all(buckets.reserve('reservation', now=NOW) == 0 for _ in range(100))
+
+
+def test_hold_off():
+    buckets = ratelimit.TokenBuckets({'reservation': mealpy.RateLimit(10.0, 3)})
+    buckets.reserve('reservation', now=NOW)
+
+    buckets.hold_off('reservation', 2.0, now=NOW)
+
+    assert buckets.reserve('reservation', now=NOW + 1) == pytest.approx(1.1)
+    assert buckets.reserve('reservation', now=NOW + 1) == pytest.approx(1.2)
+
+
+def test_shared_file(tmp_path):
+    limits = {'reservation': mealpy.RateLimit(10.0, 10)}
+    buckets = [ratelimit.TokenBuckets(limits, tmp_path / 'rate_limits.json') for _ in range(4)]
+    waits = []
+
+    def reserve(bucket):
+        for _ in range(5):
+            waits.append(bucket.reserve('reservation', now=NOW))
+
+    threads = [threading.Thread(target=reserve, args=(i,)) for i in buckets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(waits) == pytest.approx([0] * 10 + [i / 10 for i in range(1, 11)])
+
+
+def test_shared_between_processes(tmp_path):
+    path = tmp_path / 'rate_limits.json'
+    subprocess.run(
+        [
+            sys.executable, '-c',
+            'import sys\n'
+            'from mealpy import mealpy, ratelimit\n'
+            'buckets = ratelimit.TokenBuckets({"reservation": mealpy.RateLimit(1.0, 2)}, sys.argv[1])\n'
+            f'buckets.reserve("reservation", now={NOW})\n',
+            str(path),
+        ],
+        check=True,
+        cwd=mealpy.ROOT_DIR,
+    )
+
+    buckets = ratelimit.TokenBuckets({'reservation': mealpy.RateLimit(1.0, 2)}, path)
+    assert buckets.reserve('reservation', now=NOW) == 0
+    assert buckets.reserve('reservation', now=NOW) == pytest.approx(1.0)
+
+
+def test_429_holds_off():
+    mealpal = mealpy.MealPal(rate_limits={'reservation': mealpy.RateLimit(10.0, 3)})
+
+    with responses.RequestsMock() as mock_responses:
+        mock_responses.add(
+            responses.RequestsMock.POST, mealpy.RESERVATION_URL, status=429, headers={'Retry-After': '5'},
+        )
+        assert mealpal.fire({'schedule_id': 'mock_schedule_id'}) == 429
+
+    assert mealpal.rate_limits.reserve('reservation') == pytest.approx(5.1, abs=0.05)
+
+
+def test_429_without_retry_after():
+    mealpal = mealpy.MealPal(rate_limits={'reservation': mealpy.RateLimit(10.0, 3)})
+
+    with responses.RequestsMock() as mock_responses:
+        mock_responses.add(responses.RequestsMock.POST, mealpy.RESERVATION_URL, status=429)
+        mealpal.fire({'schedule_id': 'mock_schedule_id'})
+
+    assert mealpal.rate_limits.reserve('reservation') == pytest.approx(ratelimit.DEFAULT_RETRY_AFTER + 0.1, abs=0.05)
+
+
+def test_retry_after_capped():
+    mealpal = mealpy.MealPal(rate_limits={'reservation': mealpy.RateLimit(10.0, 3)})
+
+    with responses.RequestsMock() as mock_responses:
+        mock_responses.add(
+            responses.RequestsMock.POST, mealpy.RESERVATION_URL, status=503, headers={'Retry-After': '3600'},
+        )
+        mealpal.fire({'schedule_id': 'mock_schedule_id'})
+
+    assert mealpal.rate_limits.reserve('reservation') == pytest.approx(ratelimit.MAX_RETRY_AFTER + 0.1, abs=0.05)
+
+
+def test_fire_until_success_throttled(standin_mealpal):
+    mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url, rate_limits={'reservation': mealpy.RateLimit(50.0, 1)})
+    mealpal.login('username', 'password')
+    reserve_data = mealpal.prepare_reservation('12:15pm-12:30pm', 'San Francisco', meal_name='Spam and Eggs')
+    reservations = [{'schedule_id': 'unknown'}] * 5 + [reserve_data]
+
+    start = time.perf_counter()
+    assert mealpy.fire_until_success(mealpal, reservations) == reserve_data
+
+    assert time.perf_counter() - start >= 5 / 50
+    received_at = [i.received_at for i in standin_mealpal.attempts]
+    assert min(b - a for a, b in zip(received_at, received_at[1:])) > 0.015
+
+
+def test_burst_fire_throttled(standin_mealpal):
+    mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url, rate_limits={'reservation': mealpy.RateLimit(10.0, 1)})
+    mealpal.reserve_data = {'schedule_id': 'unknown'}
+
+    results = mealpy.burst_fire(mealpal, time.time(), 3, interval=0)
+
+    assert [i.status_code for i in results] == [400] * 3
+    received_at = sorted(i.received_at for i in standin_mealpal.attempts)
+    assert received_at[-1] - received_at[0] > 0.15
+
+
+def test_shared_by_accounts(tmp_path):
+    limits = {'reservation': mealpy.RateLimit(1.0, 1)}
+    first, second = (mealpy.MealPal(cache_dir=tmp_path, rate_limits=limits) for _ in range(2))
+
+    assert first.rate_limits.reserve('reservation', now=NOW) == 0
+    assert second.rate_limits.reserve('reservation', now=NOW) == pytest.approx(1.0)
+    assert (tmp_path / mealpy.RATE_LIMITS_FILENAME).exists()
+
+
+def test_get_rate_limits():
+    config = {'rate_limits': {'reservation': {'rate': 5.0}, 'menu': {'rate': 1.0, 'burst': 3}}}
+
+    assert mealpy.get_rate_limits({}) == mealpy.DEFAULT_RATE_LIMITS
+    assert mealpy.get_rate_limits(config) == {
+        'reservation': mealpy.RateLimit(5.0, mealpy.DEFAULT_RATE_LIMITS['reservation'].burst),
+        'menu': mealpy.RateLimit(1.0, 3),
+    }
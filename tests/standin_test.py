@@ -0,0 +1,133 @@
+import time
+
+import pytest
+import requests
+
+from mealpy import mealpy
+from mealpy import standin
+
+
+@pytest.fixture
+def standin_mealpal():
+    with standin.StandInMealPal() as _standin_mealpal:
+        yield _standin_mealpal
+
+
+def test_reserve_meal(standin_mealpal):
+    mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+
+    assert mealpal.login('username', 'password') == 200
+    assert mealpal.reserve_meal('12:15pm-12:30pm', 'San Francisco', meal_name='Spam and Eggs') == 200
+    assert standin_mealpal.reservations == [{
+        'quantity': '1',
+        'schedule_id': 'standin_schedule_1',
+        'pickup_time': '12:15pm-12:30pm',
+        'source': 'Web',
+    }]
+
+
+def test_reserve_unknown_schedule(standin_mealpal):
+    mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+
+    assert mealpal.fire({'schedule_id': 'unknown'}) == 400
+    assert not standin_mealpal.reservations
+
+
+def test_unknown_paths(standin_mealpal):
+    mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+
+    assert mealpal.session.get(standin_mealpal.base_url + '/unknown').status_code == 404
+    assert mealpal.session.post(standin_mealpal.base_url + '/unknown').status_code == 404
+    assert mealpal.session.get(standin_mealpal.base_url + mealpy.MENU_PATH.format('unknown')).status_code == 404
+    assert mealpal.session.head(standin_mealpal.base_url).headers['Date']
+
+
+def test_login_fail(standin_mealpal):
+    mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+
+    with pytest.raises(requests.HTTPError):
+        mealpal.login('username', '')
+
+
+def test_open_at():
+    with standin.StandInMealPal(open_at=time.time() + 0.1) as standin_mealpal:
+        mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+
+        assert mealpal.fire({'schedule_id': 'standin_schedule_1'}) == 400
+        time.sleep(0.1)
+        assert mealpal.fire({'schedule_id': 'standin_schedule_1'}) == 200
+
+    assert standin_mealpal.reserved_at[0] >= standin_mealpal.open_at
+
+
+def test_latency():
+    with standin.StandInMealPal(latency=0.1) as standin_mealpal:
+        mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+
+        start = time.perf_counter()
+        mealpal.fire({'schedule_id': 'standin_schedule_1'})
+
+    assert time.perf_counter() - start >= 0.1
+
+
+def test_quantity():
+    with standin.StandInMealPal(quantity=1) as standin_mealpal:
+        standin_mealpal.remaining['standin_schedule_2'] = 2
+        mealpal = mealpy.MealPal(base_url=standin_mealpal.base_url)
+
+        assert mealpal.fire({'schedule_id': 'standin_schedule_1'}) == 200
+        assert mealpal.fire({'schedule_id': 'standin_schedule_1'}) == 400
+        assert standin_mealpal.sold_out('standin_schedule_1')
+        assert not standin_mealpal.sold_out()
+        assert mealpal.fire({'schedule_id': 'standin_schedule_2'}) == 200
+        assert mealpal.fire({'schedule_id': 'standin_schedule_2'}) == 200
+
+    assert standin_mealpal.sold_out()
+    assert len(standin_mealpal.reservations) == 3
+    assert [i.error for i in standin_mealpal.attempts] == [None, 'ERROR_SOLD_OUT', None, None]
+
+
+def test_attempts_sessions(standin_mealpal):
+    alice = mealpy.MealPal(base_url=standin_mealpal.base_url)
+    alice.login('alice', 'password')
+    bob = mealpy.MealPal(base_url=standin_mealpal.base_url)
+    bob.login('bob', 'password')
+
+    bob.fire({'schedule_id': 'standin_schedule_1'})
+    alice.fire({'schedule_id': 'unknown'})
+    bob.fire({'schedule_id': 'standin_schedule_2'})
+    mealpy.MealPal(base_url=standin_mealpal.base_url).fire({'schedule_id': 'standin_schedule_1'})
+
+    assert [(i.session, i.schedule_id, i.error) for i in standin_mealpal.attempts] == [
+        ('r:bob', 'standin_schedule_1', None),
+        ('r:alice', 'unknown', 'ERROR_SCHEDULE_NOT_FOUND'),
+        ('r:bob', 'standin_schedule_2', 'ERROR_ALREADY_RESERVED'),
+        (None, 'standin_schedule_1', None),
+    ]
+
+
+def test_menu_conditional_requests(standin_mealpal):
+    url = standin_mealpal.base_url + mealpy.MENU_PATH.format('standin_sf_object_id')
+    response = requests.get(url)
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+
+    assert requests.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert requests.get(url, headers={'If-None-Match': '"other"'}).status_code == 200
+    assert requests.get(url, headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert requests.get(url, headers={'If-Modified-Since': 'Mon, 01 Apr 2019 00:00:00 GMT'}).status_code == 200
+
+    standin_mealpal.menus['standin_sf_object_id'] = standin_mealpal.menus['standin_sf_object_id'][:1]
+
+    assert requests.get(url, headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_gzip(standin_mealpal):
+    url = standin_mealpal.base_url + mealpy.MENU_PATH.format('standin_sf_object_id')
+
+    compressed = requests.get(url, headers={'Accept-Encoding': 'gzip'})
+    identity = requests.get(url, headers={'Accept-Encoding': 'identity'})
+
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in identity.headers
+    assert compressed.json() == identity.json()
+    assert int(compressed.headers['Content-Length']) < int(identity.headers['Content-Length'])
@@ -0,0 +1,13 @@
+from benchmarks import startup
+
+
+def test_heavy_imports_deferred():
+    imported = {i.split('.')[0] for i in startup.import_times()}
+
+    assert not imported & startup.DEFERRED_PACKAGES
+
+
+def test_import_within_budget():
+    baseline = startup.measure_import(runs=3, module='click')
+
+    assert startup.measure_import(runs=3) < startup.STARTUP_BUDGET_RATIO * baseline